@@ -1,80 +1,75 @@
 import time
 import os
+import sys
+import json
+import yaml
 import serial
 import argparse
 
+# settings parser is shared with the lens tester GUI
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "03_lens_tester_gui"))
+import streaming
+import grbl_settings
+
 parser = argparse.ArgumentParser(description='Read parameters from the SCE2 controller', usage='%(prog)s -p COM20 -l L086.txt')
 parser.add_argument('-p', '--port', help='COM port', required=True, type=str)
 parser.add_argument('-l', '--lens', help='Parameter file for particular lens', required=True, type=str)
 parser.add_argument('-d', '--delay', help='Delay to sleep between each sent parameter line', default=0.001, type=float)
+parser.add_argument('-f', '--format', help='Output format, default by file extension (.json, .yaml), otherwise txt', choices=['txt', 'json', 'yaml'], default=None)
+parser.add_argument('-t', '--timeout', help='Timeout for a reply, s', default=1, type=float)
 args = parser.parse_args()
 
 ser = serial.Serial()
 ser.port = args.port
 ser.baudrate = 115200
-ser.timeout = 1
+ser.timeout = args.timeout
 ser.open()
 ser.flushInput()
 ser.flushOutput()
 
+start = time.time()
 
-ser.write(bytes("$$\r", 'utf8'))
+# All three queries are sent at once, each section ends with its ok, so
+# reading stops as soon as the last ok arrives instead of waiting for timeout
+names = ["motion", "init", "SN"]
+print("Reading " + ", ".join(names) + " parameters...")
+ser.write(bytes("".join(q+"\n" for q in grbl_settings.QUERIES), 'utf8'))
 time.sleep(args.delay)
-data1 = ""
-print("Reading motion parameters...")
-while(1):
-	packet = ser.read(10).decode("utf-8")
-	if len(packet)==0:
-		break
-	data1 += packet
-print(data1)
-
-
-ser.write(bytes("$N\r", 'utf8'))
-time.sleep(args.delay)
-data2 = ""
-print("Reading init parameters...")
-while(1):
-	packet = ser.read(10).decode("utf-8")
-	if len(packet)==0:
-		break
-	data2 += packet
-print(data2)
-
-
-ser.write(bytes("$I\r", 'utf8'))
-time.sleep(args.delay)
-data3 = ""
-print("Reading SN parameters...")
-while(1):
-	packet = ser.read(10).decode("utf-8")
-	if len(packet)==0:
-		break
-	data3 += packet
-print(data3)
-
-
-
-
-
-data_out = []
-
-for line in data1.split("\n"):
-	if line.strip() not in ["ok", ""]:
-		data_out.append(line)
-
-for line in data2.split("\n"):
-	if line.strip() not in ["ok", ""]:
-		data_out.append(line)
-
-for line in data3.split("\n"):
-	if "VER" in line:
-		temp1 = line.replace("[","").replace("]","").split(":")[-1]
-		data_out.append("$I="+temp1)
-
-
 
+sections = []
+data = []
+while len(sections) < len(grbl_settings.QUERIES):
+	packet = ser.readline().decode("utf-8").strip()
+	if len(packet) == 0:
+		print("Timeout, no reply to "+grbl_settings.QUERIES[len(sections)])
+		sys.exit(1)
+	if streaming.is_reply(packet):
+		if packet != "ok":
+			print(grbl_settings.QUERIES[len(sections)]+" -> "+packet)
+		sections.append(data)
+		data = []
+	elif len(packet):
+		data.append(packet)
+ser.close()
+
+for name, data in zip(names, sections):
+	print(name+":")
+	print("\n".join(data))
+print("Read in", round(time.time() - start, 3), "s")
+
+settings = grbl_settings.parse_settings(sum(sections, []))
+
+out_format = args.format
+if out_format is None:
+	ext = os.path.splitext(args.lens)[1].lower()
+	out_format = {".json": "json", ".yaml": "yaml", ".yml": "yaml"}.get(ext, "txt")
 
 f = open(args.lens, "w")
-for i in data_out:
-	f.write(i)
+if out_format == "json":
+	json.dump(grbl_settings.to_typed(settings), f, indent=2)
+elif out_format == "yaml":
+	yaml.dump(grbl_settings.to_typed(settings), f, sort_keys=False)
+else:
+	for key, value in settings.items():
+		f.write(key+"="+value+"\n")
+f.close()
@@ -1,32 +1,116 @@
 import time
 import os
+import sys
 from tqdm import tqdm
 import serial
 import argparse
 
+# character counting is shared with the lens tester GUI
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "03_lens_tester_gui"))
+import streaming
+import grbl_settings
+
 parser = argparse.ArgumentParser(description='Send parameters to SCE2 controller', usage='%(prog)s -p COM20 -l L086.txt')
 parser.add_argument('-p', '--port', help='COM port', required=True, type=str)
 parser.add_argument('-l', '--lens', help='Parameter file for particular lens', required=True, type=str)
 parser.add_argument('-d', '--delay', help='Delay to sleep between each sent parameter line', default=0.001, type=float)
+parser.add_argument('-b', '--buffer', help='Controller RX buffer size, bytes in flight are kept below it', default=streaming.RX_BUFFER_SIZE, type=int)
+parser.add_argument('-s', '--single', help='Wait for ok after every line, $x= EEPROM writes always wait', action='store_true')
+parser.add_argument('-t', '--timeout', help='Timeout for a reply, s', default=2, type=float)
+parser.add_argument('--sync', help='Read controller settings first, write only parameters that differ', action='store_true')
+parser.add_argument('-n', '--dry-run', help='Only print differences between controller and parameter file', action='store_true')
 args = parser.parse_args()
 
 ser = serial.Serial()
 ser.port = args.port
 ser.baudrate = 115200
-ser.timeout = 1
+ser.timeout = args.timeout
 ser.open()
 ser.flushInput()
 ser.flushOutput()
 
 f = open(args.lens, "r")
+content = [l.strip() for l in f.readlines()]
+f.close()
+content = [l for l in content if len(l) and not l.startswith(";")]
+
+
+def query(line):
+	# lines controller sends before ok
+	ser.write(bytes(line+"\n", 'utf8'))
+	ret = []
+	while True:
+		packet = ser.readline().decode("utf-8").strip()
+		if len(packet) == 0:
+			raise TimeoutError(line+" -> no reply")
+		if streaming.is_reply(packet):
+			if packet != "ok":
+				raise streaming.CommandError(line, packet)
+			return ret
+		ret.append(packet)
+
+
+# Every $x= write goes to controller EEPROM, in sync mode only changed keys are written
+if args.sync or args.dry_run:
+	changes = grbl_settings.diff(grbl_settings.read_controller(query), grbl_settings.parse_settings(content))
+	for key, old, new in changes:
+		print(key.ljust(5), str(old).rjust(20), "->", new)
+	print(len(changes), "of", len(content), "parameters differ")
+	if args.dry_run:
+		ser.close()
+		sys.exit(0)
+	content = grbl_settings.to_lines(changes)
+
+# GRBL drops RX bytes while it writes EEPROM, so a $x= line is sent alone
+# and nothing follows it before its ok. Other lines ($I, G-code) are
+# pipelined: as many as fit into RX buffer are written before waiting, every
+# ok/error:N is matched to its line in the order they were sent
+counter = streaming.CharacterCounter(args.buffer)
+failed = []
+sent = 0
+start = time.time()
+
+
+def can_send(line):
+	if not counter.fits(line+"\n"):
+		return False
+	if not len(counter):
+		return True
+	return not (args.single or grbl_settings.is_write(line) or grbl_settings.is_write(counter.peek()))
+
+
+with tqdm(total=len(content)) as progress:
+	while progress.n < len(content):
+		if sent < len(content) and can_send(content[sent]):
+			counter.push(content[sent]+"\n", content[sent])
+			ser.write(bytes(content[sent]+"\n", 'utf8'))
+			sent += 1
+			if args.delay:
+				time.sleep(args.delay)
+			if not ser.in_waiting:
+				continue
+
+		packet = ser.readline().decode("utf-8").strip()
+		if len(packet) == 0:
+			for line in counter.clear():
+				failed.append((line, "timeout"))
+			progress.update(len(content) - progress.n)
+			break
+		if not streaming.is_reply(packet):
+			continue
+
+		_, line = counter.pop()
+		if packet != "ok":
+			failed.append((line, packet))
+		progress.update(1)
 
-content = f.readlines()
-for i in tqdm(content):
-	#time.sleep(args.delay)
-	#print(i.strip())
-	ser.flushInput()
-	ser.flushOutput()
-	ser.write(bytes(i.strip()+"\r", 'utf8'))
-	packet = ser.read(2).decode("utf-8")
+ser.close()
 
-	
\ No newline at end of file
+print("Sent", sent, "parameter lines in", round(time.time() - start, 3), "s")
+if len(failed):
+	print("Failed parameters:")
+	for line, reply in failed:
+		print("  "+line+" -> "+reply)
+	if sent < len(content):
+		print("Not sent:", len(content) - sent, "lines")
+	sys.exit(1)
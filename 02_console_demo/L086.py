@@ -38,19 +38,14 @@ grbl_utils.send_command(ser, "G90 G1 A0.3 F1")    # ON (Visible light)
 #grbl_utils.send_command(ser, "G90 G1 A0.7 F1")  # OFF (Full spectrum)
 
 
-# Move out of home position X axis, move in small steps. 
+# Move out of home position, all axes inside home sensor with one move.
 # 1.1f-SCE2.20211130 can't perform precision homing procedure unless motors 
 # are moved out of home position. Later should be implemented in firmware
 # and this step will not be needed
-grbl_utils.unhome_motors(ser, "X")
-grbl_utils.unhome_motors(ser, "Y")
-grbl_utils.unhome_motors(ser, "Z")
-
-
-# home motors
-grbl_utils.send_command(ser, "$HX") 
-grbl_utils.send_command(ser, "$HY") 
-grbl_utils.send_command(ser, "$HZ") 
+# Then home motors with firmware homing cycle ($H), axes at the same time.
+# Firmware without one is homed $H<axis> one after another, together=False
+# forces that
+grbl_utils.home_all(ser, "XYZ")
 
 
 
@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import asyncio
+
+# asyncio client lives next to the lens tester GUI
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "03_lens_tester_gui"))
+import grbl_async
+import grbl_utils
+
+
+# Same sequence as L086.py, but every lens given on command line runs it at
+# the same time from one event loop and moves are chained without sleeps:
+#   python L086_async.py COM20 COM21 COM22
+PORTS = sys.argv[1:] or ['COM20']
+
+
+async def run_lens(port):
+    async with grbl_async.GrblClient(port) as lens:
+        t0 = time.time()
+
+        # Read controller version strings
+        ver = await lens.query("$I")
+        grbl_utils.parse_version(ver[0])
+        for line in ver:
+            if line.startswith("[TLENS:"):
+                grbl_utils.parse_adc(line)
+
+        # Switch to ABS positionig mode, limit sensor LED ON, IRIS open, IR CUT filter ON
+        # Lines are streamed back to back, only last one is waited for
+        lens.send("G90")
+        lens.send("M120 P1")
+        lens.send("M114 P1")
+        await lens.send("G90 G1 A0.3 F1")
+
+        # Move out of home position and home motors, see grbl_utils.home_all
+        timing = await lens.home_all("XYZ")
+        await lens.command("G90")
+        print(port, "homed in", round(timing["total"], 2), "s")
+
+        # Move wide and narrow angles, each move waits until motors stop
+        await lens.send("G90 G1 X-8.2 Y-5.1 Z-2.6 F1000")
+        await lens.send("G90 G1 X-7.2 Y-5.9 Z-2.98 F1000")
+        await lens.send("G90 G1 X-0.5 Y-5.6 Z-0.7 F1000")
+        await lens.send("G90 G1 X2.3 Y-5.6 Z0.24 F1000")
+
+        status = await lens.status()
+        print(port, status, "in", round(time.time() - t0, 2), "s")
+
+
+async def main():
+    results = await asyncio.gather(*[run_lens(p) for p in PORTS], return_exceptions=True)
+    for port, r in zip(PORTS, results):
+        if isinstance(r, Exception):
+            print(port, "failed:", r)
+
+
+asyncio.run(main())
@@ -1,71 +1,85 @@
-import serial
+import os
+import sys
 import time
-import inspect
 
+UNHOME_DISTANCE = 10    # longest way out of a home sensor, mm
+UNHOME_SPEED = 1000     # mm/min
+POLL_INTERVAL = 0.01    # status poll period while waiting for pins to clear, s
+JOG_CANCEL = b"\x85"
 
-class Status():
-    status = str
+# status parser is shared with the lens tester GUI
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "03_lens_tester_gui"))
+import grbl_parser
 
-    limit_x = bool
-    limit_y = bool
-    limit_z = bool
-    limit_a = bool
 
-    pos_x = float
-    pos_y = float
-    pos_z = float
-    pos_a = float
+# Status reports and command responses can arrive interleaved. Whatever is
+# read while waiting for the other kind of line is kept here for the next
+# read instead of being thrown away with flushInput().
+_backlog = {}
 
-    block_buffer_avail = int
-    rx_buffer_avail = int
-    
 
+def read_line(ser, status=False):
+    backlog = _backlog.setdefault(id(ser), {True: [], False: []})
+    if backlog[status]:
+        return backlog[status].pop(0)
 
-def send_command(ser, cmd, echo=True, expecting_lines=1, flush=True):    
+    while True:
+        line = ser.readline().decode('utf-8').strip()
+        if len(line) == 0:
+            return line     # timeout
+
+        is_status = (line[0] == "<") and (line[-1] == ">")
+        if is_status == status:
+            return line
+        backlog[is_status].append(line)
+
+
+def send_command(ser, cmd, echo=True, expecting_lines=1, flush=False):    
     if flush:
         ser.flushInput()
+        _backlog.pop(id(ser), None)
 
     ser.write(bytes(cmd+"\n", 'utf8'))
     if echo:
         print("")
         print("> "+cmd)
 
-    if expecting_lines == 1:
-        data_in = ser.readline().decode('utf-8').strip()
+    # read everything up to ok/error:N, otherwise leftover lines would be
+    # taken as response to the next command
+    ret = []
+    while True:
+        data_in = read_line(ser)
         if echo:
             print("< "+data_in)
-        return data_in
+        ret.append(data_in)
+        if (len(data_in) == 0) or (data_in == "ok") or data_in.startswith("error"):
+            break
 
+    if expecting_lines == 1:
+        return ret[0]
 
-    if expecting_lines > 1:
-        ret = []
-        for i in range(expecting_lines):
-            data_in = ser.readline().decode('utf-8').strip()
-            if echo:
-                print("< "+data_in)
-            ret.append(data_in)            
-        return ret
+    while len(ret) < expecting_lines:
+        ret.append("")
+    return ret[:expecting_lines]
 
 
 def read_status(ser, echo=True):
-    retry_cnt = 0
-    ret = ""
-    backup_timeout = ser.timeout
-    ser.timeout = 0.5
     if echo:
         print("")
         print("> ?")
 
-    while True:
-        status = send_command(ser, "?", echo=False)
-        if len(status) > 10:
-            if (status[0] == "<") and (status[-1] == ">"):
-                ret = status
-                if retry_cnt > 0:
-                    if echo:
-                        print("* Retry count", retry_cnt)            
-                break
-            retry_cnt+=1
+    # only report requested now is of interest
+    _backlog.setdefault(id(ser), {True: [], False: []})[True].clear()
+
+    backup_timeout = ser.timeout
+    ser.timeout = 0.5
+
+    # "?" is realtime command, sent without newline so no "ok" comes back.
+    # Ask again only if report did not come at all.
+    ret = ""
+    while len(ret) == 0:
+        ser.write(b"?")
+        ret = read_line(ser, status=True)
 
     ser.timeout = backup_timeout
     return ret
@@ -84,44 +98,16 @@ def wait_for_idle(ser, echo=True):
 def parse_status(txt, echo=True, print_debug=False):
     # Assume string is formed like this (some portions might be missing):
     # <Idle|MPos:0.000,0.000,0.000,0.000|Bf:35,254|F:0|Pn:XYZR|WCO:0.000,0.000,0.000,0.000|Ov:100,100,100|A:S>
-    txt = txt.replace('<', '').replace('>', '')
-    txt_list = txt.split("|")
-
     if echo:
-        print(txt_list)
-
-    s = Status()
-    s.status = txt_list[0] # allways first element
+        print(txt.strip()[1:-1].split("|"))
 
-    for p in txt_list[1:]:
-        #print("* ", p)
-
-        if p[0:2] == "Bf":
-           temp1 = p.split(":")[1]
-           s.block_buffer_avail = int(temp1.split(",")[0])
-           s.rx_buffer_avail = int(temp1.split(",")[1])
-
-        if p[0:2] == "Pn":
-            temp1 = p.split(":")[1]
-            s.limit_x = "X" in temp1
-            s.limit_y = "Y" in temp1
-            s.limit_z = "Z" in temp1
-
-        if p[0:4] == "MPos":
-            temp1 = p.split(":")[1]
-            s.pos_x = float(temp1.split(",")[0])
-            s.pos_y = float(temp1.split(",")[1])
-            s.pos_z = float(temp1.split(",")[2])
-            s.pos_a = float(temp1.split(",")[3])
+    s = grbl_parser.parse_status(txt)
 
     # print all elements for debug
     if print_debug:
-        for i in inspect.getmembers(s):
-            if not i[0].startswith('_'):
-                if not inspect.ismethod(i[1]): 
-                    print(i)
+        for name in grbl_parser.FIELDS:
+            print((name, getattr(s, name)))
 
-    # TODO: print unparsed sub-strings
     return s
 
 
@@ -176,9 +162,87 @@ def unhome_motors(ser, axis, step=1, speed=1000):
             axis_status = status.limit_a
                 
         if axis_status:
-            cmd = "G91 G"+str(step)+" "+axis+"1 F"+str(speed)
+            cmd = "G91 G1 "+axis+str(step)+" F"+str(speed)
             send_command(ser, cmd, echo=False)
             wait_for_idle(ser, echo=False)
         else:
             break
 
+
+def unhome_axes(ser, axes="XYZ", distance=UNHOME_DISTANCE, speed=UNHOME_SPEED):
+    # Moves every axis whose home sensor is active (Pn) out of it with one
+    # jog of all of them together. Pins are watched while it runs and the
+    # jog is cancelled as soon as one of them clears, the ones still inside
+    # continue with a new jog, so an axis overshoots the sensor edge by one
+    # poll at most. Returns {axis: seconds until its sensor cleared}.
+    t0 = time.time()
+    ret = {}
+    status = parse_status(read_status(ser, echo=False), echo=False)
+    inside = [a for a in axes.upper() if a in status.pins]
+    if inside:
+        print("* Moving out of home position:", "".join(inside))
+
+    while inside:
+        cmd = "$J=G91 "+" ".join(a+str(distance) for a in inside)+" F"+str(speed)
+        send_command(ser, cmd, echo=False)
+
+        while True:
+            status = parse_status(read_status(ser, echo=False), echo=False)
+            left = [a for a in inside if a in status.pins]
+            if left != inside:
+                break
+            if status.status == "Idle":
+                raise RuntimeError("Axis "+"".join(left)+" still in home sensor after "+str(distance)+" mm")
+            time.sleep(POLL_INTERVAL)
+
+        for a in inside:
+            if a not in left:
+                ret[a] = time.time() - t0
+
+        # cancel is ignored when jog is already over
+        ser.write(JOG_CANCEL)
+        wait_for_idle(ser, echo=False)
+        inside = left
+
+    return ret
+
+
+def home_command(ser, cmd):
+    reply = send_command(ser, cmd, echo=False)
+    if reply != "ok":
+        raise RuntimeError(cmd+" -> "+reply)
+
+
+def home_all(ser, axes="XYZ", together=True):
+    # Cold start: unhome_axes(), then homing. together=True sends plain $H,
+    # firmware homing cycle which moves its axes at the same time. When
+    # firmware rejects it, or with together=False for firmware whose cycle
+    # does not cover the axes given, $H<axis> one after another, firmware
+    # answers ok only when axis is homed.
+    # Returns {axis: {"unhome": s, "home": s}, "total": s}
+    t0 = time.time()
+    ret = {a: {"unhome": 0.0} for a in axes.upper()}
+    for a, t in unhome_axes(ser, axes).items():
+        ret[a]["unhome"] = t
+
+    t_home = time.time()
+    if together:
+        try:
+            home_command(ser, "$H")
+        except RuntimeError as e:
+            print("* "+str(e)+", homing axes one by one")
+            together = False
+    if together:
+        for a in axes.upper():
+            ret[a]["home"] = time.time() - t_home
+    else:
+        for a in axes.upper():
+            t = time.time()
+            home_command(ser, "$H"+a)
+            ret[a]["home"] = time.time() - t
+    ret["total"] = time.time() - t0
+
+    for a in axes.upper():
+        print("* "+a+" unhome", round(ret[a]["unhome"], 2), "s, home", round(ret[a]["home"], 2), "s")
+    print("* Homing done in", round(ret["total"], 2), "s")
+    return ret
@@ -0,0 +1,380 @@
+import os
+import math
+import time
+import collections
+import numpy as np
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+
+# Contrast autofocus. Focus axis is moved, a frame is taken at every stop and
+# scored by a sharpness metric, the search keeps the number of stops low:
+#
+#   focus = autofocus.SerialCommFocus(hw, "Z")
+#   source = autofocus.SyntheticSource(focus.position, best=1.3)
+#   r = autofocus.autofocus(focus, source, center=1.0, window=1.0)
+#   print(r.position, r.moves, r.elapsed)
+#
+# Search window is best taken around focus position the tracking curve
+# predicts for current zoom (tracking.py), a narrow window is what keeps it
+# fast. Frames are 2D numpy arrays, any camera can be a frame source with a
+# grab() method.
+
+TOLERANCE = 0.01        # search stops when bracket is narrower, mm
+COARSE_STEPS = 7        # positions of first coarse-to-fine level
+METHODS = ("golden", "coarse")
+SCAN_FEED = 120         # continuous scan sweep speed, mm/min
+SCAN_POLL_INTERVAL = 0.01   # status poll period during sweep, s
+SCAN_NEIGHBOURS = 3     # frames each side of the sharpest one the peak is fitted to
+GOLDEN = (math.sqrt(5) - 1) / 2
+
+Result = collections.namedtuple("Result", ["position", "score", "moves", "frames", "elapsed", "samples"])
+
+
+# ---------------------------------------------------------------------
+# sharpness metrics, higher is sharper
+
+def laplacian_variance(img):
+    img = np.asarray(img, dtype=np.float32)
+    lap = 4 * img[1:-1, 1:-1] - img[:-2, 1:-1] - img[2:, 1:-1] - img[1:-1, :-2] - img[1:-1, 2:]
+    return float(lap.var())
+
+
+def tenengrad(img):
+    # mean squared Sobel gradient
+    img = np.asarray(img, dtype=np.float32)
+    gx = (img[:-2, 2:] + 2 * img[1:-1, 2:] + img[2:, 2:]) - (img[:-2, :-2] + 2 * img[1:-1, :-2] + img[2:, :-2])
+    gy = (img[2:, :-2] + 2 * img[2:, 1:-1] + img[2:, 2:]) - (img[:-2, :-2] + 2 * img[:-2, 1:-1] + img[:-2, 2:])
+    return float(np.mean(gx * gx + gy * gy))
+
+
+METRICS = {
+    "laplacian": laplacian_variance,
+    "tenengrad": tenengrad,
+}
+
+
+def roi(img, fraction):
+    # centre part of the frame, fraction of width and height
+    if fraction >= 1:
+        return img
+    h, w = img.shape[:2]
+    dh, dw = int(h * (1 - fraction) / 2), int(w * (1 - fraction) / 2)
+    return img[dh:h - dh, dw:w - dw]
+
+
+# ---------------------------------------------------------------------
+# frame sources
+
+class SyntheticSource():
+    # Random texture blurred in proportion to distance from best focus, for
+    # testing without a camera. position: callable returning focus position.
+
+    def __init__(self, position, best=0.0, blur_per_mm=6.0, blur_min=0.6, noise=0.01, size=128, seed=1, fps=None):
+        # fps: grab() waits for next frame like a camera, None - at once
+        self.position = position
+        self.fps = fps
+        self.next_frame = 0
+        self.timestamp = None       # time.time() frame was taken at
+        self.best = best
+        self.blur_per_mm = blur_per_mm
+        self.blur_min = blur_min
+        self.noise = noise
+        rng = np.random.default_rng(seed)
+        self.rng = rng
+        texture = rng.random((size, size))
+        self.spectrum = np.fft.rfft2(texture)
+        fy = np.fft.fftfreq(size)[:, None]
+        fx = np.fft.rfftfreq(size)[None, :]
+        self.f2 = fx * fx + fy * fy
+
+    def blur(self, z):
+        # Gaussian sigma in pixels at focus position z
+        return self.blur_min + self.blur_per_mm * abs(z - self.best)
+
+    def grab(self):
+        if self.fps:
+            now = time.perf_counter()
+            if now < self.next_frame:
+                time.sleep(self.next_frame - now)
+            self.next_frame = max(self.next_frame, now) + 1 / self.fps
+        self.timestamp = time.time()
+        sigma = self.blur(self.position())
+        img = np.fft.irfft2(self.spectrum * np.exp(-2 * math.pi ** 2 * sigma ** 2 * self.f2))
+        if self.noise:
+            img += self.rng.normal(0, self.noise, img.shape)
+        return img
+
+
+def read_frame(filename):
+    # .npy array or binary PGM (P5), 8 or 16 bit
+    if filename.lower().endswith(".npy"):
+        return np.load(filename)
+    with open(filename, "rb") as f:
+        data = f.read()
+    fields = []
+    i = 0
+    while len(fields) < 4:
+        while data[i:i + 1].isspace():
+            i += 1
+        if data[i:i + 1] == b"#":
+            i = data.index(b"\n", i)
+            continue
+        j = i
+        while not data[j:j + 1].isspace():
+            j += 1
+        fields.append(data[i:j])
+        i = j
+    if fields[0] != b"P5":
+        raise ValueError(filename + ": only .npy and binary PGM frames are supported")
+    w, h, maxval = int(fields[1]), int(fields[2]), int(fields[3])
+    dtype = np.uint8 if maxval < 256 else np.dtype(">u2")
+    return np.frombuffer(data, dtype=dtype, offset=i + 1, count=w * h).reshape(h, w)
+
+
+class FileSequenceSource():
+    # Focus stack captured before, one file per focus position. grab() gives
+    # the frame taken closest to where focus is now.
+
+    def __init__(self, files, positions, position):
+        if len(files) != len(positions):
+            raise ValueError("One focus position per file is needed")
+        order = np.argsort(positions)
+        self.files = [files[i] for i in order]
+        self.positions = np.asarray(positions, dtype=float)[order]
+        self.position = position
+        self.frames = {}
+
+    @classmethod
+    def from_folder(cls, folder, position):
+        # files named by focus position: -1.250.npy, 0.300.pgm, ...
+        files, positions = [], []
+        for name in os.listdir(folder):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() not in (".npy", ".pgm"):
+                continue
+            try:
+                positions.append(float(stem))
+            except ValueError:
+                continue
+            files.append(os.path.join(folder, name))
+        return cls(files, positions, position)
+
+    def grab(self):
+        i = int(np.argmin(np.abs(self.positions - self.position())))
+        if i not in self.frames:
+            self.frames[i] = read_frame(self.files[i])
+        return self.frames[i]
+
+
+# ---------------------------------------------------------------------
+# focus axis
+
+class SerialCommFocus():
+    # focus axis through motion.SerialComm, move_to() returns when motors
+    # stopped (command done), position() is the last commanded position
+
+    def __init__(self, hw, axis="Z", feed=1000, timeout=10):
+        self.hw = hw
+        self.axis = axis.upper()
+        self.feed = feed
+        self.timeout = timeout
+        self.z = None
+        status = hw.last_status
+        if status is not None and status.mpos is not None:
+            self.z = status.mpos["XYZA".index(self.axis)]
+
+    def move_to(self, z):
+        self.hw.send("G90 G1 " + self.axis + "%.3f" % z + " F" + str(self.feed) + "\n").wait(self.timeout)
+        self.z = z
+
+    def position(self):
+        return self.z
+
+
+def focus_axis(lens):
+    # lens: config["lens"][name] -> "Z" for the axis whose function is Focus
+    for a in "XYZA":
+        if lens["motor"]["function"]["axis_" + a.lower()] == "Focus":
+            return a
+    return None
+
+
+# ---------------------------------------------------------------------
+# search
+
+class Sampler():
+    # moves and scores, every position is measured once
+
+    def __init__(self, focus, source, metric, roi_fraction, settle):
+        self.focus = focus
+        self.source = source
+        self.metric = METRICS[metric] if isinstance(metric, str) else metric
+        self.roi_fraction = roi_fraction
+        self.settle = settle
+        self.samples = {}
+        self.moves = 0
+        self.frames = 0
+
+    def __call__(self, z):
+        z = round(z, 3)
+        if z in self.samples:
+            return self.samples[z]
+        self.move(z)
+        if self.settle:
+            time.sleep(self.settle)
+        score = self.metric(roi(self.source.grab(), self.roi_fraction))
+        self.frames += 1
+        self.samples[z] = score
+        return score
+
+    def move(self, z):
+        self.focus.move_to(z)
+        self.moves += 1
+
+    def peak(self):
+        zs = sorted(self.samples)
+        return fit_peak(zs, [self.samples[z] for z in zs])
+
+
+def fit_peak(zs, scores, neighbours=1):
+    # best sample refined by parabola through it and its neighbours on both
+    # sides, zs ascending
+    zs = np.asarray(zs, dtype=float)
+    scores = np.asarray(scores, dtype=float)
+    i = int(np.argmax(scores))
+    if neighbours <= i < len(zs) - neighbours:
+        x = zs[i - neighbours:i + neighbours + 1]
+        y = scores[i - neighbours:i + neighbours + 1]
+        if x[-1] > x[0]:
+            a, b, c = np.polyfit(x, y, 2)
+            if a < 0:
+                z = -b / (2 * a)
+                if x[0] <= z <= x[-1]:
+                    return float(z)
+    return float(zs[i])
+
+
+def golden_search(sample, lo, hi, tolerance):
+    # one new position per step, bracket shrinks by 0.618
+    c = hi - GOLDEN * (hi - lo)
+    d = lo + GOLDEN * (hi - lo)
+    fc, fd = sample(c), sample(d)
+    while hi - lo > tolerance:
+        if fc > fd:
+            hi, d, fd = d, c, fc
+            c = hi - GOLDEN * (hi - lo)
+            fc = sample(c)
+        else:
+            lo, c, fc = c, d, fd
+            d = lo + GOLDEN * (hi - lo)
+            fd = sample(d)
+
+
+def coarse_to_fine(sample, lo, hi, tolerance, steps=COARSE_STEPS):
+    # even steps over bracket, then halving steps around the best one: best
+    # and its neighbours are measured already, two new positions per level
+    positions = np.linspace(lo, hi, steps)
+    step = positions[1] - positions[0]
+    scores = {z: sample(z) for z in positions}
+    best = max(scores, key=scores.get)
+    while step > tolerance:
+        step /= 2
+        for z in (best - step, best + step):
+            if lo <= z <= hi:
+                scores[z] = sample(z)
+        best = max(scores, key=scores.get)
+
+
+def autofocus(focus, source, center, window, method="golden", metric="tenengrad", tolerance=TOLERANCE,
+              roi_fraction=0.5, settle=0.0, limits=None):
+    # Searches center +- window, ends at the sharpest position.
+    # limits: (min, max) focus travel, window is clipped to it
+    if method not in METHODS:
+        raise ValueError("Unknown autofocus method " + str(method) + ", one of " + ", ".join(METHODS))
+    t0 = time.perf_counter()
+    lo, hi = center - window, center + window
+    if limits is not None:
+        lo, hi = max(lo, limits[0]), min(hi, limits[1])
+
+    sample = Sampler(focus, source, metric, roi_fraction, settle)
+    if method == "golden":
+        golden_search(sample, lo, hi, tolerance)
+    else:
+        coarse_to_fine(sample, lo, hi, tolerance)
+
+    z = round(sample.peak(), 3)
+    if focus.position() != z:
+        sample.move(z)
+    score = sample.metric(roi(source.grab(), roi_fraction))
+    elapsed = time.perf_counter() - t0
+    LOGGER.info("Autofocus " + method + " at " + str(z) + " in " + str(round(elapsed, 3)) + " s, " + str(sample.moves) + " moves")
+    return Result(z, score, sample.moves, sample.frames + 1, elapsed, dict(sample.samples))
+
+
+def scan_autofocus(hw, source, center, window, axis="Z", feed=SCAN_FEED, metric="tenengrad", roi_fraction=0.5,
+                   frame_delay=0.0, limits=None, move_feed=1000, timeout=10):
+    # Continuous scan, focus driven through motion.SerialComm hw: one sweep
+    # over center +- window at constant feed while frames are grabbed and
+    # scored back to back. Frame positions are interpolated from status
+    # reports (polled fast during sweep), peak is fitted to the sweep and
+    # focus goes there with one more move. Sweep starts from the window end
+    # nearer to focus, a move there is needed only when focus is not on it.
+    # Source may set .timestamp (time.time() of exposure) on grab(), camera
+    # timestamps are best, otherwise frame_delay: exposure before grab()
+    # returns, s
+    t0 = time.perf_counter()
+    metric = METRICS[metric] if isinstance(metric, str) else metric
+    lo, hi = center - window, center + window
+    if limits is not None:
+        lo, hi = max(lo, limits[0]), min(hi, limits[1])
+    focus = SerialCommFocus(hw, axis, move_feed, timeout)
+    i = "XYZA".index(focus.axis)
+    moves = 0
+
+    z = focus.position()
+    start, end = (lo, hi) if (z is None) or abs(z - lo) <= abs(z - hi) else (hi, lo)
+    if z is None or round(z, 3) != round(start, 3):
+        focus.move_to(start)
+        moves += 1
+
+    reports = []
+    frames = []
+
+    def on_status(status):
+        if status.mpos is not None:
+            reports.append((status.ts, status.mpos[i]))
+
+    poll = (hw.poll_interval, hw.poll_interval_idle)
+    hw.set_poll_interval(SCAN_POLL_INTERVAL, SCAN_POLL_INTERVAL)
+    hw.add_status_listener(on_status)
+    try:
+        cmd = hw.send("G90 G1 " + focus.axis + "%.3f" % end + " F" + str(feed) + "\n")
+        moves += 1
+        while not cmd.done.done():
+            img = source.grab()
+            ts = getattr(source, "timestamp", None)
+            if ts is None:
+                ts = time.time() - frame_delay
+            frames.append((ts, metric(roi(img, roi_fraction))))
+        cmd.wait(timeout)
+    finally:
+        hw.remove_status_listener(on_status)
+        hw.set_poll_interval(*poll)
+    focus.z = end
+
+    if not reports or len(frames) < 3:
+        raise RuntimeError("Scan got " + str(len(frames)) + " frames and " + str(len(reports)) + " status reports, slower feed is needed")
+    rts, rz = np.array(sorted(reports)).T
+    fts, scores = np.array(frames).T
+    zs = np.interp(fts, rts, rz)
+    order = np.argsort(zs, kind="stable")
+    peak = round(fit_peak(zs[order], scores[order], SCAN_NEIGHBOURS), 3)
+
+    focus.move_to(peak)
+    moves += 1
+    score = metric(roi(source.grab(), roi_fraction))
+    elapsed = time.perf_counter() - t0
+    LOGGER.info("Scan autofocus at " + str(peak) + " in " + str(round(elapsed, 3)) + " s, " + str(moves) + " moves, " + str(len(frames)) + " frames")
+    return Result(peak, score, moves, len(frames) + 1, elapsed, dict(zip(zs.tolist(), scores.tolist())))
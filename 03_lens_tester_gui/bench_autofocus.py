@@ -0,0 +1,56 @@
+import sys
+import threading
+
+import motion
+import simulator
+import autofocus
+
+
+# Time to focus and number of moves of autofocus.py search methods and of
+# continuous scan, focus driven through SerialComm on simulated controller
+# in real time, frames from synthetic blur model of a FPS camera at the
+# position simulated motor really is. Search window +-WINDOW around a start
+# that is OFFSET away from best focus, like after a zoom move with a
+# tracking curve.
+#   python bench_autofocus.py [runs]
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+WINDOW = 0.5
+OFFSET = 0.23
+BEST = 1.3
+POLL_INTERVAL = 0.01
+FPS = 60
+
+
+def connect():
+    sim = simulator.Simulator()
+    sim.start()
+    hw = motion.SerialComm()
+    hw.set_poll_interval(POLL_INTERVAL)
+    threading.Thread(target=hw.serial_worker, daemon=True).start()
+    hw.connect(sim.path, 115200, 5, streaming=True)
+    hw.send("G90\n").wait(10)
+    return sim, hw
+
+
+def run(sim, hw, method, metric):
+    focus = autofocus.SerialCommFocus(hw, "Z")
+    start = BEST - OFFSET
+    focus.move_to(start)
+    source = autofocus.SyntheticSource(lambda: sim.current_position()[2], best=BEST, fps=FPS)
+    if method == "scan":
+        return autofocus.scan_autofocus(hw, source, center=start, window=WINDOW, metric=metric)
+    return autofocus.autofocus(focus, source, center=start, window=WINDOW, method=method, metric=metric)
+
+
+if __name__ == "__main__":
+    sim, hw = connect()
+    print("method".ljust(8), "metric".ljust(10), "time, s".rjust(8), "moves".rjust(6), "frames".rjust(7), "error, mm".rjust(10))
+    for method in autofocus.METHODS + ("scan",):
+        for metric in autofocus.METRICS:
+            for i in range(RUNS):
+                r = run(sim, hw, method, metric)
+                print(method.ljust(8), metric.ljust(10), str(round(r.elapsed, 3)).rjust(8), str(r.moves).rjust(6),
+                      str(r.frames).rjust(7), str(round(r.position - BEST, 4)).rjust(10))
+    hw.disconnect()
+    sim.stop()
@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import queue
+import tempfile
+import logging
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+import motion
+
+
+# Time the serial threads spend in LOGGER calls, synchronous file handler
+# (previous logs.py) against queue handler (current logs.py), with a healthy
+# disk and with a disk that stalls now and then. Every command costs two
+# log lines (">>> line", "<<< ok"), so this is added to command turnaround.
+#   python bench_logging.py [lines]
+
+LINES = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+STALL_EVERY = 500      # records
+STALL = 0.05           # s
+FORMAT = "%(asctime)s - %(levelname)s - %(name)s:%(module)s:%(funcName)s:%(lineno)d - %(message)s"
+
+
+class StallingFileHandler(RotatingFileHandler):
+    # disk that blocks now and then (antivirus, network share, full cache)
+    def emit(self, record):
+        self.n = getattr(self, "n", 0) + 1
+        if self.n % STALL_EVERY == 0:
+            time.sleep(STALL)
+        RotatingFileHandler.emit(self, record)
+
+
+def file_handler(folder, stall):
+    cls = StallingFileHandler if stall else RotatingFileHandler
+    fh = cls(os.path.join(folder, "bench.log"), maxBytes=5*1024*1024, backupCount=2)
+    fh.setLevel(logging.INFO)
+    fh.setFormatter(logging.Formatter(FORMAT))
+    return fh
+
+
+def run(use_queue, stall):
+    folder = tempfile.mkdtemp()
+    log = logging.getLogger("bench")
+    log.setLevel(logging.DEBUG)
+    log.propagate = False
+    fh = file_handler(folder, stall)
+    listener = None
+    if use_queue:
+        q = queue.SimpleQueue()
+        qh = QueueHandler(q)
+        qh.setLevel(logging.INFO)
+        log.addHandler(qh)
+        listener = QueueListener(q, fh, respect_handler_level=True)
+        listener.start()
+    else:
+        log.addHandler(fh)
+
+    times = []
+    for i in range(LINES):
+        t = time.perf_counter()
+        log.info(">>> G90 G1 X-8.2 Y-5.1 Z-2.6 F1000 " + str(i))
+        times.append(time.perf_counter() - t)
+
+    if listener is not None:
+        listener.stop()
+    for h in list(log.handlers):
+        log.removeHandler(h)
+    fh.close()
+
+    times.sort()
+    return {
+        "mean": sum(times) / len(times),
+        "p99": times[int(len(times) * 0.99)],
+        "max": times[-1],
+    }
+
+
+def status_lines(seconds=10, rate=100):
+    # status reports logged while Idle and polled at rate Hz
+    sampler = motion.StatusLogSampler()
+    logged = 0
+    for i in range(int(seconds * rate)):
+        sampler.ts -= 1 / rate      # time passes without sleeping
+        if sampler.sample("<Idle|MPos:0.000,0.000,0.000,0.000|Bf:35,254|FS:0,0>") is not None:
+            logged += 1
+    return int(seconds * rate), logged
+
+
+if __name__ == "__main__":
+    print("Handler".ljust(24), "mean, us".rjust(10), "p99, us".rjust(10), "max, ms".rjust(10), "per command, us".rjust(16))
+    for name, use_queue, stall in (("sync file", False, False), ("queue", True, False),
+                                   ("sync file, stalls", False, True), ("queue, stalls", True, True)):
+        r = run(use_queue, stall)
+        print(name.ljust(24), str(round(r["mean"] * 1e6, 1)).rjust(10), str(round(r["p99"] * 1e6, 1)).rjust(10),
+              str(round(r["max"] * 1e3, 2)).rjust(10), str(round(2 * r["mean"] * 1e6, 1)).rjust(16))
+
+    reports, logged = status_lines()
+    print()
+    print("Status reports in 10 s at 100 Hz:", reports, "logged:", logged)
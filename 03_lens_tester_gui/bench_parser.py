@@ -0,0 +1,78 @@
+import sys
+import timeit
+import grbl_parser
+
+
+# Status report parser cost, shared grbl_parser against the old split/replace
+# parser that was copied in grbl_utils and main.py.
+#   python bench_parser.py [lenses] [poll_hz]
+
+LENSES = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+POLL_HZ = float(sys.argv[2]) if len(sys.argv) > 2 else 100
+NUMBER = 100000
+
+REPORTS = {
+    "short": b"<Idle|MPos:0.000,0.000,0.000,0.000|Bf:35,254|FS:0,0>",
+    "moving": b"<Run|MPos:-8.200,-5.100,-2.600,0.300|Bf:12,201|FS:1000,0|Pn:X>",
+    "full": b"<Hold:0|MPos:-7.200,-5.900,-2.980,0.300|Bf:15,128|FS:500,0|Pn:XYZ|WCO:0.000,0.000,0.000,0.000|Ov:100,100,100|A:S>",
+}
+
+
+class OldStatus():
+    status = str
+    limit_x = bool
+    limit_y = bool
+    limit_z = bool
+    pos_x = float
+    pos_y = float
+    pos_z = float
+    pos_a = float
+    block_buffer_avail = int
+    rx_buffer_avail = int
+
+
+def old_parse_status(txt):
+    txt = txt.replace('<', '').replace('>', '')
+    txt_list = txt.split("|")
+    s = OldStatus()
+    s.status = txt_list[0]
+    for p in txt_list[1:]:
+        if p[0:2] == "Bf":
+            temp1 = p.split(":")[1]
+            s.block_buffer_avail = int(temp1.split(",")[0])
+            s.rx_buffer_avail = int(temp1.split(",")[1])
+        if p[0:2] == "Pn":
+            temp1 = p.split(":")[1]
+            s.limit_x = "X" in temp1
+            s.limit_y = "Y" in temp1
+            s.limit_z = "Z" in temp1
+        if p[0:4] == "MPos":
+            temp1 = p.split(":")[1]
+            s.pos_x = float(temp1.split(",")[0])
+            s.pos_y = float(temp1.split(",")[1])
+            s.pos_z = float(temp1.split(",")[2])
+            s.pos_a = float(temp1.split(",")[3])
+    return s
+
+
+def bench(func):
+    # best of 5, microseconds per call
+    return min(timeit.repeat(func, number=NUMBER, repeat=5)) / NUMBER * 1e6
+
+
+if __name__ == "__main__":
+    record = grbl_parser.Status()
+    print("Report".ljust(8), "old, us".rjust(10), "new, us".rjust(10), "reused, us".rjust(11))
+    for name, raw in REPORTS.items():
+        txt = raw.decode()
+        t_old = bench(lambda: old_parse_status(txt))
+        t_new = bench(lambda: grbl_parser.parse_status(raw))
+        t_reuse = bench(lambda: grbl_parser.parse_status(raw, record, 0))
+        print(name.ljust(8), str(round(t_old, 2)).rjust(10), str(round(t_new, 2)).rjust(10), str(round(t_reuse, 2)).rjust(11))
+
+    # worst case, every lens polled at full rate with full reports
+    t = bench(lambda: grbl_parser.parse_status(REPORTS["full"]))
+    load = t * 1e-6 * POLL_HZ * LENSES
+    print()
+    print(LENSES, "lenses at", POLL_HZ, "Hz:", int(POLL_HZ * LENSES), "reports/s,",
+          round(load * 100, 2), "% of one core for parsing")
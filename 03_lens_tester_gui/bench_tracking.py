@@ -0,0 +1,59 @@
+import sys
+import timeit
+import numpy as np
+import yaml
+
+import tracking
+
+
+# Cost of one zoom -> all axes target, dense table lookup (tracking.py)
+# against interpolating the measured points on every call, and the error
+# the dense table adds to the exact PCHIP curve.
+#   python bench_tracking.py [lens]
+
+LENS = sys.argv[1] if len(sys.argv) > 1 else "L086"
+BATCH = 1000
+REPEAT = 20000
+
+
+def per_call_interp(points, zoom_axis, zoom):
+    # linear, no table: np.interp of every axis on each call
+    order = np.argsort(points[:, zoom_axis])
+    p = points[order]
+    return np.array([np.interp(zoom, p[:, zoom_axis], p[:, a]) for a in range(p.shape[1])])
+
+
+def per_call_pchip(points, zoom_axis, zoom):
+    p = points[np.argsort(points[:, zoom_axis])]
+    return tracking.pchip(p[:, zoom_axis], p, np.atleast_1d(zoom))[0]
+
+
+def us(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number * 1e6
+
+
+if __name__ == "__main__":
+    with open("config.yaml") as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    lens = config["lens"][LENS]
+
+    for method in tracking.METHODS:
+        t = tracking.LensTracking.from_config(lens, method=method)
+        c = t.curves[0]
+        zoom = 0.5 * (t.zoom_min + t.zoom_max) + 0.123
+        batch = np.linspace(t.zoom_min, t.zoom_max, BATCH)
+
+        print(LENS, method)
+        if method == "linear":
+            print("  per call np.interp, us".ljust(36), round(us(lambda: per_call_interp(c.points, c.zoom_axis, zoom), REPEAT), 2))
+        else:
+            print("  per call pchip, us".ljust(36), round(us(lambda: per_call_pchip(c.points, c.zoom_axis, zoom), REPEAT), 2))
+        print("  table target(), us".ljust(36), round(us(lambda: t.target(zoom), REPEAT), 2))
+        print("  table targets() per element, us".ljust(36), round(us(lambda: t.targets(batch), REPEAT // 10) / BATCH, 4))
+
+        if method == "pchip":
+            exact = tracking.pchip(c.points[:, c.zoom_axis], c.points, batch)
+        else:
+            exact = np.column_stack([per_call_interp(c.points, c.zoom_axis, z) for z in batch]).T
+        err = np.nanmax(np.abs(t.targets(batch) - exact))
+        print("  table error, mm".ljust(36), "%.2e" % err)
@@ -0,0 +1,274 @@
+import io
+import os
+import sys
+import json
+import time
+import serial
+import argparse
+import platform
+import threading
+import contextlib
+import yaml
+
+import motion
+import metrics
+import simulator
+
+# homing scenario runs the console scripts' helpers
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "02_console_demo"))
+import grbl_utils
+
+
+# End-to-end benchmark of the host side against simulator.py, so numbers
+# change only when motion.py, streaming.py or grbl_utils.py change:
+#   python benchmark.py [-o results.json] [-c previous.json] [-s time_scale]
+#                       [--no-streaming] [--poll-interval s] [--poll-interval-idle s]
+#
+# Per scenario:
+#   commands_per_s  - lines acked per second, first send() until last one done
+#   ack             - line written until ok, s
+#   move_start      - send() until planner starts executing the move, s
+#                     (taken from simulator, host does not see this moment)
+#   status_per_s    - status reports received per second
+#
+# Timing is deterministic: simulator uses its built in settings, not a
+# lens parameter file, and every scenario gets a fresh controller. Host
+# settings are pinned below (or given on command line) and presets too, GUI
+# saves both into config.yaml, only lens motor and filter definitions come
+# from there. Settings used are written into results.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(ROOT, "config.yaml")
+PARAMETER_FILE = os.path.join(ROOT, "..", "01_send_parameters", "L086.txt")
+
+JOG_LINES = 100
+JOG_STEP = 0.05
+PRESET_ROUNDS = 2
+FILTER_SWITCHES = 5
+HOME_START = (-2.3, -0.6, -1.1, 0.0)    # motors left inside home sensors
+TIMEOUT = 120
+
+# host side, what GUI takes from config.yaml
+HOST = {
+    "com_baud": 115200,
+    "com_timeout": 5,
+    "com_streaming": True,
+    "poll_interval": motion.POLL_INTERVAL,
+    "poll_interval_idle": motion.POLL_INTERVAL_IDLE,
+}
+PRESETS = {             # L086, X Y Z A
+    "p1": "-9.37 -4.8 -2.8 --",
+    "p2": "-3.3 -3.9 -0.5 --",
+    "p3": "4.6 -1.4 3.8 --",
+    "p4": "8.6 0.6 4.9 --",
+    "p5": "11.6 3.5 2.7 --",
+}
+
+
+def percentiles(values):
+    h = metrics.Histogram(len(values) or 1)
+    for v in values:
+        h.add(v)
+    return h.snapshot()
+
+
+class Link():
+    # fresh simulator and SerialComm, connected the way the GUI does it
+
+    def __init__(self, config, time_scale):
+        self.sim = simulator.Simulator(time_scale=time_scale)
+        self.sim.start()
+        self.hw = motion.SerialComm()
+        self.hw.set_poll_interval(config["poll_interval"], config["poll_interval_idle"])
+        self.reports = 0
+        self.hw.add_status_listener(self.on_status)
+        threading.Thread(target=self.hw.serial_worker, daemon=True).start()
+        self.hw.connect(self.sim.path, config["com_baud"], config["com_timeout"], streaming=config["com_streaming"])
+        self.hw.send("G90\n").wait(TIMEOUT)
+
+    def on_status(self, status):
+        self.reports += 1
+
+    def close(self):
+        self.hw.disconnect()
+        self.sim.stop()
+
+    def run(self, lines, wait_each=False):
+        # lines streamed back to back, or each one waited for like GUI buttons do
+        self.hw.enable_metrics(summary_interval=0)
+        self.reports = 0
+        started = len(self.sim.started)
+        t0 = time.perf_counter()
+        cmds = []
+        for line in lines:
+            cmd = self.hw.send(line + "\n")
+            cmds.append(cmd)
+            if wait_each:
+                cmd.wait(TIMEOUT)
+        cmds[-1].wait(TIMEOUT)
+        elapsed = time.perf_counter() - t0
+        m = self.hw.get_metrics()
+
+        # moves, in order, against planner blocks that started, in order
+        moves = [c for c in cmds if c.motion]
+        starts = [t for t, kind in list(self.sim.started)[started:] if kind in ("move", "jog")]
+        move_start = None
+        if moves and len(moves) == len(starts):
+            move_start = percentiles([t - c.t_enqueue for c, t in zip(moves, starts)])
+
+        return {
+            "commands": len(cmds),
+            "duration": elapsed,
+            "commands_per_s": len(cmds) / elapsed,
+            "errors": m["counters"]["errors"],
+            "ack": m["latencies"]["ack"],
+            "move_start": move_start,
+            "status_reports": self.reports,
+            "status_per_s": self.reports / elapsed,
+        }
+
+
+def jog_burst(config, time_scale):
+    # jog button hammered: short relative moves streamed back to back
+    lines = ["G91 G1 X" + str(JOG_STEP * (1 if i % 2 == 0 else -1)) + " F2000" for i in range(JOG_LINES)]
+    link = Link(config, time_scale)
+    try:
+        return link.run(lines)
+    finally:
+        link.close()
+
+
+def preset_lines(lens, presets):
+    # same command as main.py preset go buttons
+    ret = []
+    for name in sorted(presets):
+        preset = presets[name].split(" ")
+        cmd = "G90"
+        for axis, value in zip("XYZA", preset):
+            if lens["motor"]["function"]["axis_" + axis.lower()] and value != "--":
+                cmd += " " + axis + value
+        ret.append(cmd + " F" + str(lens["motor"]["default_speed"]))
+    return ret
+
+
+def preset_recall(config, time_scale):
+    lines = preset_lines(config["lens"]["L086"], PRESETS) * PRESET_ROUNDS
+    link = Link(config, time_scale)
+    try:
+        return link.run(lines, wait_each=True)
+    finally:
+        link.close()
+
+
+def filter_switch(config, time_scale):
+    # L084 IR CUT filter, multi line M113..M117 macro with dwell
+    f = config["lens"]["L084"]["filter1"]
+    lines = []
+    for i in range(FILTER_SWITCHES):
+        lines += f["state_on"] + f["state_off"]
+    link = Link(config, time_scale)
+    try:
+        return link.run(lines)
+    finally:
+        link.close()
+
+
+def parameter_upload(config, time_scale):
+    with open(PARAMETER_FILE) as f:
+        lines = [l.strip() for l in f if l.strip().startswith("$")]
+    link = Link(config, time_scale)
+    try:
+        return link.run(lines)
+    finally:
+        link.close()
+
+
+def homing(config, time_scale, together=False):
+    # cold start of console scripts (L086.py): unhome and home X, Y, Z
+    sim = simulator.Simulator(time_scale=time_scale)
+    sim.start()
+    sim.set_position(HOME_START)
+    ser = serial.Serial(sim.path, config["com_baud"], timeout=10)
+    try:
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            timing = grbl_utils.home_all(ser, "XYZ", together)
+        elapsed = time.perf_counter() - t0
+        return {
+            "commands": len(sim.lines),
+            "duration": elapsed,
+            "commands_per_s": len(sim.lines) / elapsed,
+            "status_reports": sim.status_reports,
+            "status_per_s": sim.status_reports / elapsed,
+            "axes": {a: timing[a] for a in "XYZ"},
+        }
+    finally:
+        ser.close()
+        sim.stop()
+
+
+def homing_cycle(config, time_scale):
+    # same with firmware homing cycle, $H homes all axes at once
+    return homing(config, time_scale, together=True)
+
+
+SCENARIOS = {
+    "jog_burst": jog_burst,
+    "preset_recall": preset_recall,
+    "filter_switch": filter_switch,
+    "parameter_upload": parameter_upload,
+    "homing": homing,
+    "homing_cycle": homing_cycle,
+}
+
+
+def summary_line(name, r, previous=None):
+    txt = name.ljust(18) + str(round(r["duration"], 3)).rjust(9) + str(round(r["commands_per_s"], 1)).rjust(10)
+    for key in ("ack", "move_start"):
+        h = r.get(key)
+        txt += (str(round(h["p50"] * 1000, 2)) if h and h["p50"] is not None else "-").rjust(12)
+    txt += str(round(r["status_per_s"], 1)).rjust(10)
+    if previous and name in previous:
+        txt += ("x" + str(round(previous[name]["duration"] / r["duration"], 2))).rjust(9)
+    return txt
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Host side throughput and latency benchmark against simulated controller')
+    parser.add_argument('-o', '--output', help='JSON results file', default="benchmark.json")
+    parser.add_argument('-c', '--compare', help='Previous JSON results to compare durations with', default=None)
+    parser.add_argument('-s', '--time-scale', help='Simulator time scale, 1 - real time', default=1.0, type=float)
+    parser.add_argument('--no-streaming', help='Send and wait for each line instead of character counting', action='store_true')
+    parser.add_argument('--poll-interval', help='Status poll period while busy, s', default=HOST["poll_interval"], type=float)
+    parser.add_argument('--poll-interval-idle', help='Status poll period while Idle, s', default=HOST["poll_interval_idle"], type=float)
+    parser.add_argument('scenario', nargs='*', help='Scenarios to run, all by default: ' + " ".join(SCENARIOS))
+    args = parser.parse_args()
+
+    host = dict(HOST, com_streaming=not args.no_streaming, poll_interval=args.poll_interval,
+                poll_interval_idle=args.poll_interval_idle)
+    with open(CONFIG_FILE) as f:
+        config = dict(host, lens=yaml.load(f, Loader=yaml.FullLoader)["lens"])
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)["scenarios"]
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time_scale": args.time_scale,
+        "host": host,
+        "scenarios": {},
+    }
+    print("Scenario".ljust(18) + "time, s".rjust(9) + "cmd/s".rjust(10) + "ack p50, ms".rjust(12) +
+          "start p50".rjust(12) + "status/s".rjust(10) + ("speedup".rjust(9) if previous else ""))
+    for name in args.scenario or SCENARIOS:
+        r = SCENARIOS[name](config, args.time_scale)
+        results["scenarios"][name] = r
+        print(summary_line(name, r, previous))
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("Results written to", args.output)
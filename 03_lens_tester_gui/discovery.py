@@ -0,0 +1,175 @@
+import os
+import sys
+import math
+import time
+import collections
+import concurrent.futures
+import serial
+import serial.tools.list_ports
+import yaml
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+
+PROBE_DEADLINE = 0.5     # how long a port has to open and answer $I, s
+PROBE_GRACE = 0.2        # thread start and port close on top of deadline, s
+MAX_WORKERS = 16
+
+# lens id string prefix -> lens model
+LENS_PREFIXES = {
+    "LS8": "L085",
+    "6ZG": "L086",
+    "JWF": "L084",
+}
+CONTROLLER_PREFIX = "D2R"
+
+LensInfo = collections.namedtuple("LensInfo", "firmware lens_model lens_sn controller_sn version")
+
+
+def parse_version(line):
+    # [VER:1.1f-SCE2.20211130:L086,6ZG-BEG19,D2R-00123]
+    txt = line.strip().replace('[', '').replace(']', '')
+    txt_list = txt.split(':')
+    firmware = txt_list[1] if len(txt_list) > 1 else None
+    id_strings = txt_list[2].split(',') if len(txt_list) > 2 else []
+
+    lens_model = None
+    lens_sn = None
+    controller_sn = None
+    for i in id_strings:
+        if i[0:3] in LENS_PREFIXES:
+            lens_model = LENS_PREFIXES[i[0:3]]
+            lens_sn = i[4:]
+        elif i[0:3] == CONTROLLER_PREFIX:
+            controller_sn = i[4:]
+
+    # id strings without serial number, only model name (L086)
+    if lens_model is None:
+        for i in id_strings:
+            if i in LENS_PREFIXES.values():
+                lens_model = i
+
+    return LensInfo(firmware, lens_model, lens_sn, controller_sn, line.strip())
+
+
+def probe(port, baudrate=115200, deadline=PROBE_DEADLINE):
+    # Ask port for $I, returns LensInfo or None if port is not a GRBL
+    # controller or did not answer in time. Deadline counts from before
+    # open(), though open() itself can not be interrupted. Port is locked
+    # while probed, a port another program holds locked is skipped and
+    # $I is never written into somebody else's session.
+    end = time.time() + deadline
+    ser = serial.Serial()
+    ser.port = port
+    ser.baudrate = baudrate
+    ser.timeout = deadline
+    ser.write_timeout = deadline
+    ser.exclusive = True
+    try:
+        ser.open()
+    except Exception as e:
+        LOGGER.debug(port + " is busy, skipped " + str(e))
+        return None
+    try:
+        ser.reset_input_buffer()
+        ser.write(b"$I\n")
+
+        data = b""
+        while time.time() < end:
+            ser.timeout = max(0, end - time.time())
+            data += ser.read(max(1, ser.in_waiting))
+            lines = data.decode("utf-8", errors="replace").splitlines()
+            if ("ok" in lines) or any(l.startswith("error") for l in lines):
+                break
+
+        for line in data.decode("utf-8", errors="replace").splitlines():
+            if line.startswith("[VER:"):
+                return parse_version(line)
+    except Exception as e:
+        LOGGER.debug(port + " probe failed " + str(e))
+    finally:
+        ser.close()
+    return None
+
+
+class Discovery():
+    # Finds SCE2 controllers among all serial ports. Ports are probed
+    # concurrently, so whole scan takes about one deadline regardless of port
+    # count. Results are cached by USB serial number of the port (it belongs
+    # to the controller, not to COM port name), a port seen before is not
+    # probed again unless refresh=True. Cache optionally persists in yaml file.
+    #
+    #   found = Discovery("discovery_cache.yaml").discover()
+    #   {"COM20": LensInfo(firmware='1.1f-SCE2.20211130', lens_model='L086', ...),
+    #    "COM3": None}
+
+    def __init__(self, cache_file=None, baudrate=115200, deadline=PROBE_DEADLINE):
+        self.cache_file = cache_file
+        self.baudrate = baudrate
+        self.deadline = deadline
+        self.cache = {}
+        if cache_file and os.path.exists(cache_file):
+            with open(cache_file) as f:
+                data = yaml.load(f, Loader=yaml.FullLoader) or {}
+            for usb_sn, info in data.items():
+                self.cache[usb_sn] = LensInfo(**info)
+
+    def save(self):
+        if not self.cache_file:
+            return
+        with open(self.cache_file, 'w') as f:
+            yaml.dump({k: dict(v._asdict()) for k, v in self.cache.items()}, f)
+
+    def discover(self, ports=None, refresh=False):
+        # ports: list of port names, default all serial ports in system
+        usb_sn = {}
+        if ports is None:
+            ports = []
+            for p in serial.tools.list_ports.comports():
+                ports.append(p.device)
+                usb_sn[p.device] = p.serial_number
+        else:
+            for p in serial.tools.list_ports.comports():
+                usb_sn[p.device] = p.serial_number
+
+        result = {}
+        to_probe = []
+        for port in ports:
+            sn = usb_sn.get(port)
+            if (not refresh) and sn and (sn in self.cache):
+                result[port] = self.cache[sn]
+            else:
+                to_probe.append(port)
+
+        if to_probe:
+            # A port whose open() hangs (Bluetooth COM ports on Windows) is
+            # reported as None when time is up and its probe is left to
+            # finish in background, scan is never longer than the deadline.
+            workers = min(MAX_WORKERS, len(to_probe))
+            timeout = self.deadline * math.ceil(len(to_probe) / workers) + PROBE_GRACE
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+            futures = {pool.submit(probe, p, self.baudrate, self.deadline): p for p in to_probe}
+            done, late = concurrent.futures.wait(futures, timeout=timeout)
+            pool.shutdown(wait=False)
+            for f in late:
+                f.cancel()
+                LOGGER.warning(futures[f] + " did not answer within " + str(round(timeout, 2)) + " s")
+            for f, port in futures.items():
+                info = f.result() if f in done else None
+                result[port] = info
+                sn = usb_sn.get(port)
+                if sn and info is not None:
+                    self.cache[sn] = info
+            self.save()
+
+        return result
+
+
+if __name__ == "__main__":
+    # python discovery.py [COM20 COM21 ...]
+    t0 = time.time()
+    found = Discovery().discover(sys.argv[1:] or None)
+    for port, info in sorted(found.items()):
+        print(port, info)
+    print("Done in", round(time.time() - t0, 2), "s")
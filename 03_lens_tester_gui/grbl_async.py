@@ -0,0 +1,441 @@
+import asyncio
+import collections
+import threading
+import time
+import serial
+import streaming
+import grbl_parser
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+
+POLL_INTERVAL = 0.05         # status poll period while motors move, s
+POLL_INTERVAL_IDLE = 0.5     # status poll period while Idle, s
+READ_INTERVAL = 0.001        # reader thread sleep when no port had data, event loop without add_reader, s
+BUSY_STATES = ("Run", "Jog", "Home")
+UNHOME_DISTANCE = 10         # longest way out of a home sensor, mm
+UNHOME_SPEED = 1000          # mm/min
+UNHOME_POLL_INTERVAL = 0.01  # status poll period while waiting for pins to clear, s
+RT_JOG_CANCEL = b"\x85"
+
+
+class PortReader():
+    # For event loops without add_reader (Windows proactor loop): one thread
+    # reads every port, only bytes already waiting so no read ever blocks,
+    # and hands data to the client's loop. Sleeps only when all ports are
+    # quiet, so latency does not grow with number of lenses. Thread runs
+    # while there is a port to read.
+
+    def __init__(self, interval=READ_INTERVAL):
+        self.interval = interval
+        self.ports = {}     # ser -> (loop, on_data, on_error)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, ser, loop, on_data, on_error):
+        with self.lock:
+            self.ports[ser] = (loop, on_data, on_error)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.__run, daemon=True)
+                self.thread.start()
+
+    def remove(self, ser):
+        # port is not touched any more once this returns, it can be closed
+        with self.lock:
+            self.ports.pop(ser, None)
+
+    def __run(self):
+        while True:
+            quiet = True
+            with self.lock:
+                if not self.ports:
+                    self.thread = None
+                    return
+                for ser, (loop, on_data, on_error) in list(self.ports.items()):
+                    try:
+                        n = ser.in_waiting
+                        data = ser.read(n) if n else b""
+                    except Exception as e:
+                        del self.ports[ser]
+                        data, callback = e, on_error
+                    else:
+                        if not data:
+                            continue
+                        quiet = False
+                        callback = on_data
+                    try:
+                        loop.call_soon_threadsafe(callback, data)
+                    except RuntimeError:
+                        # event loop closed under the port
+                        self.ports.pop(ser, None)
+            if quiet:
+                time.sleep(self.interval)
+
+
+READER = PortReader()
+
+
+class GrblClient():
+    # asyncio GRBL client, one instance per controller. Everything runs on
+    # the event loop thread, so many controllers can be driven from one loop:
+    #
+    #   async with GrblClient("COM20") as lens:
+    #       ver = await lens.query("$I")
+    #       await lens.command("G90")
+    #       await lens.send("G1 X-8.2 Y-5.1 Z-2.6 F1000")   # motion done
+    #       print(await lens.status())
+    #
+    # Port is read without blocking: loop.add_reader() where event loop
+    # supports it (Linux, macOS), otherwise by PortReader thread shared by
+    # all clients (Windows proactor loop). Lines are streamed with character
+    # counting, see streaming.py.
+
+    def __init__(self, port, baudrate=115200, poll_interval=POLL_INTERVAL, poll_interval_idle=POLL_INTERVAL_IDLE):
+        self.port = port
+        self.baudrate = baudrate
+        self.poll_interval = poll_interval
+        self.poll_interval_idle = poll_interval_idle
+
+        self.ser = None
+        self.loop = None
+        self.counter = streaming.CharacterCounter()
+        self.tracker = streaming.ExecutionTracker()
+        self.pending = collections.deque()
+        self.rx_buffer = b""
+        self.last_status = None
+        self.status_waiters = []
+        self.status_queues = []
+        self.polls_pending = 0
+        self.poll_ts = 0
+        self.poll_wake = None
+        self.tasks = []
+
+    def __repr__(self):
+        return "GrblClient(" + repr(self.port) + ")"
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        self.loop = asyncio.get_running_loop()
+        self.ser = serial.Serial()
+        self.ser.port = str(self.port)
+        self.ser.baudrate = int(self.baudrate)
+        self.ser.timeout = 0
+        await self.loop.run_in_executor(None, self.ser.open)
+        self.ser.reset_input_buffer()
+
+        self.poll_wake = asyncio.Event()
+        try:
+            self.loop.add_reader(self.ser.fileno(), self.__on_readable)
+        except (NotImplementedError, AttributeError):
+            READER.add(self.ser, self.loop, self.__on_data, self.__on_error)
+        self.tasks.append(asyncio.ensure_future(self.__poller()))
+
+    async def close(self):
+        if self.ser is None:
+            return
+        ser = self.ser
+        tasks = self.__stop()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        ser.close()
+
+    # ---------------------------------------------------------------------
+    # commands
+
+    def send(self, line):
+        # Queues line, returns streaming.Command right away. await it for
+        # motion completion, await asyncio.wrap_future(cmd.ack) for ok.
+        if not line.endswith("\n"):
+            line += "\n"
+        cmd = streaming.Command(line)
+        if self.ser is None:
+            # closed or port lost, line would never be answered
+            cmd.cancel()
+            return cmd
+        self.pending.append(cmd)
+        self.__pump()
+        return cmd
+
+    async def command(self, line, timeout=None):
+        # send_command() replacement, returns "ok" or raises CommandError
+        cmd = self.send(line)
+        return await asyncio.wait_for(asyncio.wrap_future(cmd.ack), timeout)
+
+    async def query(self, line, timeout=None):
+        # for commands that answer with data ($I, $$, $N), returns lines before ok
+        cmd = self.send(line)
+        await asyncio.wait_for(asyncio.wrap_future(cmd.ack), timeout)
+        return cmd.response
+
+    def realtime(self, data):
+        # realtime command (?, !, ~, 0x18, 0x85, overrides), skips the queue
+        if self.ser is None:
+            raise ConnectionError(str(self.port) + " is not open")
+        try:
+            self.ser.write(data)
+        except Exception as e:
+            self.__on_error(e)
+            raise ConnectionError(str(self.port) + " write failed: " + str(e))
+
+    def soft_reset(self):
+        self.realtime(b"\x18")
+        for cmd in self.pending:
+            cmd.cancel()
+        self.pending.clear()
+        self.__cancel_all()
+
+    # ---------------------------------------------------------------------
+    # status
+
+    async def status(self, timeout=None):
+        # fresh status report, grbl_parser.Status
+        if self.ser is None:
+            raise ConnectionError(str(self.port) + " is not open")
+        waiter = self.loop.create_future()
+        self.status_waiters.append(waiter)
+        self.__poll_now()
+        return await asyncio.wait_for(waiter, timeout)
+
+    async def status_stream(self):
+        # async iterator of every status report background poller receives
+        q = asyncio.Queue()
+        self.status_queues.append(q)
+        try:
+            while True:
+                yield await q.get()
+        finally:
+            self.status_queues.remove(q)
+
+    async def wait_for_idle(self, timeout=None):
+        # planner is empty and machine is Idle
+        async def wait():
+            while True:
+                s = await self.status()
+                blocks = s.blocks_free if s.blocks_free is not None else self.tracker.planner_blocks
+                if (s.state == "Idle") and (blocks >= self.tracker.planner_blocks):
+                    return s
+                await asyncio.sleep(self.poll_interval)
+        return await asyncio.wait_for(wait(), timeout)
+
+    # ---------------------------------------------------------------------
+    # homing
+
+    async def home(self, axis, timeout=None):
+        # $H<axis>, controller answers ok once homing is finished
+        return await self.command("$H" + axis.upper(), timeout)
+
+    async def unhome(self, axes="XYZ", distance=UNHOME_DISTANCE, speed=UNHOME_SPEED):
+        # one jog of all axes inside home sensor, restarted without the ones
+        # that left, see grbl_utils.unhome_axes. Returns {axis: seconds}
+        t0 = time.time()
+        ret = {}
+        inside = [a for a in axes.upper() if a in (await self.status()).pins]
+        while inside:
+            await self.command("$J=G91 " + " ".join(a + str(distance) for a in inside) + " F" + str(speed))
+            while True:
+                s = await self.status()
+                left = [a for a in inside if a in s.pins]
+                if left != inside:
+                    break
+                if s.state == "Idle":
+                    raise RuntimeError(str(self.port) + " axis " + "".join(left) + " still in home sensor after " + str(distance) + " mm")
+                await asyncio.sleep(UNHOME_POLL_INTERVAL)
+            for a in inside:
+                if a not in left:
+                    ret[a] = time.time() - t0
+            self.realtime(RT_JOG_CANCEL)
+            await self.wait_for_idle()
+            inside = left
+        return ret
+
+    async def home_all(self, axes="XYZ", together=True):
+        # unhome() then $H (firmware cycle, axes move together) or $H<axis>
+        # one by one when firmware rejects $H or together=False, see
+        # grbl_utils.home_all. Many controllers home at the same time with
+        # asyncio.gather(*[c.home_all() for c in clients])
+        t0 = time.time()
+        ret = {a: {"unhome": 0.0} for a in axes.upper()}
+        for a, t in (await self.unhome(axes)).items():
+            ret[a]["unhome"] = t
+        t_home = time.time()
+        if together:
+            try:
+                await self.command("$H")
+            except streaming.CommandError as e:
+                LOGGER.warning(str(self.port) + " " + str(e) + ", homing axes one by one")
+                together = False
+        if together:
+            for a in axes.upper():
+                ret[a]["home"] = time.time() - t_home
+        else:
+            for a in axes.upper():
+                t = time.time()
+                await self.home(a)
+                ret[a]["home"] = time.time() - t
+        ret["total"] = time.time() - t0
+        return ret
+
+    # ---------------------------------------------------------------------
+    # internals, all run on event loop thread
+
+    def __pump(self):
+        # character counting, write as many lines as RX buffer can take
+        while self.pending and (self.ser is not None):
+            cmd = self.pending[0]
+            if not self.counter.fits(cmd.line):
+                break
+            self.pending.popleft()
+            self.counter.push(cmd.line, cmd)
+            try:
+                self.ser.write(bytes(cmd.line, 'utf8'))
+            except Exception as e:
+                self.__on_error(e)
+                return
+            LOGGER.debug(str(self.port) + " >>> " + cmd.line.strip())
+        if self.poll_wake is not None:
+            self.poll_wake.set()
+
+    def __poll_now(self):
+        self.polls_pending += 1
+        self.poll_ts = time.time()
+        try:
+            self.ser.write(b"?")
+        except Exception as e:
+            self.__on_error(e)
+
+    async def __poller(self):
+        # one outstanding poll at a time, fast while moving
+        while self.ser is not None:
+            busy = len(self.counter) or len(self.tracker) or self.pending
+            if (self.last_status is not None) and (self.last_status.state in BUSY_STATES):
+                busy = True
+            period = self.poll_interval if busy else self.poll_interval_idle
+
+            # report that did not come within 10 periods is considered lost
+            now = time.time()
+            lost = now - self.poll_ts > 10 * period
+            if lost or ((self.polls_pending == 0) and (now - self.poll_ts >= period)):
+                if lost:
+                    self.polls_pending = 0
+                self.__poll_now()
+                now = time.time()
+
+            if self.polls_pending:
+                deadline = self.poll_ts + 10 * period
+            else:
+                deadline = self.poll_ts + period
+
+            self.poll_wake.clear()
+            try:
+                await asyncio.wait_for(self.poll_wake.wait(), max(0, deadline - now))
+            except asyncio.TimeoutError:
+                pass
+
+    def __on_readable(self):
+        try:
+            data = self.ser.read(self.ser.in_waiting or 1)
+        except Exception as e:
+            self.__on_error(e)
+            return
+        self.__on_data(data)
+
+    def __on_error(self, e):
+        # port is gone (cable pulled, USB reset), nothing will ever be answered
+        if self.ser is None:
+            return
+        LOGGER.error(str(self.port) + " port error " + str(e))
+        ser = self.ser
+        self.__stop()
+        try:
+            ser.close()
+        except Exception:
+            pass
+
+    def __on_data(self, data):
+        if self.ser is None:
+            return
+        self.rx_buffer += data
+        while b"\n" in self.rx_buffer:
+            line, self.rx_buffer = self.rx_buffer.split(b"\n", 1)
+            r = line.decode("utf-8", errors="replace").strip()
+            if len(r):
+                self.__route(r, line)
+
+    def __route(self, r, raw):
+        if streaming.is_status(r):
+            self.__on_status(raw)
+        elif streaming.is_reply(r):
+            LOGGER.debug(str(self.port) + " <<< " + r)
+            _, cmd = self.counter.pop()
+            if cmd is None:
+                LOGGER.warning(str(self.port) + " unexpected reply " + r)
+                return
+            if cmd.acked(r):
+                for c in self.tracker.add(cmd):
+                    c.finished()
+            self.__pump()
+        elif r.startswith("ALARM") or r.startswith("Grbl"):
+            LOGGER.warning(str(self.port) + " " + r)
+            self.__cancel_all()
+        else:
+            # [VER:..], [OPT:..], $x=val belong to the line being executed
+            LOGGER.debug(str(self.port) + " <<< " + r)
+            if self.counter.in_flight:
+                self.counter.in_flight[0][2].response.append(r)
+            if r.startswith("[OPT:"):
+                opt = r[1:-1].split(",")
+                self.tracker.planner_blocks = int(opt[1])
+                self.counter.rx_buffer_size = int(opt[2])
+
+    def __on_status(self, raw):
+        status = grbl_parser.parse_status(raw)
+        self.last_status = status
+        if self.polls_pending > 0:
+            self.polls_pending -= 1
+
+        for c in self.tracker.update(status.state, status.blocks_free):
+            c.finished()
+
+        waiters, self.status_waiters = self.status_waiters, []
+        for w in waiters:
+            if not w.done():
+                w.set_result(status)
+        for q in self.status_queues:
+            q.put_nowait(status)
+        self.poll_wake.set()
+
+    def __stop(self):
+        # no more reads, polls or writes, everything waiting for this
+        # controller is cancelled. Returns stopped tasks to wait for.
+        ser = self.ser
+        self.ser = None
+        try:
+            self.loop.remove_reader(ser.fileno())
+        except (NotImplementedError, AttributeError, ValueError, serial.SerialException):
+            pass
+        READER.remove(ser)
+        current = asyncio.current_task()
+        tasks = [t for t in self.tasks if t is not current]
+        self.tasks = []
+        for t in tasks:
+            t.cancel()
+        for cmd in self.pending:
+            cmd.cancel()
+        self.pending.clear()
+        self.__cancel_all()
+        waiters, self.status_waiters = self.status_waiters, []
+        for w in waiters:
+            if not w.done():
+                w.set_exception(ConnectionError(str(self.port) + " is closed"))
+        return tasks
+
+    def __cancel_all(self):
+        for cmd in self.counter.clear() + self.tracker.clear():
+            cmd.cancel()
+
@@ -0,0 +1,181 @@
+import time
+import operator
+
+
+CACHE_SIZE = 64     # WCO, Ov and Pn values kept converted, they seldom change
+
+FIELDS = ("state", "substate", "mpos", "wpos", "wco", "blocks_free", "rx_free",
+          "line_number", "feed", "spindle", "pins", "ov", "accessories", "ts")
+
+
+class Status():
+    # One GRBL 1.1 status report:
+    # <Idle|MPos:0.000,0.000,0.000,0.000|Bf:35,254|FS:0,0|Pn:XYZ|WCO:0.000,0.000,0.000,0.000|Ov:100,100,100|A:S>
+    #
+    # WCO and Ov are not in every report, controller sends them only now and
+    # then. When the same record is passed to parse_status() again they keep
+    # the last known value.
+
+    __slots__ = ("state", "substate", "_mpos", "_wpos", "wco", "blocks_free", "rx_free",
+                 "line_number", "feed", "spindle", "pins", "ov", "accessories", "ts")
+
+    def __init__(self):
+        self.state = None
+        self.substate = None        # Hold:0, Door:1
+        self._mpos = None           # (x, y, z, a), as reported
+        self._wpos = None
+        self.wco = None
+        self.blocks_free = None     # Bf
+        self.rx_free = None
+        self.line_number = None     # Ln
+        self.feed = None            # F / FS
+        self.spindle = None
+        self.pins = ""              # Pn, empty when no pin is active
+        self.ov = None              # (feed, rapid, spindle) %
+        self.accessories = ""       # A
+        self.ts = None
+
+    def __repr__(self):
+        return "Status(" + ", ".join(k + "=" + repr(getattr(self, k)) for k in FIELDS) + ")"
+
+    # controller reports either MPos or WPos ($10), the other one is computed
+    # from WCO only when asked for
+    @property
+    def mpos(self):
+        if self._mpos is None and self._wpos is not None and self.wco is not None:
+            return tuple(map(operator.add, self._wpos, self.wco))
+        return self._mpos
+
+    @property
+    def wpos(self):
+        if self._wpos is None and self._mpos is not None:
+            if self.wco is None:
+                return self._mpos
+            return tuple(map(operator.sub, self._mpos, self.wco))
+        return self._wpos
+
+    # names used by grbl_utils and older GUI code
+    @property
+    def status(self):
+        return self.state
+
+    @property
+    def pos_x(self):
+        return self.mpos[0]
+
+    @property
+    def pos_y(self):
+        return self.mpos[1]
+
+    @property
+    def pos_z(self):
+        return self.mpos[2]
+
+    @property
+    def pos_a(self):
+        return self.mpos[3]
+
+    @property
+    def limit_x(self):
+        return "X" in self.pins
+
+    @property
+    def limit_y(self):
+        return "Y" in self.pins
+
+    @property
+    def limit_z(self):
+        return "Z" in self.pins
+
+    @property
+    def limit_a(self):
+        return "A" in self.pins
+
+    @property
+    def block_buffer_avail(self):
+        return self.blocks_free
+
+    @property
+    def rx_buffer_avail(self):
+        return self.rx_free
+
+
+_wco = {}
+_ov = {}
+_text = {}
+
+
+def _cached(cache, value, convert):
+    # converted value of a field that repeats, raw bytes -> result
+    if len(cache) >= CACHE_SIZE:
+        cache.clear()
+    ret = cache[value] = convert(value)
+    return ret
+
+
+def _floats(value):
+    return tuple(map(float, value.split(b",")))
+
+
+def _ints(value):
+    return tuple(map(int, value.split(b",")))
+
+
+def parse_status(data, status=None, ts=None):
+    # data: raw report as bytes (str is accepted too), with or without <> and
+    # line end. Fields are split from bytes and numbers converted from them,
+    # without decode() and replace() of the whole report. WCO, Ov, Pn and A
+    # repeat in nearly every report they are in, their converted values are
+    # looked up by raw bytes. Fields come in GRBL order and are tested most
+    # frequent first. Fills status record when given, otherwise a new one.
+    if isinstance(data, str):
+        data = data.encode("utf8")
+    data = data.strip()
+    if data[:1] == b"<":
+        data = data[1:-1]
+
+    s = status if status is not None else Status()
+    s.ts = ts if ts is not None else time.time()
+    # fields a report may leave out, only WCO and Ov keep last known value
+    s.pins = ""
+    s.accessories = ""
+    s._mpos = None
+    s._wpos = None
+    s.blocks_free = None
+    s.rx_free = None
+    s.line_number = None
+    s.feed = None
+    s.spindle = None
+
+    fields = data.split(b"|")
+    state, _, sub = fields[0].partition(b":")
+    s.state = state.decode()
+    s.substate = int(sub) if sub else None
+
+    for f in fields[1:]:
+        name, _, value = f.partition(b":")
+        if name == b"MPos":
+            s._mpos = _floats(value)
+        elif name == b"Bf":
+            blocks, _, rx = value.partition(b",")
+            s.blocks_free = int(blocks)
+            s.rx_free = int(rx)
+        elif name == b"FS":
+            feed, _, spindle = value.partition(b",")
+            s.feed = float(feed)
+            s.spindle = float(spindle)
+        elif name == b"Pn":
+            s.pins = _text.get(value) or _cached(_text, value, bytes.decode)
+        elif name == b"WCO":
+            s.wco = _wco.get(value) or _cached(_wco, value, _floats)
+        elif name == b"Ov":
+            s.ov = _ov.get(value) or _cached(_ov, value, _ints)
+        elif name == b"A":
+            s.accessories = _text.get(value) or _cached(_text, value, bytes.decode)
+        elif name == b"WPos":
+            s._wpos = _floats(value)
+        elif name == b"F":
+            s.feed = float(value)
+        elif name == b"Ln":
+            s.line_number = int(value)
+    return s
@@ -0,0 +1,195 @@
+import os
+import time
+import hashlib
+import threading
+import yaml
+
+
+# GRBL prints float settings with 3 decimals ($27=0.500), values closer than
+# that are the same setting
+FLOAT_TOLERANCE = 0.0005
+
+QUERIES = ("$$", "$N", "$I")
+
+AXES = "XYZA"
+MAX_TRAVEL = 130    # $130..$133, max travel of X, Y, Z, A
+
+
+def parse_line(line):
+    # "$100=314.961" -> ("$100", "314.961"), "$N1=G90 G1 A0.3 F1" -> ("$N1", ...)
+    # "[VER:1.1f-SCE2.20211130:L086,6ZG-BEG19]" -> ("$I", "L086,6ZG-BEG19")
+    # anything else -> None
+    line = line.strip()
+    if line.startswith("[VER:"):
+        txt_list = line[1:-1].split(":", 2)
+        return "$I", txt_list[2] if len(txt_list) > 2 else ""
+    if line.startswith("$") and ("=" in line):
+        key, _, value = line.partition("=")
+        return key.strip(), value.strip()
+    return None
+
+
+def is_write(line):
+    # "$110=1000", "$N0=G90", "$RST=$" change controller EEPROM, "$J=" does not
+    line = line.strip()
+    return line.startswith("$") and ("=" in line) and not line.startswith("$J=")
+
+
+def parse_settings(lines):
+    # lines of parameter file or controller replies -> {key: value}
+    ret = {}
+    for line in lines:
+        kv = parse_line(line)
+        if kv is not None:
+            ret[kv[0]] = kv[1]
+    return ret
+
+
+def read_file(filename):
+    with open(filename, "r") as f:
+        return parse_settings(f.readlines())
+
+
+def read_controller(query):
+    # query(line) -> list of lines controller sent before ok
+    lines = []
+    for q in QUERIES:
+        lines += query(q)
+    return parse_settings(lines)
+
+
+def same_value(key, a, b):
+    if key.startswith("$N"):
+        # startup blocks are stored without spaces, upper case
+        return a.replace(" ", "").upper() == b.replace(" ", "").upper()
+    try:
+        return abs(float(a) - float(b)) < FLOAT_TOLERANCE
+    except ValueError:
+        return a == b
+
+
+def diff(current, target):
+    # keys of target which controller does not have or has with other value
+    # -> [(key, current value or None, target value)]
+    ret = []
+    for key, value in target.items():
+        if (key not in current) or not same_value(key, current[key], value):
+            ret.append((key, current.get(key), value))
+    return ret
+
+
+def to_lines(changes):
+    return [key + "=" + value for key, old, value in changes]
+
+
+def typed_value(value):
+    # "6" -> 6, "314.961" -> 314.961, startup blocks and $I stay strings
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def to_typed(settings):
+    return {key: typed_value(value) for key, value in settings.items()}
+
+
+def content_hash(settings):
+    txt = "".join(k + "=" + settings[k] + "\n" for k in sorted(settings))
+    return hashlib.sha1(txt.encode("utf8")).hexdigest()
+
+
+def travel_limits(settings):
+    # {"X": 360.0, ...} for axes controller reports
+    ret = {}
+    for i, axis in enumerate(AXES):
+        key = "$" + str(MAX_TRAVEL + i)
+        if key in settings:
+            ret[axis] = float(settings[key])
+    return ret
+
+
+class SettingsCache():
+    # Full $$/$N state of controllers seen before, keyed by controller SN from
+    # the VER line (discovery.LensInfo) and stamped with the whole VER line
+    # (firmware, lens ids) and a hash of the $$ and $N content. GRBL has no
+    # checksum query and $x= can be changed by other tools (01_send_parameters,
+    # a terminal), so an entry is never trusted alone: SerialComm hands it to
+    # the app right after $I, still reads the full dump in background and
+    # sends settings again only when their hash differs from the entry.
+    # Entries older than max_age, with other VER line or changed by
+    # SerialComm itself are not served, 0 disables the cache.
+
+    def __init__(self, filename=None, max_age=0):
+        self.filename = filename
+        self.max_age = max_age
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        if filename and os.path.exists(filename):
+            with open(filename) as f:
+                self.entries = yaml.load(f, Loader=yaml.FullLoader) or {}
+
+    def save(self):
+        if not self.filename:
+            return
+        # snapshot taken under save_lock, so the last save writes newest state
+        with self.save_lock:
+            with self.lock:
+                entries = dict(self.entries)
+            with open(self.filename, "w") as f:
+                yaml.dump(entries, f)
+
+    def save_later(self):
+        # callers are serial threads, file is written in background
+        if self.filename:
+            threading.Thread(target=self.save, daemon=True).start()
+
+    def enabled(self, info):
+        # controller without SN can not be told apart from others
+        return (self.max_age > 0) and (info.controller_sn is not None)
+
+    def get(self, info):
+        # entry which still matches controller firmware, None otherwise
+        if not self.enabled(info):
+            return None
+        with self.lock:
+            entry = self.entries.get(info.controller_sn)
+        if entry is None:
+            return None
+        if entry["version"] != info.version:
+            return None
+        if time.time() - entry["ts"] > self.max_age:
+            return None
+        if content_hash(entry["settings"]) != entry["hash"]:
+            return None
+        return entry
+
+    def check(self, entry, settings):
+        # settings: $$ and $N just read from controller
+        return (entry is not None) and (content_hash(settings) == entry["hash"])
+
+    def put(self, info, settings):
+        if not self.enabled(info):
+            return
+        entry = {
+            "firmware": info.firmware,
+            "version": info.version,
+            "ts": time.time(),
+            "settings": dict(settings),
+            "hash": content_hash(settings),
+        }
+        with self.lock:
+            self.entries[info.controller_sn] = entry
+        self.save_later()
+
+    def invalidate(self, info):
+        # controller settings were changed, entry is not served any more
+        with self.lock:
+            if self.entries.pop(info.controller_sn, None) is None:
+                return
+        self.save_later()
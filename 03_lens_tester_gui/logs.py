@@ -2,7 +2,8 @@ import logging
 import atexit
 import time
 import sys
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
 # https://docs.python.org/3/howto/logging-cookbook.html
 
@@ -16,13 +17,21 @@ fh.setLevel(logging.INFO)
 formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(name)s:%(module)s:%(funcName)s:%(lineno)d - %(message)s")
 #formatter.converter = time.gmtime  # if you want UTC time
 fh.setFormatter(formatter)
-logger.addHandler(fh)
 
 ch = logging.StreamHandler()
 ch.setLevel(logging.WARNING)
 formatter = logging.Formatter("%(levelname)s - %(name)s:%(module)s:%(funcName)s:%(lineno)d - %(message)s")
 ch.setFormatter(formatter)
-logger.addHandler(ch)
+
+# Handlers above run in listener thread. Threads that log (serial worker,
+# reader) only put the record into a queue, formatting and disk writes never
+# delay a motor command. Records below INFO are dropped before queueing.
+log_queue = queue.SimpleQueue()
+qh = QueueHandler(log_queue)
+qh.setLevel(min(fh.level, ch.level))
+logger.addHandler(qh)
+listener = QueueListener(log_queue, fh, ch, respect_handler_level=True)
+listener.start()
 
 
 def handle_exception(exc_type, exc_value, exc_traceback):
@@ -40,6 +49,7 @@ sys.excepthook = handle_exception
 @atexit.register
 def goodbye():
     logger.info("-------------------------- END --------------------------")
+    listener.stop()     # writes out whatever is still queued
 
 #raise RuntimeError("Test unhandled")
 #for l in range(100000):
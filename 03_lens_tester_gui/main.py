@@ -12,8 +12,16 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtCore import Qt
 import numpy as np
 import queue
+import threading
 import utils
 import motion
+import discovery
+import grbl_parser
+import grbl_settings
+import tracking
+import trajectory
+import thermal
+import autofocus
 import gui
 
 import logging
@@ -24,24 +32,9 @@ COLOR_GREEN = '#33cc33'
 COLOR_YELLOW = '#E5B500'
 COLOR_RED = '#C0150E'
 SETTINGS_FILE = 'config.yaml'
-
-
-class Status():
-    status = str
-
-    limit_x = bool
-    limit_y = bool
-    limit_z = bool
-    limit_a = bool
-
-    pos_x = float
-    pos_y = float
-    pos_z = float
-    pos_a = float
-
-    block_buffer_avail = int
-    rx_buffer_avail = int
-    
+DISCOVERY_CACHE_FILE = 'discovery_cache.yaml'
+SETTINGS_CACHE_FILE = 'settings_cache.yaml'
+TRACE_FILE = 'motion.trc'
 
 
 if sys.platform == 'win32':
@@ -54,15 +47,22 @@ class VLine(QFrame):
         self.setFrameShape(self.VLine|self.Sunken)
 
 class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
+    portsDiscovered = pyqtSignal(dict)
+
     def __init__(self, parent=None):
         QtWidgets.QMainWindow.__init__(self, parent)
 
         self.current_motion_profile = None
         self.current_motion_filename = None
         self.hw_connected = False
+        self.discovery_running = False
         self.source_filename = ""        
-        self.status = Status()
+        self.status = grbl_parser.Status()
         self.lens_name = None
+        self.controller_settings = {}
+        self.travel_limits = {}
+        self.trajectory = None
+        self.compensator = None
 
         # load settings from json
         self.config = {}
@@ -102,13 +102,22 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
 
         # prepare serial communications
         self.hw = motion.SerialComm()
+        self.discovery = discovery.Discovery(DISCOVERY_CACHE_FILE, self.config["com_baud"])
+        self.portsDiscovered.connect(self.ports_discovered)
         self.thread_serial = QtCore.QThread()
         self.hw.strStatus.connect(self.serStatus)
         #self.hw.serReceive.connect(self.controller_read)
         #self.hw.current_line_feedback.connect(self.current_line_feedback)
         self.hw.strVersion.connect(self.serVersion)
+        self.hw.serSettings.connect(self.serSettings)
+        if self.config.get("metrics_enabled", False):
+            self.hw.enable_metrics(summary_interval=self.config.get("metrics_summary_interval", 60))
+        if self.config.get("trace_enabled", False):
+            self.hw.enable_trace(TRACE_FILE, self.config.get("trace_max_size", 50) * 1024 * 1024)
+        self.hw.set_settings_cache(grbl_settings.SettingsCache(SETTINGS_CACHE_FILE, self.config.get("settings_cache_max_age", 24) * 3600))
         self.hw.strError.connect(self.strError)
         self.hw.serFeedback.connect(self.serFeedback)
+        self.hw.serTlens.connect(self.serTlens)
         self.hw.moveToThread(self.thread_serial)
         self.thread_serial.started.connect(self.hw.serial_worker)
         self.thread_serial.start()
@@ -187,8 +196,7 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         children = self.findChildren(QtWidgets.QPushButton)
         for c in children:
             c.setEnabled(False)
-        self.btn_connect.setEnabled(True)
-        self.btn_com_refresh.setEnabled(True)
+        self.update_enabled_elements()
 
 
         # initialize gcode generator and manual control windows
@@ -202,8 +210,95 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
 
 
 
+    def check_travel(self, preset):
+        # preset "X Y Z A" against max travel from controller settings
+        for axis, value in zip("XYZA", preset):
+            limit = self.travel_limits.get(axis)
+            try:
+                outside = (limit is not None) and (abs(float(value)) > limit)
+            except ValueError:
+                continue
+            if outside:
+                self.strError("Preset " + axis + value + " is outside of max travel " + str(limit))
+                return False
+        return True
+
+    def get_trajectory(self):
+        # generator for current lens, built from its tracking curve (presets
+        # if config has none) on first use and after a preset is set
+        if self.trajectory is None:
+            lens = self.config["lens"][self.lens_name]
+            try:
+                self.trajectory = trajectory.TrajectoryGenerator(tracking.LensTracking.from_config(lens), tracking.tracked_axes(lens))
+            except ValueError as e:
+                LOGGER.warning("No tracking curve for " + str(self.lens_name) + ": " + str(e))
+                return None
+        return self.trajectory
+
+    def get_compensator(self, lens):
+        # focus drift against lens temperature, only lenses with a model in config
+        model = thermal.FocusOffsetModel.from_config(lens)
+        axis = autofocus.focus_axis(lens)
+        if (model is None) or (axis is None):
+            return None
+        return thermal.FocusCompensator(model, axis)
+
+    def compensate_preset(self, preset):
+        # presets are stored at reference temperature, focus goes where it is now
+        c = self.compensator
+        if c is None:
+            return preset
+        i = "XYZA".index(c.axis)
+        if preset[i] == "--":
+            return preset
+        preset = list(preset)
+        preset[i] = "%.3f" % c.target(float(preset[i]))
+        return preset
+
+    def store_preset(self, name, *values):
+        # current focus offset is taken out, see compensate_preset
+        values = list(values)
+        c = self.compensator
+        if c is not None:
+            i = "XYZA".index(c.axis)
+            if values[i] != "--":
+                values[i] = str(round(c.reference(float(values[i])), 3))
+        self.config["lens"][self.lens_name]["preset"][name] = " ".join(values)
+        self.trajectory = None
+        return values
+
+    def send_preset(self, preset, cmd):
+        # Zoom along tracking curve, so focus is kept on the way. Start has to
+        # be known, so only from Idle, otherwise single line as before.
+        # Streaming blends segments, send-and-wait stops shortly after each
+        # one but focus still follows the curve. Axes curves do not track
+        # (iris) go to the preset after the tracked move.
+        lines = None
+        if self.config.get("preset_tracking", False) and self.status.mpos is not None and self.status.state == "Idle":
+            gen = self.get_trajectory()
+            if gen is not None:
+                speed = self.combo_speed.currentText()
+                end = [float("nan") if v == "--" else float(v) for v in preset]
+                try:
+                    lines = list(gen.lines(self.status.mpos, end, speed))
+                except ValueError as e:
+                    LOGGER.warning("Preset move without tracking: " + str(e))
+                function = self.config["lens"][self.lens_name]["motor"]["function"]
+                other = [a + preset[i] for i, a in enumerate("XYZA")
+                         if (i not in gen.axes) and function["axis_" + a.lower()] and (preset[i] != "--")]
+                if lines and other:
+                    lines.append("G90 G1 " + " ".join(other) + " F" + speed)
+        if not lines:
+            lines = [cmd]
+        for line in lines:
+            self.hw.send(line+"\n")
+        if self.compensator is not None:
+            self.compensator.sync()
+
     def push_pr1_go_clicked(self):
-        preset = self.config["lens"][self.lens_name]["preset"]["p1"].split(" ")  
+        preset = self.compensate_preset(self.config["lens"][self.lens_name]["preset"]["p1"].split(" "))
+        if not self.check_travel(preset):
+            return
         cmd =  "G90"
         if self.config["lens"][self.lens_name]["motor"]["function"]["axis_x"]:
             cmd += " X"
@@ -219,10 +314,12 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
             cmd += preset[3]
         cmd += " F"
         cmd += self.combo_speed.currentText()
-        self.hw.send(cmd+"\n")
+        self.send_preset(preset, cmd)
 
     def push_pr2_go_clicked(self):
-        preset = self.config["lens"][self.lens_name]["preset"]["p2"].split(" ")  
+        preset = self.compensate_preset(self.config["lens"][self.lens_name]["preset"]["p2"].split(" "))
+        if not self.check_travel(preset):
+            return
         cmd =  "G90"
         if self.config["lens"][self.lens_name]["motor"]["function"]["axis_x"]:
             cmd += " X"
@@ -238,10 +335,12 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
             cmd += preset[3]
         cmd += " F"
         cmd += self.combo_speed.currentText()
-        self.hw.send(cmd+"\n")
+        self.send_preset(preset, cmd)
 
     def push_pr3_go_clicked(self):
-        preset = self.config["lens"][self.lens_name]["preset"]["p3"].split(" ")  
+        preset = self.compensate_preset(self.config["lens"][self.lens_name]["preset"]["p3"].split(" "))
+        if not self.check_travel(preset):
+            return
         cmd =  "G90"
         if self.config["lens"][self.lens_name]["motor"]["function"]["axis_x"]:
             cmd += " X"
@@ -257,10 +356,12 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
             cmd += preset[3]
         cmd += " F"
         cmd += self.combo_speed.currentText()
-        self.hw.send(cmd+"\n")
+        self.send_preset(preset, cmd)
 
     def push_pr4_go_clicked(self):
-        preset = self.config["lens"][self.lens_name]["preset"]["p4"].split(" ")  
+        preset = self.compensate_preset(self.config["lens"][self.lens_name]["preset"]["p4"].split(" "))
+        if not self.check_travel(preset):
+            return
         cmd =  "G90"
         if self.config["lens"][self.lens_name]["motor"]["function"]["axis_x"]:
             cmd += " X"
@@ -276,10 +377,12 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
             cmd += preset[3]
         cmd += " F"
         cmd += self.combo_speed.currentText()
-        self.hw.send(cmd+"\n")
+        self.send_preset(preset, cmd)
 
     def push_pr5_go_clicked(self):
-        preset = self.config["lens"][self.lens_name]["preset"]["p5"].split(" ")  
+        preset = self.compensate_preset(self.config["lens"][self.lens_name]["preset"]["p5"].split(" "))
+        if not self.check_travel(preset):
+            return
         cmd =  "G90"
         if self.config["lens"][self.lens_name]["motor"]["function"]["axis_x"]:
             cmd += " X"
@@ -295,7 +398,7 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
             cmd += preset[3]
         cmd += " F"
         cmd += self.combo_speed.currentText()
-        self.hw.send(cmd+"\n")
+        self.send_preset(preset, cmd)
 
 
 
@@ -320,7 +423,7 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         else:
             val_a = "--"
 
-        self.config["lens"][self.lens_name]["preset"]["p1"] = val_x+" "+val_y+" "+val_z+" "+val_a
+        val_x, val_y, val_z, val_a = self.store_preset("p1", val_x, val_y, val_z, val_a)
 
         self.label_pr1_x.setText(val_x)
         self.label_pr1_y.setText(val_y)
@@ -349,7 +452,7 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         else:
             val_a = "--"
 
-        self.config["lens"][self.lens_name]["preset"]["p2"] = val_x+" "+val_y+" "+val_z+" "+val_a
+        val_x, val_y, val_z, val_a = self.store_preset("p2", val_x, val_y, val_z, val_a)
 
         self.label_pr2_x.setText(val_x)
         self.label_pr2_y.setText(val_y)
@@ -378,7 +481,7 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         else:
             val_a = "--"
 
-        self.config["lens"][self.lens_name]["preset"]["p3"] = val_x+" "+val_y+" "+val_z+" "+val_a
+        val_x, val_y, val_z, val_a = self.store_preset("p3", val_x, val_y, val_z, val_a)
 
         self.label_pr3_x.setText(val_x)
         self.label_pr3_y.setText(val_y)
@@ -407,7 +510,7 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         else:
             val_a = "--"
 
-        self.config["lens"][self.lens_name]["preset"]["p4"] = val_x+" "+val_y+" "+val_z+" "+val_a
+        val_x, val_y, val_z, val_a = self.store_preset("p4", val_x, val_y, val_z, val_a)
 
         self.label_pr4_x.setText(val_x)
         self.label_pr4_y.setText(val_y)
@@ -436,7 +539,7 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         else:
             val_a = "--"
 
-        self.config["lens"][self.lens_name]["preset"]["p5"] = val_x+" "+val_y+" "+val_z+" "+val_a
+        val_x, val_y, val_z, val_a = self.store_preset("p5", val_x, val_y, val_z, val_a)
 
         self.label_pr5_x.setText(val_x)
         self.label_pr5_y.setText(val_y)
@@ -587,11 +690,22 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
 
 
     def btn_mdi_send_clicked(self):
-        self.hw.send(self.line_mdi.text()+"\n")
+        text = self.line_mdi.text().strip()
+        # realtime commands skip the queue
+        if text in ("!", "~", "?"):
+            self.hw.realtime(bytes(text, 'utf8'))
+        elif text.lower() == "ctrl-x":
+            self.hw.soft_reset()
+        else:
+            self.hw.send(self.line_mdi.text()+"\n")
 
     def btn_connect_clicked(self):
+        if self.discovery_running:
+            return
         self.config["port"] = self.combo_ports.currentText()
-        self.hw.connect(self.config["port"], self.config["com_baud"], self.config["com_timeout"])
+        self.hw.set_poll_interval(self.config["controller_feedback_interval"] / 1000,
+                                  self.config.get("controller_feedback_interval_idle", 500) / 1000)
+        self.hw.connect(self.config["port"], self.config["com_baud"], self.config["com_timeout"], self.config.get("com_streaming", False))
 
     def btn_disconnect_clicked(self):
         self.hw.disconnect()
@@ -603,6 +717,42 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
             self.combo_ports.addItem(port.strip())
         self.combo_ports.setCurrentIndex(self.combo_ports.findText(self.config["port"]))
 
+        if self.config.get("com_discovery", False) and not self.discovery_running:
+            # ask all ports for $I at once, known controllers come from cache.
+            # Runs in background, a slow port must not freeze the window.
+            # Connect waits for it, probe holds the ports open meanwhile.
+            self.discovery_running = True
+            self.update_enabled_elements()
+            ports = [port for port, desc in com_ports]
+            threading.Thread(target=self.discover_ports, args=(ports,), daemon=True).start()
+
+    def discover_ports(self, ports):
+        # discovery thread, result goes to ports_discovered in GUI thread
+        try:
+            found = self.discovery.discover(ports)
+        except Exception as e:
+            LOGGER.error("Port discovery failed " + str(e))
+            found = {}
+        self.portsDiscovered.emit(found)
+
+    def ports_discovered(self, found):
+        self.discovery_running = False
+        self.update_enabled_elements()
+        for i in range(self.combo_ports.count()):
+            info = found.get(self.combo_ports.itemText(i))
+            if info is not None:
+                tip = str(info.lens_model) + " " + str(info.lens_sn) + " / FW " + str(info.firmware)
+                self.combo_ports.setItemData(i, tip, Qt.ToolTipRole)
+
+        # configured port is not a lens, select first port with a known lens
+        if self.hw_connected or (found.get(self.config["port"]) is not None):
+            return
+        for i in range(self.combo_ports.count()):
+            info = found.get(self.combo_ports.itemText(i))
+            if (info is not None) and (info.lens_model in self.config["lens"]):
+                self.combo_ports.setCurrentIndex(i)
+                break
+
     def serStatus(self, text):
         self.s_status.setText(text)
         self.combo_ports.setEnabled(False)
@@ -611,12 +761,14 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         
         if text == "Connected":
             self.hw_connected = True
-            self.hw.action_recipe.put("status1")
-            self.hw.action_recipe.put("version")
-            self.hw.action_recipe.put("get_param_list")
+            self.hw.recipe("status1")
+            self.hw.recipe("version")
+            self.hw.recipe("get_param_list")
             
         if text == "Disconnected":
             self.hw_connected = False
+            self.compensator = None
+            self.hw.set_tlens_interval(0)
 
         self.update_enabled_elements()
 
@@ -634,8 +786,8 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
 
         else:
             self.combo_ports.setEnabled(True)
-            self.btn_connect.setEnabled(True)
-            self.btn_com_refresh.setEnabled(True)
+            self.btn_connect.setEnabled(not self.discovery_running)
+            self.btn_com_refresh.setEnabled(not self.discovery_running)
             self.btn_disconnect.setEnabled(False)
             #self.btn_connect.setStyleSheet("background-color: " + COLOR_GREEN)
 
@@ -654,170 +806,152 @@ class MyWindowClass(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.s_controller_fw.setText(text)
 
         # Expecting: [VER:1.1f-SCE2.20211130:L086,6ZG-BEG19]
-        txt = text.replace('[', '').replace(']', '')
-
-        txt_list = txt.split(':')    
-        id_strings = txt_list[2].split(',')
-
-        for i in id_strings:
-
-            lens_detected = False
-            if i[0:3] == "LS8":
-                self.lens_name = "L085"
-                self.label_lens_name.setText(self.lens_name)
-                lens_detected = True
-
-            if i[0:3] == "6ZG":
-                self.lens_name = "L086"
-                self.label_lens_name.setText(self.lens_name)
-                lens_detected = True
-
-            if i[0:3] == "JWF":
-                self.lens_name = "L084"
-                self.label_lens_name.setText(self.lens_name)
-                lens_detected = True
-
-
-
+        info = discovery.parse_version(text)
+        lens_detected = info.lens_model in self.config["lens"]
+        if lens_detected:
+            self.lens_name = info.lens_model
+            self.trajectory = None
+            self.compensator = self.get_compensator(self.config["lens"][self.lens_name])
+            # $I is sampled only for a lens which has a temperature model
+            if self.compensator is not None:
+                self.hw.set_tlens_interval(self.config.get("tlens_interval", thermal.TLENS_INTERVAL))
+            else:
+                self.hw.set_tlens_interval(0)
+            self.label_lens_name.setText(self.lens_name)
+
+            cmd = self.config["lens"][self.lens_name]["limit_sensor"]["led_on"]
+            self.hw.send(cmd+"\n")
+            cmd = self.config["lens"][self.lens_name]["iris"]["open"]
+            self.hw.send(cmd+"\n")
 
-            if lens_detected:
-                cmd = self.config["lens"][self.lens_name]["limit_sensor"]["led_on"]
-                self.hw.send(cmd+"\n")
-                cmd = self.config["lens"][self.lens_name]["iris"]["open"]
-                self.hw.send(cmd+"\n")
+            self.group_step_size.setEnabled(True)
+            self.combo_step.clear()                
+            default_step = None
+            step_list = self.config["lens"][self.lens_name]["motor"]["step_list"].split(" ")
+            for i in step_list:
+                if "*" in i:
+                    default_step = i.replace("*", "")
+                self.combo_step.addItem(i.replace("*", ""))
+            if default_step:
+                self.combo_step.setCurrentText(default_step)
 
-                self.group_step_size.setEnabled(True)
-                self.combo_step.clear()                
-                default_step = None
-                step_list = self.config["lens"][self.lens_name]["motor"]["step_list"].split(" ")
-                for i in step_list:
-                    if "*" in i:
-                        default_step = i.replace("*", "")
-                    self.combo_step.addItem(i.replace("*", ""))
-                if default_step:
-                    self.combo_step.setCurrentText(default_step)
 
+            self.group_speed.setEnabled(True)
+            self.combo_speed.clear()                
+            default_speed = None
+            speed_list = self.config["lens"][self.lens_name]["motor"]["speed_list"].split(" ")
+            for i in speed_list:
+                if "*" in i:
+                    default_speed = i.replace("*", "")
+                self.combo_speed.addItem(i.replace("*", ""))
+            if default_speed:
+                self.combo_speed.setCurrentText(default_speed)
 
-                self.group_speed.setEnabled(True)
-                self.combo_speed.clear()                
-                default_speed = None
-                speed_list = self.config["lens"][self.lens_name]["motor"]["speed_list"].split(" ")
-                for i in speed_list:
-                    if "*" in i:
-                        default_speed = i.replace("*", "")
-                    self.combo_speed.addItem(i.replace("*", ""))
-                if default_speed:
-                    self.combo_speed.setCurrentText(default_speed)
 
+            self.group_mdi.setEnabled(True)
 
-                self.group_mdi.setEnabled(True)
 
+            if "filter1"  in self.config["lens"][self.lens_name]:
+                self.group_filter1.setEnabled(True)
+                self.group_filter1.setTitle("Filter: "+self.config["lens"][self.lens_name]["filter1"]["name"])
 
-                if "filter1"  in self.config["lens"][self.lens_name]:
-                    self.group_filter1.setEnabled(True)
-                    self.group_filter1.setTitle("Filter: "+self.config["lens"][self.lens_name]["filter1"]["name"])
+            if "filter2"  in self.config["lens"][self.lens_name]:
+                self.group_filter2.setEnabled(True)
+                self.group_filter2.setTitle("Filter: "+self.config["lens"][self.lens_name]["filter2"]["name"])
 
-                if "filter2"  in self.config["lens"][self.lens_name]:
-                    self.group_filter2.setEnabled(True)
-                    self.group_filter2.setTitle("Filter: "+self.config["lens"][self.lens_name]["filter2"]["name"])
 
+            self.group_pi.setEnabled(True)
 
-                self.group_pi.setEnabled(True)
 
+            if "iris"  in self.config["lens"][self.lens_name]:
+                self.group_iris.setEnabled(True)
 
-                if "iris"  in self.config["lens"][self.lens_name]:
-                    self.group_iris.setEnabled(True)
 
+            self.group_p1.setEnabled(True)
+            self.group_p2.setEnabled(True)
+            self.group_p3.setEnabled(True)
+            self.group_p4.setEnabled(True)
+            self.group_p5.setEnabled(True)
 
-                self.group_p1.setEnabled(True)
-                self.group_p2.setEnabled(True)
-                self.group_p3.setEnabled(True)
-                self.group_p4.setEnabled(True)
-                self.group_p5.setEnabled(True)
+            preset = self.config["lens"][self.lens_name]["preset"]["p1"].split(" ")
+            self.label_pr1_x.setText(preset[0])
+            self.label_pr1_y.setText(preset[1])
+            self.label_pr1_z.setText(preset[2])
+            self.label_pr1_a.setText(preset[3])
 
-                preset = self.config["lens"][self.lens_name]["preset"]["p1"].split(" ")
-                self.label_pr1_x.setText(preset[0])
-                self.label_pr1_y.setText(preset[1])
-                self.label_pr1_z.setText(preset[2])
-                self.label_pr1_a.setText(preset[3])
+            preset = self.config["lens"][self.lens_name]["preset"]["p2"].split(" ")
+            self.label_pr2_x.setText(preset[0])
+            self.label_pr2_y.setText(preset[1])
+            self.label_pr2_z.setText(preset[2])
+            self.label_pr2_a.setText(preset[3])
 
-                preset = self.config["lens"][self.lens_name]["preset"]["p2"].split(" ")
-                self.label_pr2_x.setText(preset[0])
-                self.label_pr2_y.setText(preset[1])
-                self.label_pr2_z.setText(preset[2])
-                self.label_pr2_a.setText(preset[3])
+            preset = self.config["lens"][self.lens_name]["preset"]["p3"].split(" ")
+            self.label_pr3_x.setText(preset[0])
+            self.label_pr3_y.setText(preset[1])
+            self.label_pr3_z.setText(preset[2])
+            self.label_pr3_a.setText(preset[3])
 
-                preset = self.config["lens"][self.lens_name]["preset"]["p3"].split(" ")
-                self.label_pr3_x.setText(preset[0])
-                self.label_pr3_y.setText(preset[1])
-                self.label_pr3_z.setText(preset[2])
-                self.label_pr3_a.setText(preset[3])
+            preset = self.config["lens"][self.lens_name]["preset"]["p4"].split(" ")
+            self.label_pr4_x.setText(preset[0])
+            self.label_pr4_y.setText(preset[1])
+            self.label_pr4_z.setText(preset[2])
+            self.label_pr4_a.setText(preset[3])
 
-                preset = self.config["lens"][self.lens_name]["preset"]["p4"].split(" ")
-                self.label_pr4_x.setText(preset[0])
-                self.label_pr4_y.setText(preset[1])
-                self.label_pr4_z.setText(preset[2])
-                self.label_pr4_a.setText(preset[3])
+            preset = self.config["lens"][self.lens_name]["preset"]["p5"].split(" ")
+            self.label_pr5_x.setText(preset[0])
+            self.label_pr5_y.setText(preset[1])
+            self.label_pr5_z.setText(preset[2])
+            self.label_pr5_a.setText(preset[3])
 
-                preset = self.config["lens"][self.lens_name]["preset"]["p5"].split(" ")
-                self.label_pr5_x.setText(preset[0])
-                self.label_pr5_y.setText(preset[1])
-                self.label_pr5_z.setText(preset[2])
-                self.label_pr5_a.setText(preset[3])
 
 
+            if self.config["lens"][self.lens_name]["motor"]["function"]["axis_x"]:
+                self.group_x_axis.setEnabled(True)
+                self.group_x_axis.setTitle("X axis / " + self.config["lens"][self.lens_name]["motor"]["function"]["axis_x"])
 
-                if self.config["lens"][self.lens_name]["motor"]["function"]["axis_x"]:
-                    self.group_x_axis.setEnabled(True)
-                    self.group_x_axis.setTitle("X axis / " + self.config["lens"][self.lens_name]["motor"]["function"]["axis_x"])
+            if self.config["lens"][self.lens_name]["motor"]["function"]["axis_y"]:
+                self.group_y_axis.setEnabled(True)
+                self.group_y_axis.setTitle("Y axis / " + self.config["lens"][self.lens_name]["motor"]["function"]["axis_y"])
 
-                if self.config["lens"][self.lens_name]["motor"]["function"]["axis_y"]:
-                    self.group_y_axis.setEnabled(True)
-                    self.group_y_axis.setTitle("Y axis / " + self.config["lens"][self.lens_name]["motor"]["function"]["axis_y"])
+            if self.config["lens"][self.lens_name]["motor"]["function"]["axis_z"]:
+                self.group_z_axis.setEnabled(True)
+                self.group_z_axis.setTitle("Z axis / " + self.config["lens"][self.lens_name]["motor"]["function"]["axis_z"])
 
-                if self.config["lens"][self.lens_name]["motor"]["function"]["axis_z"]:
-                    self.group_z_axis.setEnabled(True)
-                    self.group_z_axis.setTitle("Z axis / " + self.config["lens"][self.lens_name]["motor"]["function"]["axis_z"])
+            if self.config["lens"][self.lens_name]["motor"]["function"]["axis_a"]:
+                self.group_a_axis.setEnabled(True)
+                self.group_a_axis.setTitle("A axis / " + self.config["lens"][self.lens_name]["motor"]["function"]["axis_a"])
 
-                if self.config["lens"][self.lens_name]["motor"]["function"]["axis_a"]:
-                    self.group_a_axis.setEnabled(True)
-                    self.group_a_axis.setTitle("A axis / " + self.config["lens"][self.lens_name]["motor"]["function"]["axis_a"])
 
+            
 
-                
+    def serSettings(self, settings):
+        self.controller_settings = settings
+        self.travel_limits = grbl_settings.travel_limits(settings)
+        LOGGER.info("Max travel " + str(self.travel_limits))
+
+    def serTlens(self, adc):
+        # background lens temperature reading, focus follows drift while Idle
+        c = self.compensator
+        if c is None:
+            return
+        c.update(adc)
+        delta = round(c.correction(), 3)
+        if (delta == 0) or (self.status.state != "Idle"):
+            return
+        LOGGER.info("TLENS " + str(adc) + ", focus " + c.axis + " offset " + str(round(c.offset, 4)))
+        cmd = "G91 G1 " + c.axis + "%.3f" % delta
+        cmd += " F"
+        cmd += str(self.combo_speed.currentText())
+        self.hw.send(cmd+"\n")
+        # presets and MDI lines expect absolute mode
+        self.hw.send("G90\n")
+        c.apply(delta)
 
     def serFeedback(self, text):
-        txt = text.replace('<', '').replace('>', '')
-        txt_list = txt.split("|")
-        s = Status()
-        s.status = txt_list[0] # allways first element
-
-        for p in txt_list[1:]:
-            if p[0:2] == "Bf":
-                temp1 = p.split(":")[1]
-                s.block_buffer_avail = int(temp1.split(",")[0])
-                s.rx_buffer_avail = int(temp1.split(",")[1])
-
-            s.limit_x = False
-            s.limit_y = False
-            s.limit_z = False
-            s.limit_a = False
-
-            if p[0:2] == "Pn":
-                temp1 = p.split(":")[1]
-                s.limit_x = "X" in temp1
-                s.limit_y = "Y" in temp1
-                s.limit_z = "Z" in temp1
-                s.limit_a = "A" in temp1
-
-            if p[0:4] == "MPos":
-                temp1 = p.split(":")[1]
-                s.pos_x = float(temp1.split(",")[0])
-                s.pos_y = float(temp1.split(",")[1])
-                s.pos_z = float(temp1.split(",")[2])
-                s.pos_a = float(temp1.split(",")[3])
-
-        self.status = s
+        # same record is refilled, keeps WCO/Ov between reports
+        s = grbl_parser.parse_status(text, self.status)
+        if s.mpos is None:
+            return
 
 
         self.label_x_pos.setText(str(round(s.pos_x,3)))
@@ -0,0 +1,163 @@
+import sys
+import asyncio
+import threading
+import grbl_async
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+
+class ControllerManager():
+    # Owns connections to many SCE2 controllers. Each controller is a
+    # grbl_async.GrblClient with its own queue, state and status stream, all
+    # of them serviced by one asyncio event loop running in one background
+    # thread, no matter how many lenses are on the station.
+    #
+    # Methods are called from ordinary (non-asyncio) code and block until
+    # results from every lens are collected:
+    #
+    #   with ControllerManager(["COM20", "COM21"]) as station:
+    #       station.home_all("XYZ")
+    #       station.broadcast("G90 G1 X-8.2 Y-5.1 Z-2.6 F1000")
+    #
+    # Aggregate calls return {port: result}, failed lens has the exception
+    # as its result so one bad controller does not hide results of others.
+
+    def __init__(self, ports=(), baudrate=115200):
+        self.baudrate = baudrate
+        self.clients = {}
+        self.status_listeners = []
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.__run_loop, daemon=True)
+        self.thread.start()
+        for port in ports:
+            self.add(port)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coro, timeout=None):
+        # run coroutine on manager loop and wait for its result
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    # ---------------------------------------------------------------------
+    # connections
+
+    def add(self, port, timeout=None):
+        client = grbl_async.GrblClient(port, self.baudrate)
+        self.run(self.__open(client), timeout)
+        self.clients[port] = client
+        return client
+
+    async def __open(self, client):
+        await client.open()
+        client.tasks.append(asyncio.ensure_future(self.__forward_status(client)))
+
+    async def __forward_status(self, client):
+        async for status in client.status_stream():
+            for callback in list(self.status_listeners):
+                try:
+                    callback(client.port, status)
+                except Exception as e:
+                    LOGGER.error("Status listener error " + str(e))
+
+    def remove(self, port, timeout=None):
+        client = self.clients.pop(port)
+        self.run(client.close(), timeout)
+
+    def close(self, timeout=None):
+        for port in list(self.clients):
+            try:
+                self.remove(port, timeout)
+            except Exception as e:
+                LOGGER.error(str(port) + " close error " + str(e))
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+
+    def add_status_listener(self, callback):
+        # callback(port, status) is called from manager loop thread for every
+        # status report of every lens, must return quickly
+        self.status_listeners.append(callback)
+
+    def remove_status_listener(self, callback):
+        if callback in self.status_listeners:
+            self.status_listeners.remove(callback)
+
+    # ---------------------------------------------------------------------
+    # aggregate API
+
+    def for_each(self, func, ports=None, timeout=None):
+        # func(client) -> coroutine, runs concurrently on selected lenses
+        if ports is None:
+            ports = list(self.clients)
+
+        async def gather():
+            results = await asyncio.gather(*[func(self.clients[p]) for p in ports], return_exceptions=True)
+            return dict(zip(ports, results))
+
+        return self.run(gather(), timeout)
+
+    def send(self, port, line, timeout=None):
+        # single lens, waits until motion caused by line is done
+        async def send(client):
+            return await client.send(line)
+        return self.run(send(self.clients[port]), timeout)
+
+    def broadcast(self, line, wait_done=True, ports=None, timeout=None):
+        # same line to every lens. Presets of lenses of the same model are the
+        # same G-code, different lines per lens go through send_each()
+        return self.send_each({p: line for p in (ports or self.clients)}, wait_done, timeout)
+
+    def send_each(self, lines, wait_done=True, timeout=None):
+        # {port: line or list of lines}, lines of one lens are streamed back to back
+        async def send(client):
+            todo = lines[client.port]
+            if isinstance(todo, str):
+                todo = [todo]
+            cmds = [client.send(line) for line in todo]
+            for c in cmds:
+                if wait_done:
+                    await c
+                else:
+                    await asyncio.wrap_future(c.ack)
+            return "ok"
+
+        return self.for_each(send, list(lines), timeout)
+
+    def query_all(self, line, ports=None, timeout=None):
+        async def query(client):
+            return await client.query(line)
+        return self.for_each(query, ports, timeout)
+
+    def status_all(self, ports=None, timeout=None):
+        async def status(client):
+            return await client.status()
+        return self.for_each(status, ports, timeout)
+
+    def home_all(self, axes="XYZ", together=True, ports=None, timeout=None):
+        # every lens at the same time, see GrblClient.home_all. Returns
+        # {port: {axis: {"unhome": s, "home": s}, "total": s}}
+        async def home(client):
+            return await client.home_all(axes, together)
+        return self.for_each(home, ports, timeout)
+
+    def soft_reset_all(self, ports=None):
+        async def reset(client):
+            client.soft_reset()
+        return self.for_each(reset, ports)
+
+
+if __name__ == "__main__":
+    # python manager.py COM20 COM21 ... - print version and status of every lens
+    with ControllerManager(sys.argv[1:]) as station:
+        for port, ver in station.query_all("$I").items():
+            print(port, ver)
+        for port, status in station.status_all().items():
+            print(port, status)
@@ -0,0 +1,107 @@
+import time
+import collections
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+
+WINDOW = 1000                # samples kept per histogram
+SUMMARY_INTERVAL = 60        # s, 0 - no periodic summary
+PERCENTILES = (50, 95, 99)
+
+# command latencies, seconds:
+#   queue   - send() until line is written to port
+#   ack     - written until ok/error:N
+#   motion  - ok until planner has executed it (motion lines only)
+#   total   - send() until done
+LATENCIES = ("queue", "ack", "motion", "total")
+COUNTERS = ("commands", "errors", "polls", "retries", "bytes_in", "bytes_out")
+
+
+class Histogram():
+    # rolling window of last samples, percentiles computed on request
+
+    def __init__(self, window=WINDOW):
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+
+    def percentile(self, p, ordered=None):
+        if ordered is None:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        i = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[i]
+
+    def snapshot(self):
+        ordered = sorted(self.samples)
+        ret = {"count": self.count}
+        for p in PERCENTILES:
+            ret["p" + str(p)] = self.percentile(p, ordered)
+        ret["max"] = ordered[-1] if ordered else None
+        return ret
+
+
+class Metrics():
+    # Counters and latency histograms of one controller link. SerialComm
+    # keeps metrics=None until enable_metrics() is called, so disabled
+    # instrumentation costs one attribute test per event.
+
+    def __init__(self, window=WINDOW, summary_interval=SUMMARY_INTERVAL, name=""):
+        self.name = name
+        self.window = window
+        self.summary_interval = summary_interval
+        self.reset()
+
+    def reset(self):
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.latencies = {k: Histogram(self.window) for k in LATENCIES}
+        self.started = time.perf_counter()
+        self.summary_ts = self.started
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def command_done(self, cmd):
+        # cmd: streaming.Command with t_enqueue, t_write, t_ack, t_done set
+        self.counters["commands"] += 1
+        if cmd.t_write is not None:
+            self.latencies["queue"].add(cmd.t_write - cmd.t_enqueue)
+            if cmd.t_ack is not None:
+                self.latencies["ack"].add(cmd.t_ack - cmd.t_write)
+        if cmd.motion and (cmd.t_ack is not None):
+            self.latencies["motion"].add(cmd.t_done - cmd.t_ack)
+        self.latencies["total"].add(cmd.t_done - cmd.t_enqueue)
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "elapsed": elapsed,
+            "counters": dict(self.counters),
+            "latencies": {k: h.snapshot() for k, h in self.latencies.items()},
+        }
+
+    def summary(self):
+        s = self.snapshot()
+        c = s["counters"]
+        elapsed = max(s["elapsed"], 1e-9)
+        txt = self.name + " " + str(c["commands"]) + " cmds, " + str(c["errors"]) + " errors, "
+        txt += str(c["polls"]) + " polls, " + str(c["retries"]) + " retries, "
+        txt += str(int(c["bytes_in"] / elapsed)) + " B/s in, " + str(int(c["bytes_out"] / elapsed)) + " B/s out"
+        for name, h in s["latencies"].items():
+            if h["count"]:
+                txt += " | " + name + " " + "/".join(str(round(h["p" + str(p)] * 1000, 1)) for p in PERCENTILES) + " ms"
+        return txt.strip()
+
+    def tick(self):
+        # called from worker loop, logs summary every summary_interval
+        if not self.summary_interval:
+            return
+        now = time.perf_counter()
+        if now - self.summary_ts >= self.summary_interval:
+            self.summary_ts = now
+            LOGGER.info(self.summary())
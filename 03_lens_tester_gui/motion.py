@@ -4,32 +4,118 @@ from PyQt5 import QtCore, QtGui, QtWidgets, uic, QtSvg
 import serial
 import time
 import queue
+import threading
 import serial.tools.list_ports
+import streaming
+import grbl_parser
+import grbl_settings
+import discovery
+import metrics
+import protocol_trace
+import thermal
 
 import logging
 LOGGER = logging.getLogger(__name__)
 LOGGER.info('start')
 
 
-IDLE_TIMEOUT = 0.02
+POLL_INTERVAL = 0.05         # status poll period while motors move, s
+POLL_INTERVAL_IDLE = 0.5     # status poll period while Idle, s
+READ_TIMEOUT = 0.5           # reader thread read timeout, lost status report timeout, s
+STATUS_LOG_INTERVAL = 1.0    # status reports with unchanged state are logged once per interval, s
+BUSY_STATES = ("Run", "Jog", "Home")
+
+# GRBL realtime commands, picked out of serial stream by controller as soon
+# as they arrive, never stored in RX buffer
+RT_STATUS = b"?"
+RT_FEED_HOLD = b"!"
+RT_CYCLE_START = b"~"
+RT_SOFT_RESET = b"\x18"
+RT_JOG_CANCEL = b"\x85"
+RT_FEED_OV_RESET = b"\x90"
+RT_FEED_OV_PLUS_10 = b"\x91"
+RT_FEED_OV_MINUS_10 = b"\x92"
+RT_FEED_OV_PLUS_1 = b"\x93"
+RT_FEED_OV_MINUS_1 = b"\x94"
+RT_RAPID_OV_100 = b"\x95"
+RT_RAPID_OV_50 = b"\x96"
+RT_RAPID_OV_25 = b"\x97"
+
+class StatusLogSampler():
+    # Status reports come at poll rate, up to 100 Hz per lens. Report with a
+    # new state is always logged, the same state only once per interval with
+    # the number of reports skipped in between. interval 0 logs every report.
+
+    def __init__(self, interval=STATUS_LOG_INTERVAL):
+        self.interval = interval
+        self.state = None
+        self.ts = 0
+        self.skipped = 0
+
+    def sample(self, r):
+        # returns text to log or None
+        state = r[1:r.find("|")]
+        now = time.time()
+        if (state == self.state) and (now - self.ts < self.interval):
+            self.skipped += 1
+            return None
+        txt = r
+        if self.skipped:
+            txt += " (+" + str(self.skipped) + " reports)"
+        self.state = state
+        self.ts = now
+        self.skipped = 0
+        return txt
+
 
 class SerialComm(QObject):
     strStatus = pyqtSignal(str)
     strVersion = pyqtSignal(str)
+    serSettings = pyqtSignal(dict)
     serFeedback = pyqtSignal(str)
     serReceive = pyqtSignal(list)
     strError = pyqtSignal(str)
+    serTlens = pyqtSignal(int)
     current_line_feedback = pyqtSignal(str)
 
     log_tx = pyqtSignal(str)
     log_rx = pyqtSignal(str)
     
-    port = None
-    commands = queue.Queue()
-    action_connect = queue.Queue()
-    action_disconnect = queue.Queue()
-    action_recipe = queue.Queue()
-
+    def __init__(self, parent=None):
+        QObject.__init__(self, parent)
+
+        # everything is per instance, several lenses can live in one process
+        self.port = None
+        self.ser = None
+        self.rx_error = None
+        self.use_streaming = False
+        self.counter = streaming.CharacterCounter()
+        self.tracker = streaming.ExecutionTracker()
+        self.lock = threading.Lock()
+        self.tx_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.reset_pending = False
+        self.tx_cmd = None
+        self.poll_ts = 0
+        self.poll_forced = False
+        self.poll_interval = POLL_INTERVAL
+        self.poll_interval_idle = POLL_INTERVAL_IDLE
+        self.polls_pending = 0
+        self.last_status = None
+        self.status_listeners = []
+        self.settings = {}
+        self.settings_cache = None
+        self.settings_entry = None
+        self.version_info = None
+        self.metrics = None
+        self.trace = None
+        self.status_log = StatusLogSampler()
+        self.tlens_interval = 0
+        self.tlens_ts = 0
+        self.commands = queue.Queue()
+        self.action_connect = queue.Queue()
+        self.action_disconnect = queue.Queue()
+        self.action_recipe = queue.Queue()
 
     def get_compot_list(self):
         ports = []
@@ -37,36 +123,199 @@ class SerialComm(QObject):
             ports.append((p.device, p.description))
         return ports
 
-    def connect(self, port, baudrate, seek_timeout):
+    def connect(self, port, baudrate, seek_timeout, streaming=False):
         self.port = port
         self.baudrate = baudrate
+        self.use_streaming = streaming
         self.action_connect.put(True)
         self.seek_timeout = seek_timeout
 
     def disconnect(self):
         self.action_disconnect.put(True)
+        self.wake.set()
 
     def send(self, data):
-        self.commands.put(data)
+        # returns streaming.Command handle, see there how to wait for it
+        cmd = streaming.Command(data)
+        if self.metrics is not None:
+            cmd.t_enqueue = time.perf_counter()
+        if grbl_settings.is_write(data):
+            # cached $$ of this controller is no longer true
+            cache = self.settings_cache
+            if (cache is not None) and (self.version_info is not None):
+                cache.invalidate(self.version_info)
+        self.commands.put(cmd)
+        self.wake.set()
+        return cmd
+
+    def recipe(self, name):
+        self.action_recipe.put(name)
+        self.wake.set()
+
+    def set_poll_interval(self, interval, interval_idle=None):
+        # status is polled every interval seconds while machine is busy and
+        # every interval_idle seconds while it is Idle
+        self.poll_interval = interval
+        if interval_idle is not None:
+            self.poll_interval_idle = interval_idle
+        self.wake.set()
+
+    def set_tlens_interval(self, interval):
+        # lens temperature ($I, serTlens) is read every interval seconds while
+        # machine is Idle and nothing else is queued, 0 stops it
+        self.tlens_interval = interval
+        self.tlens_ts = time.time()
+        self.wake.set()
+
+    def enable_metrics(self, window=metrics.WINDOW, summary_interval=metrics.SUMMARY_INTERVAL):
+        # command latencies and link counters, see metrics.py
+        self.metrics = metrics.Metrics(window, summary_interval, str(self.port))
+
+    def disable_metrics(self):
+        self.metrics = None
+
+    def get_metrics(self):
+        # {"counters": {...}, "latencies": {"ack": {"p50": ..}, ..}} or None
+        m = self.metrics
+        return m.snapshot() if m is not None else None
+
+    def enable_trace(self, path, max_size=protocol_trace.MAX_SIZE, backups=protocol_trace.BACKUPS):
+        # every TX/RX frame into binary trace file, see protocol_trace.py
+        self.disable_trace()
+        self.trace = protocol_trace.TraceRecorder(path, max_size, backups)
+
+    def disable_trace(self):
+        rec = self.trace
+        self.trace = None
+        if rec is not None:
+            rec.close()
+
+    def set_settings_cache(self, cache):
+        # grbl_settings.SettingsCache, known controllers get settings before $$ dump
+        self.settings_cache = cache
+
+    def add_status_listener(self, callback):
+        # callback(status) is called from reader thread with grbl_parser.Status
+        # of every status report, must return quickly
+        self.status_listeners.append(callback)
+
+    def remove_status_listener(self, callback):
+        if callback in self.status_listeners:
+            self.status_listeners.remove(callback)
+
+    # ---------------------------------------------------------------------
+    # Realtime channel. These bytes are written right away from the calling
+    # thread and do not wait behind queued commands, delay is at most one
+    # line write already in progress.
+
+    def realtime(self, data):
+        with self.tx_lock:
+            return self.__realtime(data)
+
+    def __realtime(self, data):
+        ser = self.ser
+        if ser is None:
+            LOGGER.warning("Realtime command while disconnected")
+            return False
+        rec = self.trace
+        if rec is not None:
+            rec.record(protocol_trace.RT, data)
+        ser.write(data)
+        m = self.metrics
+        if m is not None:
+            m.count("bytes_out", len(data))
+        LOGGER.info(">>> " + repr(data))
+        return True
+
+    def feed_hold(self):
+        return self.realtime(RT_FEED_HOLD)
+
+    def cycle_start(self):
+        return self.realtime(RT_CYCLE_START)
+
+    def jog_cancel(self):
+        return self.realtime(RT_JOG_CANCEL)
+
+    def feed_override(self, code=RT_FEED_OV_RESET):
+        return self.realtime(code)
+
+    def rapid_override(self, code=RT_RAPID_OV_100):
+        return self.realtime(code)
+
+    def soft_reset(self):
+        # Controller drops everything it has buffered, so queued lines are
+        # dropped as well. Worker clears rest of the bookkeeping, nothing is
+        # written in between because of tx_lock.
+        with self.tx_lock:
+            self.reset_pending = True
+            while not self.commands.empty():
+                try:
+                    self.commands.get_nowait().cancel()
+                except queue.Empty:
+                    break
+            ret = self.__realtime(RT_SOFT_RESET)
+        self.wake.set()
+        return ret
+
+    def __reset_state(self):
+        with self.tx_lock:
+            self.__cancel_all()
+            with self.lock:
+                self.polls_pending = 0
+            self.reset_pending = False
+        LOGGER.warning("Soft reset")
+
+    def __cancel_all(self):
+        # commands controller will never answer or execute
+        with self.lock:
+            dropped = self.counter.clear() + self.tracker.clear()
+        if self.tx_cmd is not None:
+            dropped.append(self.tx_cmd)
+            self.tx_cmd = None
+        for cmd in dropped:
+            cmd.cancel()
+
+    def __ser_send(self, ser, cmd, monitor=True):
+        data = cmd.line
+        with self.tx_lock:
+            if self.reset_pending:
+                cmd.cancel()
+                return False
+            # line is registered before it is written, reply can't overtake it
+            with self.lock:
+                self.counter.push(data, cmd)
+            rec = self.trace
+            if rec is not None:
+                rec.record(protocol_trace.TX, bytes(data.strip(), 'utf8'))
+            ser.write(bytes(data, 'utf8'))
+        m = self.metrics
+        if m is not None:
+            cmd.t_write = time.perf_counter()
+            if cmd.t_enqueue is None:
+                cmd.t_enqueue = cmd.t_write
+            m.count("bytes_out", len(data))
 
-    def __ser_send(self, ser, data, monitor=True):
-        ser.flushInput()
-        ser.write(bytes(data, 'utf8'))
         self.current_line_feedback.emit(data.strip())
         LOGGER.info(">>> " + data.strip())
         if monitor:
             self.log_tx.emit(data.strip())
-
-    def __ser_read(self, ser, monitor=True):
-        data = ser.readline().decode("utf-8").strip()
-        LOGGER.info("<<< " + str(data))
-        if monitor:
-            self.log_rx.emit(data)
-
-        #if len(data)==0:
-        #    print("read timeout")
-
-        return data
+        return True
+
+    def __ser_poll(self, ser):
+        # "?" is a realtime command, it is not stored in RX buffer and
+        # controller answers with single status report
+        with self.lock:
+            self.polls_pending += 1
+        self.poll_ts = time.time()
+        rec = self.trace
+        with self.tx_lock:
+            if rec is not None:
+                rec.record(protocol_trace.RT, RT_STATUS)
+            ser.write(RT_STATUS)
+        m = self.metrics
+        if m is not None:
+            m.count("polls")
+            m.count("bytes_out", len(RT_STATUS))
 
     '''
     def __parse_status(self, status_string):
@@ -92,234 +341,370 @@ class SerialComm(QObject):
         return -1
     '''
 
+    # ---------------------------------------------------------------------
+    # RX side. Reader thread is the only one reading from the port, it splits
+    # byte stream into lines and routes each line by its type:
+    #   <...>        status report  -> __on_status
+    #   ok, error:N  reply          -> __on_reply (pending line tracker)
+    #   [...]        feedback       -> __on_feedback
+    #   $x=val       setting        -> __on_setting
+    #   ALARM, Grbl  reset / alarm  -> __on_reset
+    # Worker is woken up after every line.
+
+    def serial_reader(self, ser):
+        rx_buffer = b""
+        while self.ser is ser:
+            try:
+                data = ser.read(max(1, ser.in_waiting))
+            except Exception as e:
+                if self.ser is ser:
+                    self.rx_error = e
+                    self.wake.set()
+                break
+
+            if len(data) == 0:
+                continue
+            m = self.metrics
+            if m is not None:
+                m.count("bytes_in", len(data))
+
+            rx_buffer += data
+            while b"\n" in rx_buffer:
+                line, rx_buffer = rx_buffer.split(b"\n", 1)
+                r = line.decode("utf-8", errors="replace").strip()
+                if len(r) == 0:
+                    continue
+                rec = self.trace
+                if rec is not None:
+                    rec.record(protocol_trace.RX, line.strip())
+
+                if (r[0] == "<") and (r[-1] == ">"):
+                    txt = self.status_log.sample(r)
+                    if txt is not None:
+                        LOGGER.info("<<< " + txt)
+                else:
+                    LOGGER.info("<<< " + r)
+                try:
+                    self.__route(r, line)
+                except Exception as e:
+                    LOGGER.error("Line parse error " + r + " " + str(e))
+                self.wake.set()
+
+    def __route(self, r, raw):
+        if (r[0] == "<") and (r[-1] == ">"):
+            self.__on_status(r, raw)
+        elif streaming.is_reply(r):
+            self.__on_reply(r)
+        elif r[0] == "[":
+            self.__on_feedback(r)
+        elif r[0] == "$":
+            self.__on_setting(r)
+        elif r.startswith("ALARM") or r.startswith("Grbl"):
+            self.__on_reset(r)
+        else:
+            LOGGER.warning("Unknown line: " + r)
+
+    def __on_status(self, r, raw):
+        # new record for every report, listeners may keep it
+        status = grbl_parser.parse_status(raw)
+
+        with self.lock:
+            if self.polls_pending > 0:
+                self.polls_pending -= 1
+            finished = self.tracker.update(status.state, status.blocks_free)
+            self.last_status = status
+
+        self.__finish(finished)
+
+        self.serFeedback.emit(r)
+        for callback in list(self.status_listeners):
+            try:
+                callback(status)
+            except Exception as e:
+                LOGGER.error("Status listener error " + str(e))
+
+    def __on_reply(self, r):
+        finished = []
+        with self.lock:
+            f, cmd = self.counter.pop()
+            m = self.metrics
+            if (f is not None) and (m is not None):
+                cmd.t_ack = time.perf_counter()
+                if r != "ok":
+                    m.count("errors")
+            if (f is not None) and cmd.acked(r):
+                finished = self.tracker.add(cmd)
+                if cmd.motion:
+                    # ask for fresh status right away, or as soon as the
+                    # outstanding report is in
+                    self.poll_forced = True
+
+        if f is None:
+            LOGGER.warning("Unexpected reply: " + r)
+            return
+
+        self.__finish(finished)
+
+        self.log_rx.emit(r)
+        self.serReceive.emit([f.strip(), r])
+        if r != "ok":
+            LOGGER.warning(f.strip() + " -> " + r)
+        elif cmd.tag == "get_param_list":
+            with self.lock:
+                settings = dict(self.settings)
+            LOGGER.debug(settings)
+            if (self.settings_cache is not None) and (self.version_info is not None):
+                if self.settings_cache.check(self.settings_entry, settings):
+                    # app got these from cache already
+                    LOGGER.debug("settings cache confirmed")
+                    self.settings_cache.put(self.version_info, settings)
+                    return
+                self.settings_cache.put(self.version_info, settings)
+            self.serSettings.emit(settings)
+
+        elif grbl_settings.is_write(f):
+            # $130=360 accepted, travel limits and others follow at once
+            key, value = grbl_settings.parse_line(f)
+            if key == "$RST":
+                self.action_recipe.put("get_param_list")
+                self.wake.set()
+            else:
+                with self.lock:
+                    self.settings[key] = value
+                    settings = dict(self.settings)
+                self.serSettings.emit(settings)
+
+    def __finish(self, cmds):
+        m = self.metrics
+        for cmd in cmds:
+            cmd.finished()
+            if (m is not None) and (cmd.t_enqueue is not None):
+                cmd.t_done = time.perf_counter()
+                m.command_done(cmd)
+
+    def __on_feedback(self, r):
+        self.log_rx.emit(r)
+
+        if r.startswith("[VER:"):
+            # [VER:1.1f-SCE2.20200405:]
+            self.version_info = discovery.parse_version(r)
+            with self.lock:
+                cmd = self.counter.peek()
+            # background temperature read is not a new controller
+            if (cmd is None) or (cmd.tag != "tlens"):
+                self.strVersion.emit(r)
+
+        elif r.startswith("[TLENS:"):
+            # [TLENS:1743]
+            adc = thermal.parse_tlens(r)
+            if adc is not None:
+                self.serTlens.emit(adc)
+
+        elif r.startswith("[OPT:"):
+            # [OPT:VMZHL,35,254] - use real RX buffer size for character counting
+            opt = r[1:-1].split(",")
+            with self.lock:
+                self.tracker.planner_blocks = int(opt[1])
+                self.counter.rx_buffer_size = int(opt[2])
+
+    def __on_setting(self, r):
+        # $100=1600.000
+        key, _, value = r.partition("=")
+        # recipe resets settings from worker thread
+        with self.lock:
+            self.settings[key] = value
+
+    def __on_reset(self, r):
+        # controller has been reset or locked, everything in RX buffer is lost
+        LOGGER.warning(r)
+        self.log_rx.emit(r)
+        with self.lock:
+            dropped = self.counter.clear() + self.tracker.clear()
+        for cmd in dropped:
+            cmd.cancel()
+
+    # ---------------------------------------------------------------------
+    # TX side, runs in worker thread
+
+    def __stream(self, ser):
+        # keep controller RX buffer (and so planner) full, see streaming.py
+        while True:
+            if self.tx_cmd is None:
+                if self.commands.empty():
+                    break
+                self.tx_cmd = self.commands.get()
+
+            with self.lock:
+                fits = self.counter.fits(self.tx_cmd.line)
+            if not fits:
+                break
+
+            self.__ser_send(ser, self.tx_cmd)
+            self.tx_cmd = None
+
+    def __step(self, ser):
+        # previous mode: send one line, wait for reply, then poll status
+        # until planner is empty and machine is Idle
+        if len(self.counter) or len(self.tracker):
+            return
+
+        if not self.commands.empty():
+            self.__ser_send(ser, self.commands.get())
+
+    def __recipe(self, ser):
+        # some commands require certain sequence and testing, these are put into recipes
+        # process these recipes only when main buffer is consumed
+        if len(self.counter) or len(self.tracker) or (self.tx_cmd is not None):
+            return
+        if self.action_recipe.empty():
+            return
+
+        rec = self.action_recipe.get()
+
+        if rec == "version":
+            LOGGER.debug("version")
+            self.__ser_send(ser, streaming.Command("$I\n", tag=rec))
+
+        if rec == "status1":
+            LOGGER.debug("status")
+            self.poll_forced = True
+
+        if rec == "get_param_list":
+            LOGGER.debug("get param list")
+            with self.lock:
+                self.settings = {}
+            self.settings_entry = None
+            if (self.settings_cache is not None) and (self.version_info is not None):
+                self.settings_entry = self.settings_cache.get(self.version_info)
+            if self.settings_entry is not None:
+                # known controller, app gets its settings before the dump is in
+                LOGGER.debug("settings from cache")
+                self.serSettings.emit(dict(self.settings_entry["settings"]))
+
+            self.__ser_send(ser, streaming.Command("$$\n"))
+            self.__ser_send(ser, streaming.Command("$N\n", tag="get_param_list"))
+
+    def __sample_tlens(self, ser):
+        # $I is not a realtime command and GRBL rejects it while moving, so it
+        # goes only into an idle gap: nothing queued, nothing in flight, Idle
+        if self.tlens_interval <= 0:
+            return
+        now = time.time()
+        if now - self.tlens_ts < self.tlens_interval:
+            return
+        if len(self.counter) or len(self.tracker) or (self.tx_cmd is not None):
+            return
+        if (not self.commands.empty()) or (not self.action_recipe.empty()):
+            return
+        status = self.last_status
+        if (status is None) or (status.state != "Idle"):
+            return
+        self.tlens_ts = now
+        self.__ser_send(ser, streaming.Command("$I\n", tag="tlens"))
+
+    def __poll_period(self):
+        # poll fast while something is moving or expected to move
+        status = self.last_status
+        if len(self.tracker) or len(self.counter) or (self.tx_cmd is not None):
+            return self.poll_interval
+        if (status is not None) and (status.state in BUSY_STATES):
+            return self.poll_interval
+        return self.poll_interval_idle
+
+    def __poll(self, ser):
+        # background status poller, "?" is a realtime command and bypasses
+        # RX buffer. Only one poll is outstanding at a time so link is never
+        # flooded. A poll without report for READ_TIMEOUT is lost, GRBL
+        # also answers two "?" close together with one report.
+        now = time.time()
+        if self.polls_pending > 0:
+            if now - self.poll_ts < READ_TIMEOUT:
+                return READ_TIMEOUT - (now - self.poll_ts)
+            with self.lock:
+                self.polls_pending = 0
+            m = self.metrics
+            if m is not None:
+                m.count("retries")
+        elif not self.poll_forced:
+            next_poll = self.poll_ts + self.__poll_period()
+            if now < next_poll:
+                return next_poll - now
+
+        self.poll_forced = False
+        self.__ser_poll(ser)
+        return self.__poll_period()
+
     @pyqtSlot()
     def serial_worker(self):
 
         while True:
             try:
-                stay_connected = True
-                needs_feedback = False
-                feedback_ts = 0
-
                 self.action_connect.get()  # in general - wait until connect button is pressed
 
                 self.strStatus.emit("Connecting...")
                 ser = serial.Serial()
                 ser.port = str(self.port)
                 ser.baudrate = int(self.baudrate)
-                ser.timeout = 1
+                ser.timeout = READ_TIMEOUT
 
                 res = ser.open()
                 ser.flushInput()
                 ser.flushOutput()
 
+                with self.lock:
+                    self.polls_pending = 0
+                    self.last_status = None
+                self.rx_error = None
+                self.version_info = None
+                m = self.metrics
+                if m is not None:
+                    m.name = str(self.port)
+                self.ser = ser
+                reader = threading.Thread(target=self.serial_reader, args=(ser,), daemon=True)
+                reader.start()
+
                 self.strStatus.emit("Connected")
 
-                while stay_connected:
-                    if not self.action_disconnect.empty():
-                        self.action_disconnect.get()
-                        #self.action_disconnect.clear()
-                        stay_connected = False
-
-                    # read bare command
-                    if not self.commands.empty():
-                        f = self.commands.get()
-
-                        self.__ser_send(ser, f)
-                        # TODO: check command and adjust timeout accordingly
-                        ser.timeout = 10
-                        r = self.__ser_read(ser)
-                        self.serReceive.emit([f.strip(), r.strip()])
-
-                        # this part waits for command to be completed
-                        LOGGER.debug("wait buffer")
-                        while(True):
-
-                            '''
-                            ser.timeout = 0.1
-                            cmd = "?"
-                            self.__ser_send(ser, cmd, monitor=False)
-                            r1 = self.__ser_read(ser, monitor=False)
-                            '''
-
-                            retry_cnt = 0
-                            ret = ""
-                            cmd = "?"
-                            backup_timeout = ser.timeout
-                            ser.timeout = 0.01
-                            r1 = ""
-
-                            while True:
-                                self.__ser_send(ser, cmd, monitor=False)
-                                status = self.__ser_read(ser, monitor=False)
-                                if len(status) > 10:
-                                    if (status[0] == "<") and (status[-1] == ">"):
-                                        r1 = status
-                                        #print(r1)
-                                        break
-
-                                if retry_cnt > 0:
-                                    LOGGER.info("* Retry count:"+str(retry_cnt))
-
-                                retry_cnt += 1
-
-                            ser.timeout = backup_timeout
-
-                            try:
-                                if r1[0] == "<":
-                                        # <Idle|MPos:0.000,0.000,0.000,0.000|Bf:35,254|FS:0,0|Pn:X>
-                                        text = r1[1:-1]
-                                        feedback_split = text.split("|")
-                                        positions = feedback_split[2].split(":")
-                                        positions = positions[1]
-                                        positions = positions.split(",")
-                                        buffers = int(positions[0])
-                                        status = feedback_split[0]
-                                        self.serFeedback.emit(r1)
-
-                                        # GRBL command buffer = 0
-                                        if buffers >= 35:
-                                            if status == "Idle":
-                                                break
-                            except Exception as e:
-                                print("Parse error", e)
-
-                        #LOGGER.debug("ok")
-
-
-                        '''
-                        retry_cnt = 0
-                        ret = ""
-                        cmd = "?"
-                        backup_timeout = ser.timeout
-                        ser.timeout = 0.5
-
-                        while True:
-                            self.__ser_send(ser, cmd, monitor=False)
-                            status = self.__ser_read(ser, monitor=False)
-                            if len(status) > 10:
-                                if (status[0] == "<") and (status[-1] == ">"):
-                                    ret = status
-                                    self.serFeedback.emit(ret)
-                                    break
-
-                            if retry_cnt > 0:
-                                LOGGER.info("* Retry count", retry_cnt)
-                                print("* Retry count", retry_cnt)
-
-                            retry_cnt += 1
-
-                        ser.timeout = backup_timeout
-                        '''
-
-
-                    # some commands require certain sequence and testing, these are put into recipes
-                    # process these recipes only when main buffer is consumed
-                    if True:
-                        if not self.action_recipe.empty():
-                            rec = self.action_recipe.get()
-                            #self.action_recipe.clear()
-
-                            # get_params
-                            # home / ser.timeout
-                            # set_param
-                            # emergency stop
-                            # halt
-                            # jog
-
-                            if rec == "version":
-                                LOGGER.debug("version")
-                                ser.timeout = 2
-                                cmd = "$I"
-                                self.__ser_send(ser, cmd+'\n')
-                                r1 = self.__ser_read(ser)                   # [VER:1.1f-SCE2.20200405:]
-                                r2 = self.__ser_read(ser, monitor=False)    # [OPT:VMZHL,35,254]
-                                r3 = self.__ser_read(ser, monitor=False)    # [VTEMP]
-                                r3 = self.__ser_read(ser, monitor=False)    # ok
-                                self.strVersion.emit(r1)
-
-                            if rec == "status1":
-                                #self.action_recipe.put("status1")
-                                LOGGER.debug("status")
-                                retry_cnt = 0
-                                ret = ""
-                                cmd = "?"
-                                backup_timeout = ser.timeout
-                                ser.timeout = 0.5
-
-                                while True:
-                                    self.__ser_send(ser, cmd, monitor=False)
-                                    status = self.__ser_read(ser, monitor=False)
-                                    if len(status) > 10:
-                                        if (status[0] == "<") and (status[-1] == ">"):
-                                            ret = status
-                                            self.serFeedback.emit(ret)
-                                            break
-
-                                    if retry_cnt > 0:
-                                        LOGGER.info("Retry count " + str(retry_cnt))
-
-                                    retry_cnt += 1
-
-                                ser.timeout = backup_timeout
-
-
-
-                                '''
-                                LOGGER.debug("status")
-                                ser.timeout = 0.5
-                                cmd = "?"
-                                self.__ser_send(ser, cmd, monitor=False)
-                                r1 = self.__ser_read(ser, monitor=False)
-                                if len(r1) > 5:
-                                    self.serFeedback.emit(r1)
-                                '''
-
-
-
-                                '''
-                                retry_cnt = 0
-                                ret = ""
-                                backup_timeout = ser.timeout
-                                ser.timeout = 0.02
-                                if echo:
-                                    print("")
-                                    print("> ?")
-
-                                while True:
-                                    status = send_command(ser, "?", echo=False)
-                                    if len(status) > 10:
-                                        if (status[0] == "<") and (status[-1] == ">"):
-                                            ret = status
-                                            if retry_cnt > 0:
-                                                if echo:
-                                                    print("* Retry count", retry_cnt)            
-                                            break
-                                        retry_cnt+1
-
-                                ser.timeout = backup_timeout
-                                return ret
-                                '''
-
-
-                            if rec == "get_param_list":
-                                LOGGER.debug("get param list")
-                                temp = ser.timeout
-                                ser.timeout = 0.5
-                                cmd = "$$"
-                                self.__ser_send(ser, cmd + '\n')
-                                while True:
-                                    p = self.__ser_read(ser)
-                                    if (len(p) >= 2) and (p.find("ok") == 0):
-                                        break
-                                ser.timeout = temp
-                                # TODO: return parameters to host
-
-                    # count few cycles with no delay
-                    # if delay count > xxx add delay
-                    # if delay count > yyy add put recipe status
-
-                ser.close()
+                try:
+                    while True:
+                        # clear before looking at the queues, event set after this
+                        # point means there is more work and wait() returns at once
+                        self.wake.clear()
+
+                        if not self.action_disconnect.empty():
+                            self.action_disconnect.get()
+                            break
+
+                        if self.rx_error is not None:
+                            raise self.rx_error
+
+                        if self.reset_pending:
+                            self.__reset_state()
+
+                        if self.use_streaming:
+                            self.__stream(ser)
+                        else:
+                            self.__step(ser)
+
+                        self.__recipe(ser)
+                        self.__sample_tlens(ser)
+
+                        m = self.metrics
+                        if m is not None:
+                            m.tick()
+
+                        # sleep until next status poll unless woken up earlier
+                        self.wake.wait(self.__poll(ser))
+                finally:
+                    self.ser = None
+                    try:
+                        ser.cancel_read()
+                    except Exception:
+                        pass
+                    reader.join()
+                    ser.close()
+                    self.__cancel_all()
+
                 self.strStatus.emit("Disconnected")
 
             except Exception as e:
@@ -0,0 +1,307 @@
+import os
+import sys
+import mmap
+import time
+import queue
+import struct
+import bisect
+import datetime
+import threading
+import collections
+import argparse
+
+import streaming
+import grbl_parser
+import grbl_settings
+import discovery
+import metrics
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+
+# Binary protocol trace. File starts with MAGIC, then frames:
+#   <d ts, B direction, H length> payload
+# ts is time.time() of the event, payload is the line without line end (or
+# realtime byte). Sidecar file <name>.idx holds <d ts, Q offset> of the first
+# frame of every INDEX_INTERVAL, so a time range is found without scanning.
+# A trace reaching MAX_SIZE rolls over: <name> -> <name>.1 (and <name>.idx ->
+# <name>.1.idx), .1 -> .2 and so on, the oldest of BACKUPS is deleted.
+MAGIC = b"SCE2TRC1"
+FRAME = struct.Struct("<dBH")
+INDEX = struct.Struct("<dQ")
+INDEX_INTERVAL = 1.0    # s
+MAX_SIZE = 50 * 1024 * 1024     # bytes of one trace file, 0 grows without limit
+BACKUPS = 1             # rolled over files kept
+
+TX = 0          # line written to controller
+RX = 1          # line received
+RT = 2          # realtime byte written (?, !, ~, 0x18, ...)
+DIRECTIONS = {TX: ">>>", RX: "<<<", RT: "RT "}
+
+Frame = collections.namedtuple("Frame", "ts direction data")
+
+
+class TraceRecorder():
+    # Appends frames from any thread, file writes happen in own thread so
+    # serial threads never wait for disk.
+    #
+    #   rec = TraceRecorder("motion.trc")
+    #   rec.record(protocol_trace.TX, b"G90")
+    #   rec.close()
+
+    def __init__(self, path, max_size=MAX_SIZE, backups=BACKUPS):
+        self.path = path
+        self.max_size = max_size
+        self.backups = backups
+        self.queue = queue.SimpleQueue()
+        self.__open()
+        self.thread = threading.Thread(target=self.__writer, daemon=True)
+        self.thread.start()
+
+    def record(self, direction, data, ts=None):
+        self.queue.put((ts if ts is not None else time.time(), direction, data))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.f.close()
+        self.idx.close()
+
+    def __writer(self):
+        while True:
+            item = self.queue.get()
+            while item is not None:
+                self.__write(*item)
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.f.flush()
+            self.idx.flush()
+            if item is None:
+                return
+
+    def __open(self):
+        self.f = open(self.path, "ab")
+        if self.f.tell() == 0:
+            self.f.write(MAGIC)
+        self.idx = open(self.path + ".idx", "ab")
+        self.index_ts = 0
+
+    def __rotate(self):
+        self.f.close()
+        self.idx.close()
+        names = [self.path] + [self.path + "." + str(i) for i in range(1, self.backups + 1)]
+        for name in (names[-1], names[-1] + ".idx"):
+            if os.path.exists(name):
+                os.remove(name)
+        for old, new in reversed(list(zip(names[:-1], names[1:]))):
+            for suffix in ("", ".idx"):
+                if os.path.exists(old + suffix):
+                    os.replace(old + suffix, new + suffix)
+        self.__open()
+
+    def __write(self, ts, direction, data):
+        size = FRAME.size + len(data)
+        if (self.max_size > 0) and (self.f.tell() + size > self.max_size) and (self.f.tell() > len(MAGIC)):
+            try:
+                self.__rotate()
+            except OSError as e:
+                # file open elsewhere (Windows), keep writing where we are
+                LOGGER.warning("Trace rotation failed, size limit off " + str(e))
+                self.max_size = 0
+                if self.f.closed:
+                    self.__open()
+        if ts - self.index_ts >= INDEX_INTERVAL:
+            self.index_ts = ts
+            self.idx.write(INDEX.pack(ts, self.f.tell()))
+        self.f.write(FRAME.pack(ts, direction, len(data)))
+        self.f.write(data)
+
+
+class TraceReader():
+    # Memory maps a trace file, frames(start, end) seeks by time through
+    # the index (rebuilt by scanning when .idx is missing)
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, "rb")
+        self.size = os.path.getsize(path)
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(path + " is not a trace file")
+        self.index_ts, self.index_offset = self.__load_index()
+
+    def close(self):
+        if self.size:
+            self.mm.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __load_index(self):
+        ts = []
+        offset = []
+        idx = self.path + ".idx"
+        if os.path.exists(idx):
+            with open(idx, "rb") as f:
+                data = f.read()
+            data = data[:len(data) - len(data) % INDEX.size]
+            for t, o in INDEX.iter_unpack(data):
+                ts.append(t)
+                offset.append(o)
+        else:
+            last = 0
+            for o, frame in self.__scan(len(MAGIC)):
+                if frame.ts - last >= INDEX_INTERVAL:
+                    last = frame.ts
+                    ts.append(frame.ts)
+                    offset.append(o)
+        return ts, offset
+
+    def __scan(self, offset):
+        mm = self.mm
+        while offset + FRAME.size <= self.size:
+            ts, direction, length = FRAME.unpack_from(mm, offset)
+            end = offset + FRAME.size + length
+            if end > self.size:
+                break   # frame cut by crash or still being written
+            yield offset, Frame(ts, direction, mm[offset + FRAME.size:end])
+            offset = end
+
+    def frames(self, start=None, end=None):
+        offset = len(MAGIC)
+        if (start is not None) and self.index_ts:
+            i = bisect.bisect_right(self.index_ts, start) - 1
+            if i >= 0:
+                offset = self.index_offset[i]
+        for _, frame in self.__scan(offset):
+            if (start is not None) and (frame.ts < start):
+                continue
+            if (end is not None) and (frame.ts > end):
+                break
+            yield frame
+
+    def __iter__(self):
+        return self.frames()
+
+    def time_range(self):
+        first = next(self.frames(), None)
+        if first is None:
+            return None, None
+        start = self.index_ts[-1] if self.index_ts else first.ts
+        last = first
+        for last in self.frames(start):
+            pass
+        return first.ts, last.ts
+
+
+def format_frame(frame):
+    ts = datetime.datetime.fromtimestamp(frame.ts).isoformat(sep=" ", timespec="microseconds")
+    if frame.direction == RT:
+        data = repr(frame.data)
+    else:
+        data = frame.data.decode("utf-8", errors="replace")
+    return ts + " " + DIRECTIONS.get(frame.direction, "?  ") + " " + data
+
+
+def export_text(reader, out, start=None, end=None):
+    n = 0
+    for frame in reader.frames(start, end):
+        out.write(format_frame(frame) + "\n")
+        n += 1
+    return n
+
+
+def replay(frames):
+    # Feeds recorded frames through the same parsers the live link uses.
+    # Yields (frame, kind, value):
+    #   "status"  grbl_parser.Status
+    #   "reply"   (line, reply, latency s) - reply matched to its line
+    #   "version" discovery.LensInfo
+    #   "setting" (key, value)
+    #   "reset"   text
+    counter = streaming.CharacterCounter()
+    for frame in frames:
+        if frame.direction == TX:
+            counter.push(frame.data.decode("utf-8", errors="replace") + "\n", frame.ts)
+            continue
+        if frame.direction != RX or not frame.data:
+            continue
+
+        r = frame.data.decode("utf-8", errors="replace").strip()
+        if streaming.is_status(r):
+            yield frame, "status", grbl_parser.parse_status(frame.data, ts=frame.ts)
+        elif streaming.is_reply(r):
+            line, ts = counter.pop()
+            if line is not None:
+                yield frame, "reply", (line.strip(), r, frame.ts - ts)
+        elif r.startswith("[VER:"):
+            yield frame, "version", discovery.parse_version(r)
+        elif r.startswith("$"):
+            yield frame, "setting", grbl_settings.parse_line(r)
+        elif r.startswith("ALARM") or r.startswith("Grbl"):
+            counter.clear()
+            yield frame, "reset", r
+
+
+def parse_time(txt):
+    # epoch seconds or ISO date "2026-10-18 14:09:28"
+    if txt is None:
+        return None
+    try:
+        return float(txt)
+    except ValueError:
+        return datetime.datetime.fromisoformat(txt).timestamp()
+
+
+if __name__ == "__main__":
+    # python protocol_trace.py export motion.trc [-s START] [-e END] [-o out.txt]
+    # python protocol_trace.py replay motion.trc [-s START] [-e END]
+    parser = argparse.ArgumentParser(description='SCE2 protocol trace tools')
+    parser.add_argument('command', choices=['export', 'replay', 'info'])
+    parser.add_argument('trace', help='Trace file')
+    parser.add_argument('-s', '--start', help='Start time, epoch s or ISO date', default=None)
+    parser.add_argument('-e', '--end', help='End time, epoch s or ISO date', default=None)
+    parser.add_argument('-o', '--out', help='Text output file, default stdout', default=None)
+    args = parser.parse_args()
+
+    start = parse_time(args.start)
+    end = parse_time(args.end)
+    with TraceReader(args.trace) as reader:
+        if args.command == "info":
+            first, last = reader.time_range()
+            print(args.trace, reader.size, "bytes,", len(reader.index_ts), "index entries")
+            if first is not None:
+                print("From", datetime.datetime.fromtimestamp(first), "to", datetime.datetime.fromtimestamp(last))
+
+        elif args.command == "export":
+            out = open(args.out, "w") if args.out else sys.stdout
+            export_text(reader, out, start, end)
+            if args.out:
+                out.close()
+
+        elif args.command == "replay":
+            kinds = collections.Counter()
+            states = collections.Counter()
+            ack = metrics.Histogram(window=None)
+            for frame, kind, value in replay(reader.frames(start, end)):
+                kinds[kind] += 1
+                if kind == "status":
+                    states[value.state] += 1
+                elif kind == "reply":
+                    ack.add(value[2])
+                    if value[1] != "ok":
+                        print(format_frame(frame), "<-", value[0])
+                elif kind in ("version", "reset"):
+                    print(format_frame(frame))
+            print(dict(kinds))
+            print("States:", dict(states))
+            if ack.count:
+                s = ack.snapshot()
+                print("Ack latency ms p50/p95/p99/max:", "/".join(str(round(s[k] * 1000, 2)) for k in ("p50", "p95", "p99", "max")))
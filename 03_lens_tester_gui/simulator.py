@@ -0,0 +1,601 @@
+import os
+import re
+import math
+import time
+import select
+import argparse
+import threading
+import collections
+
+import grbl_settings
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+
+# Virtual SCE2 controller: GRBL 1.1 subset with SCE2 extensions this SDK uses.
+#
+#   sim = Simulator(time_scale=10)      # 10x faster than real time
+#   sim.start()
+#   ser = serial.Serial(sim.path, 115200)
+#   ...
+#   sim.stop()
+#
+# or from command line, prints the pseudo terminal to connect to:
+#   python simulator.py [-s 10] [-l L086.txt] [--link /tmp/ttySCE2]
+#
+# Model:
+#   - 254 byte RX buffer, bytes that do not fit are lost (counted in overflows)
+#   - 35 block planner, trapezoidal moves from $110.. max rate and $120.. accel,
+#     blocks are not blended, each one starts and ends at zero speed
+#   - ok for motion lines as soon as they are planned, for $H, G4 and M113-M120
+#     only after planner is empty and command is done
+#   - $ commands (except $J=) while not Idle -> error:8
+#   - Pn shows axis while it is on negative side of its home flag (position < 0),
+#     $H<axis> seeks to the flag edge, which is machine zero, $H homes X, Y
+#     and Z at the same time
+#   - time_scale: simulated seconds per real second, 0 - moves finish at once
+#
+# POSIX pseudo terminal by default, on Windows pass a port of a virtual
+# null-modem pair (com0com) and connect the SDK to the other end.
+
+RX_BUFFER_SIZE = 254
+PLANNER_BLOCKS = 35
+AXES = "XYZA"
+FIRMWARE = "1.1f-SCE2.20211130"
+BANNER = "Grbl 1.1f ['$' for help]"
+TICK = 0.005            # max real time between planner updates, s
+OUTPUTS = range(113, 121)
+
+DEFAULT_SETTINGS = {
+    "$0": "6", "$1": "255", "$2": "0", "$3": "6", "$4": "1", "$5": "0", "$6": "0",
+    "$10": "19", "$11": "0.010", "$12": "0.002", "$13": "0",
+    "$20": "0", "$21": "0", "$22": "1", "$23": "15",
+    "$24": "1000", "$25": "250", "$26": "50", "$27": "0.50",
+    "$100": "100.000", "$101": "100.000", "$102": "100.000", "$103": "100.000",
+    "$110": "2000.000", "$111": "2000.000", "$112": "2000.000", "$113": "80.000",
+    "$120": "100.000", "$121": "100.000", "$122": "100.000", "$123": "10.000",
+    "$130": "360.000", "$131": "360.000", "$132": "360.000", "$133": "360.000",
+    "$N0": "", "$N1": "",
+    "$I": "L086,6ZG-SIM00,D2R-SIM00",
+}
+
+_WORD = re.compile(r"([A-Z])([-+]?\d*\.?\d*)")
+_COMMENT = re.compile(r"\(.*?\)|;.*")
+
+
+class Block():
+    # one planner entry: move, dwell or homing of one axis
+    __slots__ = ("kind", "start", "target", "distance", "speed", "accel", "duration", "t_start", "feed")
+
+    def __init__(self, kind, start, target, duration, distance=0.0, speed=0.0, accel=0.0, feed=0.0):
+        self.kind = kind
+        self.start = start
+        self.target = target
+        self.duration = duration
+        self.distance = distance
+        self.speed = speed
+        self.accel = accel
+        self.feed = feed
+        self.t_start = None
+
+    def travelled(self, t):
+        # distance along the move t seconds after start, trapezoidal profile
+        d, v, a, T = self.distance, self.speed, self.accel, self.duration
+        if T <= 0 or t >= T:
+            return d
+        if t <= 0:
+            return 0.0
+        ta = min(v / a, T / 2)
+        if t < ta:
+            return 0.5 * a * t * t
+        if t > T - ta:
+            return d - 0.5 * a * (T - t) ** 2
+        return 0.5 * a * ta * ta + v * (t - ta)
+
+    def position(self, t):
+        if self.distance <= 0:
+            return self.target if t >= self.duration else self.start
+        k = self.travelled(t) / self.distance
+        return tuple(s + (e - s) * k for s, e in zip(self.start, self.target))
+
+
+def move_time(distance, speed, accel):
+    # trapezoid (or triangle when top speed is not reached), starts and ends at 0
+    if distance <= 0:
+        return 0.0
+    if distance * accel >= speed * speed:
+        return distance / speed + speed / accel
+    return 2 * math.sqrt(distance / accel)
+
+
+class Simulator():
+
+    def __init__(self, port=None, params=None, time_scale=1.0, baudrate=115200):
+        self.port = port
+        self.baudrate = baudrate
+        self.time_scale = time_scale
+        self.settings = dict(DEFAULT_SETTINGS)
+        if params:
+            self.settings.update(grbl_settings.read_file(params))
+
+        self.path = None
+        self.tlens = 1743           # [TLENS:] ADC reading, tests may change it
+        self.outputs = {m: 0 for m in OUTPUTS}
+        self.overflows = 0
+        self.lines = collections.deque(maxlen=10000)    # last lines received, for tests
+        self.status_reports = 0
+        self.started = collections.deque(maxlen=10000)  # (perf_counter, block kind) as blocks start
+        self.running = False
+        self.thread = None
+        self.fd = None
+        self.ser = None
+        self.lock = threading.Lock()
+        self.reset()
+
+    # ---------------------------------------------------------------------
+    # life cycle
+
+    def start(self):
+        if self.port is None:
+            import pty
+            import tty
+            master, slave = pty.openpty()
+            tty.setraw(master)
+            tty.setraw(slave)
+            self.fd = master
+            self.slave = slave
+            self.path = os.ttyname(slave)
+        else:
+            import serial
+            self.ser = serial.Serial(self.port, self.baudrate, timeout=TICK)
+            self.path = self.port
+        self.running = True
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+        return self.path
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        if self.fd is not None:
+            os.close(self.fd)
+            os.close(self.slave)
+            self.fd = None
+        if self.ser is not None:
+            self.ser.close()
+            self.ser = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def reset(self):
+        # power on / soft reset state, settings survive
+        self.rx = bytearray()
+        self.rx_full = False
+        self.planner = collections.deque()
+        self.position = (0.0, 0.0, 0.0, 0.0)
+        self.planned = self.position        # end of last planned block
+        self.absolute = True
+        self.motion = 0                     # G0 / G1
+        self.feed = None
+        self.state = "Idle"
+        self.hold_ts = None
+        self.waiting = None                 # (reply, action) sent when planner is empty
+        self.clock_real = time.perf_counter()
+        self.clock_sim = 0.0
+
+    # ---------------------------------------------------------------------
+    # simulated time
+
+    def now(self):
+        real = time.perf_counter()
+        if self.time_scale > 0:
+            self.clock_sim += (real - self.clock_real) * self.time_scale
+        self.clock_real = real
+        return self.clock_sim
+
+    def real_time(self, t):
+        # simulated time -> perf_counter()
+        if self.time_scale > 0:
+            return self.clock_real + (t - self.clock_sim) / self.time_scale
+        return self.clock_real
+
+    def duration(self, t):
+        # moves take no time when time_scale is 0
+        return t if self.time_scale > 0 else 0.0
+
+    # ---------------------------------------------------------------------
+    # I/O
+
+    def __read(self, timeout):
+        if self.fd is not None:
+            r, _, _ = select.select([self.fd], [], [], timeout)
+            if r:
+                try:
+                    return os.read(self.fd, 1024)
+                except OSError:
+                    return b""
+            return b""
+        return self.ser.read(max(1, self.ser.in_waiting))
+
+    def write(self, txt):
+        data = bytes(txt + "\r\n", "utf8")
+        if self.fd is not None:
+            os.write(self.fd, data)
+        else:
+            self.ser.write(data)
+
+    def __run(self):
+        while self.running:
+            data = self.__read(self.__timeout())
+            with self.lock:
+                for c in data:
+                    self.__on_byte(c)
+                self.__update()
+                self.__execute_lines()
+
+    def __timeout(self):
+        if not self.planner or self.time_scale <= 0 or self.hold_ts is not None:
+            return TICK
+        b = self.planner[0]
+        if b.t_start is None:
+            return 0
+        left = (b.t_start + b.duration - self.now()) / self.time_scale
+        return max(0, min(TICK, left))
+
+    # ---------------------------------------------------------------------
+    # realtime commands and RX buffer
+
+    def __on_byte(self, c):
+        if c == 0x3F:       # ?
+            self.__update()
+            self.write(self.status_report())
+        elif c == 0x21:     # !
+            if self.state in ("Run", "Jog") and self.hold_ts is None:
+                self.hold_ts = self.now()
+                self.state = "Hold:0"
+        elif c == 0x7E:     # ~
+            if self.hold_ts is not None:
+                paused = self.now() - self.hold_ts
+                if self.planner and self.planner[0].t_start is not None:
+                    self.planner[0].t_start += paused
+                self.hold_ts = None
+                self.state = "Run" if self.planner else "Idle"
+        elif c == 0x18:     # ctrl-x
+            self.reset()
+            self.write("")
+            self.write(BANNER)
+        elif c == 0x85:     # jog cancel
+            if self.state == "Jog":
+                self.__update()
+                self.planner.clear()
+                self.planned = self.position
+                self.state = "Idle"
+        elif 0x90 <= c <= 0x97:
+            pass            # overrides are accepted but not simulated
+        elif len(self.rx) < RX_BUFFER_SIZE:
+            self.rx.append(c)
+        else:
+            # once per burst, a flooding client would flood the log too
+            if not self.rx_full:
+                LOGGER.warning("RX buffer overflow")
+            self.rx_full = True
+            self.overflows += 1
+
+    # ---------------------------------------------------------------------
+    # planner
+
+    def __update(self):
+        now = self.now()
+        if self.hold_ts is not None:
+            now = self.hold_ts
+        while self.planner:
+            b = self.planner[0]
+            if b.t_start is None:
+                b.t_start = now
+                self.started.append((self.real_time(now), b.kind))
+            if now - b.t_start < b.duration:
+                self.position = b.position(now - b.t_start)
+                break
+            self.planner.popleft()
+            self.position = b.target
+            if self.planner:
+                nb = self.planner[0]
+                nb.t_start = b.t_start + b.duration
+                self.started.append((self.real_time(nb.t_start), nb.kind))
+
+        if not self.planner:
+            if self.hold_ts is None:
+                self.state = "Idle"
+            if self.waiting is not None:
+                reply, action = self.waiting
+                self.waiting = None
+                if action is not None:
+                    action()
+                self.write(reply)
+        elif self.hold_ts is None:
+            self.state = {"home": "Home", "jog": "Jog"}.get(self.planner[0].kind, "Run")
+
+    def __plan_move(self, target, rapid, kind="move"):
+        start = self.planned
+        delta = [e - s for s, e in zip(start, target)]
+        distance = math.sqrt(sum(d * d for d in delta))
+        if distance <= 0:
+            return
+        speed = float("inf") if rapid else self.feed / 60
+        accel = float("inf")
+        for i, d in enumerate(delta):
+            if d == 0:
+                continue
+            k = distance / abs(d)
+            speed = min(speed, float(self.settings["$" + str(110 + i)]) / 60 * k)
+            accel = min(accel, float(self.settings["$" + str(120 + i)]) * k)
+        duration = self.duration(move_time(distance, speed, accel))
+        self.planner.append(Block(kind, start, target, duration, distance, speed, accel, speed * 60))
+        self.planned = target
+
+    def __plan_home(self, axes):
+        # one homing cycle, all axes seek at the same time like a GRBL
+        # HOMING_CYCLE with several axes, cycle ends when slowest is done
+        seek = float(self.settings["$25"]) / 60
+        feed = float(self.settings["$24"]) / 60
+        pull_off = float(self.settings["$27"])
+        accel = float(self.settings["$120"])
+        start = self.planned
+        target = list(start)
+        t = 0.0
+        for axis in axes:
+            i = AXES.index(axis)
+            target[i] = 0.0
+            # seek to the flag edge, pull off, locate edge again slowly
+            t = max(t, move_time(abs(start[i]), seek, accel) + 2 * move_time(pull_off, feed, accel))
+        self.planner.append(Block("home", start, tuple(target), self.duration(t)))
+        self.planned = tuple(target)
+
+    # ---------------------------------------------------------------------
+    # line execution
+
+    def __execute_lines(self):
+        while self.waiting is None:
+            i = self.rx.find(b"\n")
+            j = self.rx.find(b"\r")
+            if i < 0 or (0 <= j < i):
+                i = j
+            if i < 0:
+                return
+            line = self.rx[:i].decode("utf8", errors="replace")
+            if not self.__can_execute(line):
+                return
+            del self.rx[:i + 1]
+            self.rx_full = False
+            line = line.strip()
+            if not line:
+                continue        # GRBL ignores empty lines
+            self.lines.append(line)
+            reply = self.execute(line)
+            if reply is not None:
+                self.write(reply)
+
+    def __can_execute(self, line):
+        # motion line waits for a free planner block, RX buffer fills meanwhile
+        if len(self.planner) < PLANNER_BLOCKS:
+            return True
+        return line.strip().startswith("$") and not line.strip().upper().startswith("$J=")
+
+    def execute(self, line):
+        # returns reply, None when reply is sent later
+        try:
+            if line.startswith("$"):
+                return self.__system(line)
+            return self.__gcode(line)
+        except (ValueError, KeyError, IndexError):
+            return "error:2"
+
+    def __system(self, line):
+        cmd = line[1:].upper()
+        if cmd.startswith("J="):
+            return self.__gcode(line[3:], jog=True)
+        if self.state not in ("Idle", "Alarm"):
+            return "error:8"
+
+        if cmd == "$":
+            for key, value in self.settings.items():
+                if key[1:].isdigit():
+                    self.write(key + "=" + value)
+            return "ok"
+        if cmd == "N":
+            for key, value in self.settings.items():
+                if key.startswith("$N"):
+                    self.write(key + "=" + value)
+            return "ok"
+        if cmd == "I":
+            self.write("[VER:" + FIRMWARE + ":" + self.settings["$I"] + "]")
+            self.write("[OPT:VMZHL," + str(PLANNER_BLOCKS) + "," + str(RX_BUFFER_SIZE) + "]")
+            self.write("[TLENS:" + str(int(self.tlens)) + "]")
+            return "ok"
+        if cmd == "X":
+            self.state = "Idle"
+            return "ok"
+        if cmd.startswith("H"):
+            # $H - homing cycle of X, Y, Z together, $H<axis> - one axis
+            axes = cmd[1:] or "XYZ"
+            if (len(cmd) > 2) or any(a not in AXES for a in axes):
+                return "error:3"
+            self.__plan_home(axes)
+            self.waiting = ("ok", None)
+            self.__update()
+            return None
+        if cmd in ("G", "#", "C"):
+            return "ok"
+        if "=" in line:
+            key, _, value = line.partition("=")
+            key = key.strip()
+            if key.upper() == "$I":
+                key = "$I"
+            elif key.upper().startswith("$N"):
+                key = "$N" + key[2:]
+            elif key[1:].isdigit():
+                float(value)
+            else:
+                return "error:3"
+            self.settings[key] = value.strip()
+            return "ok"
+        return "error:3"
+
+    def __gcode(self, line, jog=False):
+        line = _COMMENT.sub("", line.upper()).replace(" ", "")
+        words = _WORD.findall(line)
+        if "".join(l + v for l, v in words) != line:
+            return "error:1"        # something that is not a word
+
+        axes = {}
+        motion = None
+        absolute = self.absolute
+        feed = None
+        dwell = None
+        outputs = []
+        param_p = None
+        for letter, value in words:
+            if letter == "G":
+                g = float(value)
+                if g in (0, 1):
+                    motion = int(g)
+                elif g == 4:
+                    dwell = True
+                elif g == 90:
+                    absolute = True
+                elif g == 91:
+                    absolute = False
+                elif g in (17, 21, 94):
+                    pass
+                else:
+                    return "error:20"
+            elif letter == "M":
+                m = int(float(value))
+                if m not in OUTPUTS:
+                    return "error:20"
+                outputs.append(m)
+            elif letter in AXES:
+                axes[AXES.index(letter)] = float(value)
+            elif letter == "F":
+                feed = float(value)
+            elif letter == "P":
+                param_p = float(value)
+            elif letter == "N":
+                pass
+            else:
+                return "error:20"
+
+        if jog:
+            if feed is None:
+                return "error:22"
+        else:
+            self.absolute = absolute
+            if motion is not None:
+                self.motion = motion
+            if feed is not None:
+                self.feed = feed
+
+        if dwell:
+            if param_p is None:
+                return "error:28"
+            t = self.duration(param_p)
+            self.planner.append(Block("dwell", self.planned, self.planned, t))
+            self.waiting = ("ok", None)
+            self.__update()
+            return None
+
+        if outputs:
+            # M codes wait for planner, like GRBL spindle/coolant commands
+            value = 1 if (param_p or 0) > 0 else 0
+
+            def apply():
+                for m in outputs:
+                    self.outputs[m] = value
+            self.waiting = ("ok", apply)
+            self.__update()
+            return None
+
+        if axes:
+            rapid = (not jog) and self.motion == 0
+            if not rapid and not jog and self.feed is None:
+                return "error:22"
+            target = list(self.planned)
+            for i, v in axes.items():
+                target[i] = v if absolute else target[i] + v
+            saved = self.feed
+            if jog:
+                self.feed = feed
+            self.__plan_move(tuple(target), rapid, "jog" if jog else "move")
+            self.feed = saved
+            self.__update()
+        return "ok"
+
+    # ---------------------------------------------------------------------
+    # status
+
+    def current_position(self):
+        # position right now, not as of last planner update
+        with self.lock:
+            self.__update()
+            return self.position
+
+    def set_position(self, position):
+        # machine position of an Idle controller, e.g. motors left in home sensors
+        with self.lock:
+            self.position = self.planned = tuple(float(p) for p in position)
+
+    def pins(self):
+        return "".join(a for a, p in zip(AXES, self.position) if p < 0)
+
+    def status_report(self):
+        self.status_reports += 1
+        pos = ",".join("%.3f" % p for p in self.position)
+        feed = 0
+        if self.planner and self.state == "Run":
+            feed = int(self.planner[0].feed)
+        txt = "<" + self.state + "|MPos:" + pos
+        txt += "|Bf:" + str(PLANNER_BLOCKS - len(self.planner)) + "," + str(RX_BUFFER_SIZE - len(self.rx))
+        txt += "|FS:" + str(feed) + ",0"
+        pins = self.pins()
+        if pins:
+            txt += "|Pn:" + pins
+        # like GRBL, work offset and overrides only in some reports
+        if self.status_reports % 10 == 1:
+            txt += "|WCO:0.000,0.000,0.000,0.000"
+        elif self.status_reports % 10 == 2:
+            txt += "|Ov:100,100,100"
+        return txt + ">"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Virtual SCE2 controller')
+    parser.add_argument('-l', '--lens', help='Parameter file to load settings from (01_send_parameters/L086.txt)', default=None)
+    parser.add_argument('-s', '--time-scale', help='Simulated seconds per real second, 0 - moves take no time', default=1.0, type=float)
+    parser.add_argument('-p', '--port', help='Serve on this serial port (virtual null-modem pair) instead of a pseudo terminal', default=None)
+    parser.add_argument('--link', help='Symlink to pseudo terminal, for a fixed port name', default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    sim = Simulator(args.port, args.lens, args.time_scale)
+    path = sim.start()
+    if args.link:
+        if os.path.lexists(args.link):
+            os.remove(args.link)
+        os.symlink(path, args.link)
+        path = args.link
+    print("SCE2 simulator on", path, "- Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    sim.stop()
+    if args.link:
+        os.remove(args.link)
@@ -0,0 +1,198 @@
+import asyncio
+import collections
+import concurrent.futures
+import re
+
+
+# GRBL defaults, controller reports real values in [OPT:VMZHL,35,254]
+PLANNER_BLOCKS = 35
+RX_BUFFER_SIZE = 254
+
+
+class CharacterCounter():
+    # Character counting streaming protocol (see GRBL wiki, "Interface" section).
+    # Every line sent to the controller occupies its length in the serial RX
+    # buffer until GRBL answers with ok/error:N. As long as the sum of unanswered
+    # lines fits into the RX buffer, next line can be sent without waiting and
+    # planner never starves. Replies always come in the same order as lines.
+
+    def __init__(self, rx_buffer_size=RX_BUFFER_SIZE):
+        self.rx_buffer_size = rx_buffer_size
+        self.in_flight = collections.deque()
+        self.bytes_in_flight = 0
+
+    def __len__(self):
+        return len(self.in_flight)
+
+    def fits(self, line):
+        size = len(line.encode('utf8'))
+        # a single line longer than whole buffer is still sent when nothing
+        # else is in flight, otherwise it would block the stream forever
+        if not self.in_flight:
+            return True
+        return self.bytes_in_flight + size <= self.rx_buffer_size
+
+    def push(self, line, tag=None):
+        size = len(line.encode('utf8'))
+        self.in_flight.append((line, size, tag))
+        self.bytes_in_flight += size
+
+    def pop(self):
+        # returns (line, tag) of the oldest unanswered line
+        if not self.in_flight:
+            return None, None
+        line, size, tag = self.in_flight.popleft()
+        self.bytes_in_flight -= size
+        return line, tag
+
+    def peek(self):
+        # tag of the oldest unanswered line, feedback lines ([VER:..]) belong to it
+        if not self.in_flight:
+            return None
+        return self.in_flight[0][2]
+
+    def clear(self):
+        # returns tags of dropped lines
+        ret = [tag for line, size, tag in self.in_flight]
+        self.in_flight.clear()
+        self.bytes_in_flight = 0
+        return ret
+
+
+def is_status(line):
+    return (line[0] == "<") and (line[-1] == ">")
+
+
+def is_reply(line):
+    # ok / error:N are the only responses that consume a line from RX buffer
+    return line == "ok" or line.startswith("error")
+
+
+# lines that add a block to the planner: jogging and anything with axis words,
+# except non-motion G codes that take axis words as parameters
+_AXIS_WORD = re.compile(r"[XYZA]\s*[-+.\d]")
+_NON_MOTION = re.compile(r"G(4|10|92|28\.1|30\.1|43\.1)(?![.\d])")
+
+
+def is_motion(line):
+    line = line.upper()
+    if line.startswith("$J="):
+        return True
+    if line.startswith("$") or line.startswith("M"):
+        return False
+    line = re.sub(r"\(.*?\)|;.*", "", line)
+    return bool(_AXIS_WORD.search(line)) and not _NON_MOTION.search(line)
+
+
+class CommandError(Exception):
+    def __init__(self, line, reply):
+        Exception.__init__(self, line.strip() + " -> " + reply)
+        self.line = line
+        self.reply = reply
+
+
+class Command():
+    # Handle for a line sent to controller, has two completion points:
+    #   ack  - controller answered ok (result "ok") or error:N (CommandError)
+    #   done - planner has executed the motion this line caused, for lines
+    #          without motion same as ack
+    # Both are concurrent.futures.Future, so from a thread:
+    #   cmd.wait_ack(timeout), cmd.wait(timeout)
+    # and from asyncio:
+    #   await cmd                       (done)
+    #   await asyncio.wrap_future(cmd.ack)
+
+    def __init__(self, line, tag=None):
+        self.line = line
+        self.tag = tag
+        self.motion = is_motion(line)
+        self.response = []     # [...] and $x=val lines controller sent before ok
+        self.ack = concurrent.futures.Future()
+        self.done = concurrent.futures.Future()
+        # perf_counter() timestamps, filled only when metrics are enabled
+        self.t_enqueue = None
+        self.t_write = None
+        self.t_ack = None
+        self.t_done = None
+
+    def __repr__(self):
+        return "Command(" + repr(self.line.strip()) + ")"
+
+    def __await__(self):
+        return asyncio.wrap_future(self.done).__await__()
+
+    def wait_ack(self, timeout=None):
+        return self.ack.result(timeout)
+
+    def wait(self, timeout=None):
+        return self.done.result(timeout)
+
+    def acked(self, reply):
+        if reply == "ok":
+            self.ack.set_result(reply)
+            return True
+        error = CommandError(self.line, reply)
+        self.ack.set_exception(error)
+        self.done.set_exception(error)
+        return False
+
+    def finished(self):
+        if not self.done.done():
+            self.done.set_result("ok")
+
+    def cancel(self):
+        self.ack.cancel()
+        self.done.cancel()
+
+
+class ExecutionTracker():
+    # GRBL does not report which block it executes, only how many planner
+    # blocks are free (Bf:15,254). Acked lines are executed in order, so
+    # everything except the last (total - free) motion lines is finished.
+    # The newest motion line is finished only when machine is Idle, its block
+    # leaves planner a little before motors stop.
+
+    def __init__(self, planner_blocks=PLANNER_BLOCKS):
+        self.planner_blocks = planner_blocks
+        self.executing = collections.deque()
+
+    def __len__(self):
+        return len(self.executing)
+
+    def add(self, cmd):
+        # returns commands finished right away (non-motion with nothing ahead)
+        self.executing.append(cmd)
+        return self.__collect(0)
+
+    def update(self, state, blocks_free):
+        # returns commands finished according to status report
+        if not self.executing:
+            return []
+        motion = self.__motion_count()
+        if blocks_free is None:
+            queued = 0 if state == "Idle" else motion
+        else:
+            queued = max(0, self.planner_blocks - blocks_free)
+        finished = motion - queued
+        if state != "Idle":
+            finished = min(finished, motion - 1)
+        return self.__collect(finished)
+
+    def clear(self):
+        ret = list(self.executing)
+        self.executing.clear()
+        return ret
+
+    def __motion_count(self):
+        return sum(1 for c in self.executing if c.motion)
+
+    def __collect(self, finished_motion):
+        ret = []
+        while self.executing:
+            c = self.executing[0]
+            if c.motion:
+                if finished_motion <= 0:
+                    break
+                finished_motion -= 1
+            ret.append(self.executing.popleft())
+        return ret
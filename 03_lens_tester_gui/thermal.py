@@ -0,0 +1,153 @@
+import math
+import time
+import numpy as np
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+
+# Focus drift compensation from lens temperature. Controller reports lens
+# temperature sensor as 12 bit ADC reading in $I ([TLENS:1743]). SerialComm
+# samples it now and then while Idle, readings are filtered here and turned
+# into a focus offset by a per lens model fitted on calibration data:
+#
+#   lens:
+#     L086:
+#       temperature_compensation:
+#         reference: 1743           # reading presets and tracking were taken at
+#         poly: [1.2e-6, -3.1e-4]   # np.polyval coefficients, counts from reference -> mm
+#       or
+#         table: [[1600, -0.04], [1743, 0.0], [1900, 0.05]]   # reading, offset mm
+#
+# Model works on raw ADC counts, no sensor curve is needed to calibrate it.
+
+ADC_MAX = 4096
+VREF = 3.3
+TLENS_INTERVAL = 60         # s between background $I samples
+FILTER_TIME = 300           # s, time constant of temperature estimate
+OUTLIER = 40                # counts, a single reading this far from estimate waits for confirmation
+DRIFT_THRESHOLD = 0.005     # mm, focus is moved again when offset changed more
+
+
+def parse_tlens(line):
+    # "[TLENS:1743]" -> 1743, None for other lines
+    if not line.startswith("[TLENS:"):
+        return None
+    try:
+        return int(line[1:-1].split(":")[1].strip())
+    except (IndexError, ValueError):
+        return None
+
+
+def adc_to_volts(adc):
+    return adc / ADC_MAX * VREF
+
+
+class TemperatureFilter():
+    # Exponential average over time, samples come at uneven intervals. A
+    # reading far from estimate (glitch) is taken only if the next one agrees.
+
+    def __init__(self, time_constant=FILTER_TIME, outlier=OUTLIER):
+        self.time_constant = time_constant
+        self.outlier = outlier
+        self.value = None
+        self.ts = None
+        self.suspect = None
+
+    def update(self, adc, ts=None):
+        ts = time.time() if ts is None else ts
+        if self.value is None:
+            self.value, self.ts = float(adc), ts
+            return self.value
+
+        if abs(adc - self.value) > self.outlier:
+            if (self.suspect is None) or abs(adc - self.suspect) > self.outlier:
+                self.suspect = adc
+                return self.value
+            # confirmed step, e.g. lens moved from shade to sun
+            self.value = float(adc)
+            self.ts = ts
+            self.suspect = None
+            return self.value
+        self.suspect = None
+
+        alpha = 1 - math.exp(-max(ts - self.ts, 0) / self.time_constant)
+        self.value += alpha * (adc - self.value)
+        self.ts = ts
+        return self.value
+
+
+class FocusOffsetModel():
+    # focus offset, mm, against TLENS reading, 0 at reference reading
+
+    def __init__(self, poly=None, table=None, reference=0):
+        if (poly is None) == (table is None):
+            raise ValueError("Temperature model needs either poly or table")
+        self.reference = reference
+        self.poly = None if poly is None else np.asarray(poly, dtype=float)
+        self.table = None if table is None else np.asarray(sorted(table), dtype=float)
+
+    @classmethod
+    def fit(cls, adc, offsets, degree=2, reference=None):
+        # calibration: focus offsets (autofocus result - preset) at readings
+        adc = np.asarray(adc, dtype=float)
+        if reference is None:
+            reference = float(np.median(adc))
+        coefficients = np.polyfit(adc - reference, np.asarray(offsets, dtype=float), degree)
+        # offset at reference is 0 by definition, presets were taken there
+        coefficients[-1] = 0.0
+        return cls(poly=coefficients, reference=reference)
+
+    @classmethod
+    def from_config(cls, lens):
+        # lens: config["lens"][name], None when lens has no model
+        cfg = lens.get("temperature_compensation")
+        if not cfg:
+            return None
+        return cls(cfg.get("poly"), cfg.get("table"), cfg.get("reference", 0))
+
+    def offset(self, adc):
+        # works on arrays too
+        if self.poly is not None:
+            return np.polyval(self.poly, np.asarray(adc, dtype=float) - self.reference)
+        ref = np.interp(self.reference, self.table[:, 0], self.table[:, 1]) if self.reference else 0.0
+        return np.interp(adc, self.table[:, 0], self.table[:, 1]) - ref
+
+
+class FocusCompensator():
+    # Offset to add to every focus target, and how much focus has to move
+    # now because offset drifted away from the one applied last time.
+
+    def __init__(self, model, axis, threshold=DRIFT_THRESHOLD, temperature_filter=None):
+        self.model = model
+        self.axis = axis
+        self.threshold = threshold
+        self.filter = temperature_filter or TemperatureFilter()
+        self.applied = 0.0      # offset focus position includes now
+        self.offset = 0.0       # offset for current temperature estimate
+
+    def update(self, adc, ts=None):
+        estimate = self.filter.update(adc, ts)
+        self.offset = float(self.model.offset(estimate))
+        return estimate
+
+    def target(self, z):
+        # focus target at reference temperature -> where focus should go now
+        return z + self.offset
+
+    def reference(self, z):
+        # focus position now -> same position at reference temperature
+        return z - self.applied
+
+    def correction(self):
+        # relative focus move due, 0.0 while drift is below threshold
+        delta = self.offset - self.applied
+        return delta if abs(delta) >= self.threshold else 0.0
+
+    def apply(self, delta):
+        # relative focus move of delta has been sent
+        self.applied += delta
+
+    def sync(self):
+        # focus has been sent to target(), it includes current offset
+        self.applied = self.offset
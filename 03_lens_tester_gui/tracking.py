@@ -0,0 +1,193 @@
+import math
+import numpy as np
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+
+# Zoom/focus tracking curves. A curve is a list of positions of all axes
+# ("X Y Z A", like presets) measured with the image in focus at one object
+# distance. Positions between the measured points are interpolated along the
+# main zoom axis, linearly or with monotone cubic (PCHIP, no overshoot
+# between points, so a motor never goes past the range that was measured).
+#
+# Interpolation is done once into a dense table with even zoom spacing, a
+# lookup is then an index computation and one linear blend of two table
+# rows, for a single target or an array of them:
+#
+#   t = tracking.LensTracking.from_config(config["lens"]["L086"])
+#   t.target(-2.0)                      # array([-2.0, y, z, nan])
+#   t.targets(np.linspace(-9, 11, 500)) # (500, 4)
+#
+# Axes the lens does not use ("--") are nan.
+
+AXES = "XYZA"
+SAMPLES = 2048          # dense table rows per curve
+METHODS = ("linear", "pchip")
+INFINITY = math.inf     # object distance of presets, mm
+TRACKED = ("Zoom", "Focus")     # motor functions curves move, not iris
+
+
+def tracked_axes(lens):
+    # lens: config["lens"][name] -> "XYZ", axes a tracked move writes
+    function = lens["motor"]["function"]
+    return "".join(a for a in AXES if str(function.get("axis_" + a.lower()) or "").startswith(TRACKED))
+
+
+def parse_points(lines):
+    # ["-9.37 -4.8 -2.8 --", ...] -> (n, 4) array, "--" -> nan
+    ret = []
+    for line in lines:
+        ret.append([math.nan if v == "--" else float(v) for v in line.split()])
+    return np.array(ret, dtype=float)
+
+
+def pchip_slopes(x, y):
+    # Fritsch-Carlson derivatives at points, y: (n, m), every column at once
+    h = np.diff(x)[:, None]
+    delta = np.diff(y, axis=0) / h
+    n = len(x)
+    d = np.zeros_like(y)
+    if n == 2:
+        d[:] = delta[0]
+        return d
+
+    # interior: weighted harmonic mean where slopes have same sign, else flat
+    w1 = 2 * h[1:] + h[:-1]
+    w2 = h[1:] + 2 * h[:-1]
+    same = (delta[:-1] * delta[1:]) > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hm = (w1 + w2) / (w1 / delta[:-1] + w2 / delta[1:])
+    d[1:-1] = np.where(same, hm, 0.0)
+
+    # ends: three point formula, kept shape preserving
+    for i, j, k in ((0, 0, 1), (-1, -1, -2)):
+        h0, h1 = h[j], h[k]
+        e = ((2 * h0 + h1) * delta[j] - h0 * delta[k]) / (h0 + h1)
+        e = np.where(np.sign(e) != np.sign(delta[j]), 0.0, e)
+        e = np.where((np.sign(delta[j]) != np.sign(delta[k])) & (np.abs(e) > 3 * np.abs(delta[j])), 3 * delta[j], e)
+        d[i] = e
+    return d
+
+
+def pchip(x, y, xi):
+    # monotone cubic Hermite interpolation of y(x) at xi, y: (n, m)
+    d = pchip_slopes(x, y)
+    i = np.clip(np.searchsorted(x, xi, side="right") - 1, 0, len(x) - 2)
+    h = (x[i + 1] - x[i])[:, None]
+    t = ((xi - x[i]) / (x[i + 1] - x[i]))[:, None]
+    t2 = t * t
+    t3 = t2 * t
+    return ((2 * t3 - 3 * t2 + 1) * y[i] + (t3 - 2 * t2 + t) * h * d[i] +
+            (-2 * t3 + 3 * t2) * y[i + 1] + (t3 - t2) * h * d[i + 1])
+
+
+class TrackingCurve():
+    # positions of all axes against the zoom axis at one object distance
+
+    def __init__(self, points, zoom_axis=0, method="pchip", samples=SAMPLES):
+        if method not in METHODS:
+            raise ValueError("Unknown interpolation " + str(method) + ", one of " + ", ".join(METHODS))
+        points = np.asarray(points, dtype=float)
+        points = points[np.argsort(points[:, zoom_axis])]
+        zoom = points[:, zoom_axis]
+        if len(zoom) < 2:
+            raise ValueError("Tracking curve needs at least two points")
+        if np.any(np.diff(zoom) <= 0):
+            raise ValueError("Tracking curve has two points with the same zoom position")
+
+        self.points = points
+        self.zoom_axis = zoom_axis
+        self.method = method
+        self.zoom_min = zoom[0]
+        self.zoom_max = zoom[-1]
+        self.step = (self.zoom_max - self.zoom_min) / (samples - 1)
+
+        grid = np.linspace(self.zoom_min, self.zoom_max, samples)
+        if method == "pchip":
+            table = pchip(zoom, points, grid)
+        else:
+            table = np.column_stack([np.interp(grid, zoom, points[:, a]) for a in range(points.shape[1])])
+        table[:, zoom_axis] = grid
+        # one spare row, so index of zoom_max can blend with the row after it
+        self.table = np.vstack([table, table[-1:]])
+
+    def targets(self, zoom):
+        # array of zoom positions -> (n, axes), clamped to measured range
+        zoom = np.clip(np.asarray(zoom, dtype=float), self.zoom_min, self.zoom_max)
+        f = (zoom - self.zoom_min) / self.step
+        i = f.astype(np.intp)
+        f = (f - i)[..., None]
+        return self.table[i] * (1 - f) + self.table[i + 1] * f
+
+    def target(self, zoom):
+        # single zoom position, same as targets() without the array overhead
+        zoom = min(max(float(zoom), self.zoom_min), self.zoom_max)
+        f = (zoom - self.zoom_min) / self.step
+        i = int(f)
+        f -= i
+        return self.table[i] * (1 - f) + self.table[i + 1] * f
+
+
+class LensTracking():
+    # tracking curves of one lens for several object distances, targets
+    # between them are blended linearly in diopters (1/distance)
+
+    def __init__(self, curves, zoom_axis=0, method="pchip", samples=SAMPLES):
+        # curves: {object distance mm (math.inf allowed): points}
+        if not curves:
+            raise ValueError("No tracking curves")
+        self.zoom_axis = zoom_axis
+        self.method = method
+        items = sorted(curves.items(), key=lambda kv: 1 / kv[0])
+        self.distances = [d for d, p in items]
+        self.diopters = np.array([1 / d for d in self.distances])
+        self.curves = [TrackingCurve(p, zoom_axis, method, samples) for d, p in items]
+        self.zoom_min = max(c.zoom_min for c in self.curves)
+        self.zoom_max = min(c.zoom_max for c in self.curves)
+
+    @classmethod
+    def from_config(cls, lens, method="pchip", samples=SAMPLES):
+        # lens: config["lens"][name]. Curves from optional
+        #   tracking: {distance mm or inf: ["X Y Z A", ...]}
+        # otherwise presets p1..p5 are the curve at infinity
+        function = lens["motor"]["function"]
+        zoom_axes = [a for a in AXES if str(function.get("axis_" + a.lower()) or "").startswith("Zoom")]
+        if not zoom_axes:
+            raise ValueError("Lens has no zoom axis")
+        zoom_axis = AXES.index(sorted(zoom_axes, key=lambda a: function["axis_" + a.lower()])[0])
+
+        curves = {}
+        for distance, lines in (lens.get("tracking") or {}).items():
+            curves[float(distance)] = parse_points(lines)
+        if not curves:
+            curves[INFINITY] = parse_points(lens["preset"][k] for k in sorted(lens["preset"]))
+        return cls(curves, zoom_axis, method, samples)
+
+    def __blend(self, distance):
+        # (curve index, next curve index, weight of next)
+        if len(self.curves) == 1:
+            return 0, 0, 0.0
+        dpt = 1 / distance
+        if dpt <= self.diopters[0]:
+            return 0, 0, 0.0
+        if dpt >= self.diopters[-1]:
+            n = len(self.curves) - 1
+            return n, n, 0.0
+        j = int(np.searchsorted(self.diopters, dpt))
+        w = (dpt - self.diopters[j - 1]) / (self.diopters[j] - self.diopters[j - 1])
+        return j - 1, j, w
+
+    def target(self, zoom, distance=INFINITY):
+        # zoom axis position -> positions of all axes, np.array of 4
+        i, j, w = self.__blend(distance)
+        if w == 0:
+            return self.curves[i].target(zoom)
+        return self.curves[i].target(zoom) * (1 - w) + self.curves[j].target(zoom) * w
+
+    def targets(self, zoom, distance=INFINITY):
+        # array of zoom positions -> (n, 4) in one call
+        i, j, w = self.__blend(distance)
+        if w == 0:
+            return self.curves[i].targets(zoom)
+        return self.curves[i].targets(zoom) * (1 - w) + self.curves[j].targets(zoom) * w
@@ -0,0 +1,142 @@
+import collections
+import numpy as np
+
+import tracking
+
+import logging
+LOGGER = logging.getLogger(__name__)
+
+
+# Zoom moves along the tracking curve. A single G1 from one preset to another
+# is a straight line in motor space and image goes out of focus on the way,
+# here the move is cut into G1 segments that follow tracking.LensTracking:
+#
+#   gen = trajectory.TrajectoryGenerator(lens_tracking, "XYZ")
+#   for line in gen.lines(current_position, preset, 1000):
+#       hw.send(line + "\n")
+#
+# Segments are found by Douglas-Peucker on a dense sample of the path, so
+# they are short where the curve bends and long where it is straight, and no
+# point of the curve is further than tolerance from the segments. Lines are
+# streamed back to back, GRBL planner blends them (junction deviation $11)
+# into one move without stops. Results are cached per (start, end, speed).
+
+TOLERANCE = 0.01        # max distance of segments from curve, mm
+SAMPLES = 256           # path samples segments are picked from
+MAX_SEGMENTS = 64       # tolerance is relaxed until path fits, keeps long moves short
+CACHE_SIZE = 64
+DECIMALS = 3            # GRBL position resolution in reports
+
+
+def chord_distance(points, a, b):
+    # distance of points from segment a-b
+    d = b - a
+    dd = np.dot(d, d)
+    if dd == 0:
+        return np.linalg.norm(points - a, axis=1)
+    t = np.clip((points - a) @ d / dd, 0, 1)
+    return np.linalg.norm(points - (a + t[:, None] * d), axis=1)
+
+
+def simplify(points, tolerance):
+    # Douglas-Peucker, indices of points kept, first and last always
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        dist = chord_distance(points[i + 1:j], points[i], points[j])
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+    return np.flatnonzero(keep)
+
+
+class TrajectoryGenerator():
+
+    def __init__(self, lens_tracking, axes="XYZA", tolerance=TOLERANCE, max_segments=MAX_SEGMENTS,
+                 cache_size=CACHE_SIZE, distance=tracking.INFINITY):
+        # axes: the ones lens uses, others are never written to G-code
+        self.tracking = lens_tracking
+        self.axes = [tracking.AXES.index(a) for a in axes]
+        self.tolerance = tolerance
+        self.max_segments = max_segments
+        self.distance = distance
+        self.cache = collections.OrderedDict()
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, start, end, samples=SAMPLES):
+        # (samples, 4) along tracking curve from start to end. Start and end
+        # need not be on the curve, the difference is spread linearly along
+        # the move so path begins and ends exactly there.
+        start = np.asarray(start, dtype=float)
+        end = np.asarray(end, dtype=float)
+        z = self.tracking.zoom_axis
+        s = np.linspace(0, 1, samples)[:, None]
+        curve = self.tracking.targets(start[z] + (end[z] - start[z]) * s[:, 0], self.distance)
+        off_start = start - self.tracking.target(start[z], self.distance)
+        off_end = end - self.tracking.target(end[z], self.distance)
+        return curve + (1 - s) * off_start + s * off_end
+
+    def waypoints(self, start, end):
+        # path points segments end at, start excluded
+        start = np.asarray(start, dtype=float)
+        end = np.asarray(end, dtype=float)
+        z = self.tracking.zoom_axis
+        if start[z] == end[z]:
+            return end[None, :]         # zoom does not move, nothing to track
+
+        points = self.path(start, end)[:, self.axes]
+        tolerance = self.tolerance
+        while True:
+            keep = simplify(points, tolerance)
+            if len(keep) - 1 <= self.max_segments:
+                break
+            tolerance *= 2
+        if tolerance != self.tolerance:
+            LOGGER.debug("Path needs tolerance " + str(tolerance) + " mm for " + str(self.max_segments) + " segments")
+
+        ret = np.tile(end, (len(keep) - 1, 1))
+        ret[:, self.axes] = points[keep[1:]]
+        return ret
+
+    def lines(self, start, end, speed):
+        # G-code lines of the move, cached. start: current position, end:
+        # target, unused axes may be nan. speed: F, mm/min
+        key = (tuple(round(float(start[a]), DECIMALS) for a in self.axes),
+               tuple(round(float(end[a]), DECIMALS) for a in self.axes), float(speed))
+        ret = self.cache.get(key)
+        if ret is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return ret
+        self.misses += 1
+
+        start = np.asarray(start, dtype=float).copy()
+        end = np.asarray(end, dtype=float).copy()
+        if np.isnan(start[self.axes]).any() or np.isnan(end[self.axes]).any():
+            raise ValueError("Position of a used axis is not known")
+        for a in range(len(tracking.AXES)):
+            if a not in self.axes:
+                start[a] = end[a] = 0.0
+        ret = []
+        last = None
+        for p in self.waypoints(start, end):
+            words = tuple(tracking.AXES[a] + ("%." + str(DECIMALS) + "f") % p[a] for a in self.axes)
+            if words == last:
+                continue
+            last = words
+            ret.append(" ".join(words))
+        ret = tuple(("G90 G1 " if i == 0 else "G1 ") + line + (" F" + str(speed) if i == 0 else "") for i, line in enumerate(ret))
+
+        self.cache[key] = ret
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return ret